@@ -0,0 +1,94 @@
+"""Deterministic action logs: record only what each side chose, replay by re-simulating.
+
+In deterministic mode a game is fully decided by its starting states, its seed and the
+actions chosen every tick, so that is all we need to store. Each tick's actions are a
+bitmask over the side's OUTPUT_MAP, and identical consecutive ticks are run length
+encoded as [tarnished mask, margit mask, ticks].
+"""
+import random
+
+LOG_VERSION = 1
+
+
+def game_seed(base_seed: int, *parts) -> int:
+    """Seed for one game, derived so the same game always gets the same seed on any machine.
+
+    Args:
+        base_seed (int): --seed
+        parts: Whatever else picks out the game, like both networks' digests
+    """
+    # Seeding with a str hashes it with sha512, which doesn't change between runs like hash() does
+    return random.Random("-".join(str(part) for part in (base_seed, *parts))).getrandbits(32)
+
+
+def actions_to_mask(actions, bits: dict) -> int:
+    mask = 0
+    for action in actions:
+        mask |= bits[action]
+    return mask
+
+
+def mask_to_actions(mask: int, output_map: list) -> list:
+    """Actions set in the mask, in output map order, which is the order the networks produce them in.
+    """
+    return [action for i, action in enumerate(output_map) if mask >> i & 1]
+
+
+class ActionLogRecorder:
+    """Builds up the action log of one game.
+
+    Args:
+        seed (int): Seed the game was played with
+        tarnished_map (list): TARNISHED_OUTPUT_MAP
+        margit_map (list): MARGIT_OUTPUT_MAP
+    """
+
+    def __init__(self, seed: int, tarnished_map: list, margit_map: list):
+        self.seed = seed
+        self.tarnished_bits = {action: 1 << i for i, action in enumerate(tarnished_map)}
+        self.margit_bits = {action: 1 << i for i, action in enumerate(margit_map)}
+        self.initial = None
+        self.ticks = 0
+        self.runs = []
+
+    def set_initial(self, tarnished_state: dict, margit_state: dict):
+        """Starting states of both entities, as get_state() gives them.
+        """
+        self.initial = {"tarnished": tarnished_state, "margit": margit_state}
+
+    def append(self, tarnished_actions, margit_actions):
+        """Log the actions both sides chose this tick.
+        """
+        self.append_masks(actions_to_mask(tarnished_actions, self.tarnished_bits),
+                          actions_to_mask(margit_actions, self.margit_bits))
+
+    def append_masks(self, tarn: int, marg: int):
+        """Log this tick's actions, already as bitmasks over the output maps (see action_mask.py).
+        """
+        self.ticks += 1
+        if self.runs and self.runs[-1][0] == tarn and self.runs[-1][1] == marg:
+            self.runs[-1][2] += 1
+        else:
+            self.runs.append([tarn, marg, 1])
+
+    def to_dict(self) -> dict:
+        return {
+            "version": LOG_VERSION,
+            "seed": self.seed,
+            "initial": self.initial,
+            "ticks": self.ticks,
+            "runs": self.runs,
+        }
+
+
+def iter_actions(action_log: dict, tarnished_map: list, margit_map: list):
+    """Yield every tick's (tarnished actions, margit actions) from a recorded log.
+    """
+    if action_log["version"] > LOG_VERSION:
+        raise ValueError(f"Action log was written by a newer version (v{action_log['version']})")
+    for tarn, marg, count in action_log["runs"]:
+        tarnished_actions = mask_to_actions(tarn, tarnished_map)
+        margit_actions = mask_to_actions(marg, margit_map)
+        for _ in range(count):
+            # Fresh lists every tick, the entities are free to change what they are given
+            yield list(tarnished_actions), list(margit_actions)
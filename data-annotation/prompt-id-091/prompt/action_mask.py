@@ -0,0 +1,122 @@
+"""Actions as integer bitmasks, from network outputs through pruning.
+
+Bit i of a side's mask is output i of its network, which is action OUTPUT_MAP[i], the same
+layout action_log.py records. With at most 10 outputs there are only 1024 possible masks,
+so pruning opposing pairs and turning a mask back into an action list are both a single
+table lookup, built once:
+
+    raw = TARNISHED_ACTIONS.from_outputs(net.activate(inputs))
+    mask = TARNISHED_ACTIONS.prune(raw)
+    actions = TARNISHED_ACTIONS.actions(mask)   # list of Actions, for do_actions and recordings
+
+Tarnished.do_actions and Margit.do_actions (in the entities package) still take action
+lists, so the mask is turned back into one for them. The recorded "actions" field of game
+states is the same list, so recordings and replays read exactly as before. Run this module
+for a per tick micro-benchmark of the mask path against the list path.
+"""
+from argparse import ArgumentParser
+import enum
+import random
+import timeit
+
+
+class ActionMask:
+    """Bitmask encoding of one side's actions.
+
+    Args:
+        name (str): Name of the IntFlag type made for this side, like "TarnishedActions"
+        output_map (list): The side's OUTPUT_MAP, bit i is output_map[i]
+        opposing (list[tuple]): Pairs of actions that cancel each other out when chosen together
+    """
+
+    def __init__(self, name: str, output_map: list, opposing: list[tuple] = ()):
+        self.output_map = list(output_map)
+        self.bits = {action: 1 << i for i, action in enumerate(self.output_map)}
+        # IntFlag over the side's actions, so a mask prints and compares readably
+        self.flags = enum.IntFlag(name, [(action.name, bit) for action, bit in self.bits.items()])
+        self.opposing = [self.bits[a] | self.bits[b] for a, b in opposing if a in self.bits and b in self.bits]
+
+        masks = range(1 << len(self.output_map))
+        self._pruned = [self._prune(mask) for mask in masks]
+        self._actions = [tuple(action for action, bit in self.bits.items() if mask & bit) for mask in masks]
+
+    def _prune(self, mask: int) -> int:
+        for pair in self.opposing:
+            if mask & pair == pair:
+                mask &= ~pair
+        return mask
+
+    def from_outputs(self, outputs) -> int:
+        """Mask of the outputs that fired, same truthiness test as the old list comprehension.
+        """
+        mask = 0
+        bit = 1
+        for output in outputs:
+            if output:
+                mask |= bit
+            bit <<= 1
+        return mask
+
+    def from_actions(self, actions) -> int:
+        """Mask of an action list, like a recorded game state's "actions" field.
+
+        Actions are int enums, so the plain ints read back from a recording look up the same.
+        """
+        mask = 0
+        for action in actions:
+            mask |= self.bits[action]
+        return mask
+
+    def prune(self, mask: int) -> int:
+        """Clear opposing pairs that were both chosen, like prune_actions does to lists.
+        """
+        return self._pruned[mask]
+
+    def actions(self, mask: int) -> list:
+        """The mask's actions, in output map order. A fresh list every call, callers are free to change it.
+        """
+        return list(self._actions[mask])
+
+    def flag(self, mask: int) -> enum.IntFlag:
+        return self.flags(mask)
+
+
+### Micro-benchmark ###
+
+def _list_path(outputs, output_map, opposing):
+    """The old per tick path: build a list, then remove opposing pairs from it.
+    """
+    actions = [output_map[i] for i in range(len(outputs)) if outputs[i]]
+    for a, b in opposing:
+        if a in actions and b in actions:
+            actions.remove(a)
+            actions.remove(b)
+    return actions
+
+
+def _mask_path(outputs, action_mask: ActionMask):
+    return action_mask.actions(action_mask.prune(action_mask.from_outputs(outputs)))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Per tick cost of turning network outputs into pruned actions")
+    parser.add_argument("--outputs", type=int, default=10, help="Network outputs, Margit has 10")
+    parser.add_argument("--ticks", type=int, default=200000)
+    args = parser.parse_args()
+
+    # Stand in actions with the same shape as an output map: pairs of opposites, then standalone ones
+    BenchActions = enum.IntEnum("BenchActions", [f"A{i}" for i in range(args.outputs)])
+    output_map = list(BenchActions)
+    opposing = [(output_map[i], output_map[i + 1]) for i in range(0, min(6, args.outputs - 1), 2)]
+    bench_mask = ActionMask("BenchFlags", output_map, opposing)
+
+    rng = random.Random(0)
+    samples = [[float(rng.random() < 0.5) for _ in range(args.outputs)] for _ in range(1024)]
+    for outputs in samples:
+        assert _list_path(outputs, output_map, opposing) == _mask_path(outputs, bench_mask)
+
+    cycle = samples * (args.ticks // len(samples) + 1)
+    for name, path in (("list", lambda: [_list_path(o, output_map, opposing) for o in cycle[:args.ticks]]),
+                       ("mask", lambda: [_mask_path(o, bench_mask) for o in cycle[:args.ticks]])):
+        best = min(timeit.repeat(path, number=1, repeat=5))
+        print(f"{name}: {best / args.ticks * 1e9:.0f} ns per tick")
@@ -0,0 +1,161 @@
+"""Compiles a whole population of NEAT feed forward genomes into packed NumPy matrices.
+
+Every genome gets the same node layout (inputs, then outputs, then its hidden nodes,
+padded to the biggest genome) and one dense weight matrix. Evaluating a layer for every
+genome at once is then a single batched matmul, instead of one
+neat.nn.FeedForwardNetwork.activate graph walk per genome per input row.
+"""
+import numpy as np
+from neat.graphs import feed_forward_layers
+
+
+def _clamp(z, low, high):
+    return np.clip(z, low, high)
+
+
+# NumPy versions of neat.activations, kept to the same clamping so the outputs match
+ACTIVATIONS = {
+    "sigmoid": lambda z: 1.0 / (1.0 + np.exp(-_clamp(5.0 * z, -60.0, 60.0))),
+    "tanh": lambda z: np.tanh(_clamp(2.5 * z, -60.0, 60.0)),
+    "sin": lambda z: np.sin(_clamp(5.0 * z, -60.0, 60.0)),
+    "gauss": lambda z: np.exp(-5.0 * _clamp(z, -3.4, 3.4) ** 2),
+    "relu": lambda z: np.where(z > 0.0, z, 0.0),
+    "elu": lambda z: np.where(z > 0.0, z, np.expm1(np.minimum(z, 0.0))),
+    "lelu": lambda z: np.where(z > 0.0, z, 0.005 * z),
+    "selu": lambda z: 1.0507009873554804934193349852946 * np.where(
+        z > 0.0, z, 1.6732632423543772848170429916717 * np.expm1(np.minimum(z, 0.0))),
+    "softplus": lambda z: 0.2 * np.log1p(np.exp(_clamp(5.0 * z, -60.0, 60.0))),
+    "identity": lambda z: z,
+    "clamped": lambda z: _clamp(z, -1.0, 1.0),
+    "inv": lambda z: np.divide(1.0, z, out=np.zeros_like(z), where=z != 0.0),
+    "log": lambda z: np.log(np.maximum(z, 1e-7)),
+    "exp": lambda z: np.exp(_clamp(z, -60.0, 60.0)),
+    "abs": np.abs,
+    "hat": lambda z: np.maximum(0.0, 1.0 - np.abs(z)),
+    "square": lambda z: z ** 2,
+    "cube": lambda z: z ** 3,
+}
+
+
+class BatchNetwork:
+    """Packed layered matrices for a population of feed forward genomes.
+
+    Build with compile_population. The row order of every input and output is the order
+    of `genome_keys`.
+    """
+
+    def __init__(self, genome_keys, num_inputs, num_outputs, weights, bias, response, layer_masks, activation_masks):
+        self.genome_keys = genome_keys
+        self.num_inputs = num_inputs
+        self.num_outputs = num_outputs
+        # (genomes, nodes, nodes) weight from source node to target node
+        self.weights = weights
+        # (genomes, nodes)
+        self.bias = bias
+        self.response = response
+        # (layers, genomes, nodes) which nodes get evaluated in each layer
+        self.layer_masks = layer_masks
+        # activation name -> (genomes, nodes) which nodes use it
+        self.activation_masks = activation_masks
+
+    def __len__(self):
+        return len(self.genome_keys)
+
+    def activate(self, inputs) -> np.ndarray:
+        """Evaluate every genome on its own batch of input rows.
+
+        Args:
+            inputs: (genomes, rows, inputs), or (genomes, inputs) for one row per genome.
+                    Any other (rows, inputs) array gives every genome the same rows.
+
+        Returns:
+            np.ndarray: Outputs in the same shape as inputs, with the input axis swapped for outputs
+        """
+        inputs = np.asarray(inputs, dtype=np.float64)
+        single_row = inputs.ndim == 2 and inputs.shape[0] == len(self) and inputs.shape[1] == self.num_inputs
+        if single_row:
+            inputs = inputs[:, None, :]
+        elif inputs.ndim == 2:
+            inputs = np.broadcast_to(inputs, (len(self),) + inputs.shape)
+
+        genomes, rows, _ = inputs.shape
+        values = np.zeros((genomes, rows, self.weights.shape[1]), dtype=np.float64)
+        values[:, :, :self.num_inputs] = inputs
+
+        bias = self.bias[:, None, :]
+        response = self.response[:, None, :]
+        for layer_mask in self.layer_masks:
+            z = bias + response * np.matmul(values, self.weights)
+            evaluated = np.empty_like(z)
+            for name, mask in self.activation_masks.items():
+                # Cheaper to run each activation over everything and pick, than to gather ragged node sets
+                np.copyto(evaluated, ACTIVATIONS[name](z), where=mask[:, None, :])
+            np.copyto(values, evaluated, where=layer_mask[:, None, :])
+
+        outputs = values[:, :, self.num_inputs:self.num_inputs + self.num_outputs]
+        return outputs[:, 0, :] if single_row else outputs
+
+
+def compile_population(genomes, config) -> BatchNetwork:
+    """Compile a population of DefaultGenomes into one BatchNetwork.
+
+    Args:
+        genomes: dict of key -> genome, list of (key, genome) like neat hands eval functions, or list of genomes
+        config (neat.config.Config): Config the genomes were made with, like tarnished_neat_config
+
+    Returns:
+        BatchNetwork: Gives the same outputs as neat.nn.FeedForwardNetwork.create(genome, config).activate,
+                      up to floating point summation order
+    """
+    if isinstance(genomes, dict):
+        genomes = list(genomes.items())
+    genomes = [g if isinstance(g, tuple) else (g.key, g) for g in genomes]
+
+    genome_config = config.genome_config
+    input_keys = list(genome_config.input_keys)
+    output_keys = list(genome_config.output_keys)
+    num_io = len(input_keys) + len(output_keys)
+
+    # Work out every genome's layers first, so we know how big to make the packed arrays
+    compiled = []
+    for _, genome in genomes:
+        connections = [cg.key for cg in genome.connections.values() if cg.enabled]
+        layers = feed_forward_layers(input_keys, output_keys, connections)
+        index = {key: i for i, key in enumerate(input_keys + output_keys)}
+        for layer in layers:
+            for node in sorted(layer):
+                if node not in index:
+                    index[node] = len(index)
+        compiled.append((genome, connections, layers, index))
+
+    num_nodes = max([num_io] + [len(index) for _, _, _, index in compiled])
+    num_layers = max([0] + [len(layers) for _, _, layers, _ in compiled])
+    num_genomes = len(compiled)
+
+    weights = np.zeros((num_genomes, num_nodes, num_nodes), dtype=np.float64)
+    bias = np.zeros((num_genomes, num_nodes), dtype=np.float64)
+    response = np.ones((num_genomes, num_nodes), dtype=np.float64)
+    layer_masks = np.zeros((num_layers, num_genomes, num_nodes), dtype=bool)
+    activation_masks = {}
+
+    for g, (genome, connections, layers, index) in enumerate(compiled):
+        for depth, layer in enumerate(layers):
+            for node in layer:
+                i = index[node]
+                ng = genome.nodes[node]
+                if ng.aggregation != "sum":
+                    raise ValueError(f"Batched networks only support sum aggregation, node {node} uses {ng.aggregation}")
+                if ng.activation not in ACTIVATIONS:
+                    raise ValueError(f"Batched networks don't support the {ng.activation} activation (node {node})")
+                bias[g, i] = ng.bias
+                response[g, i] = ng.response
+                layer_masks[depth, g, i] = True
+                activation_masks.setdefault(ng.activation, np.zeros((num_genomes, num_nodes), dtype=bool))[g, i] = True
+
+        for inode, onode in connections:
+            # Connections into nodes that never get evaluated don't matter, same as FeedForwardNetwork
+            if onode in index and inode in index:
+                weights[g, index[inode], index[onode]] = genome.connections[(inode, onode)].weight
+
+    return BatchNetwork([key for key, _ in genomes], len(input_keys), len(output_keys),
+                        weights, bias, response, layer_masks, activation_masks)
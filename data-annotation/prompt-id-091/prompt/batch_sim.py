@@ -0,0 +1,857 @@
+"""Lockstep simulator that plays many Tarnished vs Margit matches at once.
+
+The rules of Tarnished.do_actions and Margit.do_actions run on NumPy arrays (struct of
+arrays), one row per match, so a tick of N matches costs a handful of array operations
+instead of N trips through the entity objects:
+
+    - action timers, Margit's lead time and which attack starts once it runs out
+    - moving, turning, and the dodge carrying Tarnished along at velocity * 1.5
+    - the ravine (checked only while Tarnished isn't busy) and the 150 + width / 2 bounds
+    - i-frames counting down in Tarnished.update
+
+Nothing here is a guess at the entities. Every number is read off fresh Tarnished/Margit
+objects by probe_object_engine, and Entity.move() and calculate_new_xy are measured there
+too, since the batch engine can't call them on arrays.
+
+Weapon hits are left to the real weapons (entities/attacks). Every match gets a Tarnished/
+Margit pair to host its weapons, and only the matches with a swing going or daggers in
+flight copy their row into the hosts and call the real update(). Everyone else never
+leaves the arrays. Finished matches are masked out and stop changing.
+
+Action columns follow TARNISHED_OUTPUT_MAP and MARGIT_OUTPUT_MAP in main.py, so network
+outputs can be fed straight in as a (matches, outputs) array.
+
+With score_fitness, every match is scored by the same fitness accumulators, fed the same
+tick states in the same order as play_game feeds them. check_parity plays recorded action
+logs through both engines and lists every match they disagree on:
+
+    python batch_sim.py game_states/gen_12
+"""
+from argparse import ArgumentParser
+import json
+import math
+import os
+import random
+import sys
+
+import numpy as np
+
+from observations import BatchObservations
+from config.settings import WIDTH, HEIGHT, MAX_UPDATES_PER_GAME
+
+# Tarnished action columns (TARNISHED_OUTPUT_MAP order)
+P_LEFT, P_RIGHT, P_FORWARD, P_BACK, P_TURNL, P_TURNR, P_DODGE, P_ATTACK = range(8)
+# Margit action columns (MARGIT_OUTPUT_MAP order)
+M_LEFT, M_RIGHT, M_FORWARD, M_BACK, M_TURNL, M_TURNR, M_RETREAT, M_SLASH, M_REVSLASH, M_DAGGERS = range(10)
+
+# What each side is currently locked into doing. Index into params["tarnished_actions"]/["margit_actions"]
+NO_ACTION = 0
+T_DODGE, T_ATTACK = 1, 2
+M_SLASHING, M_REVSLASHING, M_THROWING = 1, 2, 3
+
+# Match outcomes, as stored in BatchSimulator.winner
+DRAW, TARNISHED_WON, MARGIT_WON = 0, 1, 2
+WINNER_NAMES = {DRAW: "draw", TARNISHED_WON: "tarnished", MARGIT_WON: "margit"}
+
+# Tarnished.collide_walls and Margit.stay_in_arena keep an entity 150 + width / 2 from the edges,
+# and Tarnished falls into the ravine past 150 from the top or bottom
+ARENA_PADDING = 150
+# A dodge carries Tarnished along at velocity * 1.5 (Tarnished.do_actions)
+DODGE_SPEEDUP = 1.5
+
+# Entity attribute -> BatchSimulator array, for copying a row into its weapon hosts and back
+TARNISHED_FIELDS = (("x", "t_x"), ("y", "t_y"), ("angle", "t_angle"), ("health", "t_health"),
+                    ("iframes", "t_iframes"), ("time_left_in_action", "t_time"))
+MARGIT_FIELDS = (("x", "m_x"), ("y", "m_y"), ("angle", "m_angle"), ("health", "m_health"),
+                 ("time_left_in_action", "m_time"), ("lead_time_before_action", "m_lead"))
+
+
+def new_entities() -> tuple:
+    """A fresh Tarnished and Margit targeting each other, like new_match_entities builds them.
+    """
+    from entities.tarnished import Tarnished
+    from entities.margit import Margit
+
+    tarnished = Tarnished()
+    margit = Margit()
+    tarnished.give_target(margit)
+    margit.give_target(tarnished)
+    return tarnished, margit
+
+
+def _round(vector) -> tuple:
+    # cos(90 degrees) comes out as 6e-17, which would leak into every step taken along it
+    return tuple(round(value, 12) for value in vector)
+
+
+def _probe_moves(entity_class, directions: tuple) -> dict:
+    """Measure Entity.move() for every combination of directions, facing 0 and 90 degrees.
+
+    move() is the same turned to any angle, so the step facing any angle a is
+    cos(a) * step at 0 + sin(a) * step at 90.
+
+    Args:
+        entity_class (type): Tarnished or Margit
+        directions (tuple): The side's (left, right, forward, back) actions, in output map order
+
+    Returns:
+        dict: "step_0"/"step_90" (3, 3, 2) steps and "angle" (3, 3) angle move() returned minus the
+              facing angle, indexed by [forward - back + 1, right - left + 1]
+    """
+    left, right, forward, back = directions
+    steps = {0: np.zeros((3, 3, 2)), 90: np.zeros((3, 3, 2))}
+    angles = np.zeros((3, 3))
+    for ahead in (-1, 0, 1):
+        for side in (-1, 0, 1):
+            # In output map order, the order do_actions passes them on in
+            moves = [action for action, chosen in ((left, side < 0), (right, side > 0), (forward, ahead > 0), (back, ahead < 0)) if chosen]
+            if not moves:
+                continue
+            for facing in (0, 90):
+                entity = entity_class()
+                start = (entity.x, entity.y)
+                entity.angle = facing
+                moved_angle = entity.move(moves)
+                steps[facing][ahead + 1, side + 1] = _round((entity.x - start[0], entity.y - start[1]))
+                if facing == 0 and moved_angle is not None:
+                    angles[ahead + 1, side + 1] = moved_angle
+    return {"step_0": steps[0], "step_90": steps[90], "angle": angles}
+
+
+def probe_object_engine() -> dict:
+    """Read the game's rules off fresh Tarnished/Margit objects, so both engines share one source of truth.
+
+    Raises:
+        ValueError: If the entities no longer work the way the batch engine assumes they do
+
+    Returns:
+        dict: Parameters for BatchSimulator
+    """
+    from entities.tarnished import Tarnished
+    from entities.margit import Margit
+    from entities.actions import Actions
+    from utilities import calculate_new_xy
+
+    tarnished, margit = new_entities()
+
+    # busy() has to be what the batch engine checks, and we need to know if it forgets the action once it's over
+    clears_action = set()
+    for entity, action in ((tarnished, Actions.PATTACK), (margit, Actions.MSLASH)):
+        for time_left in (-1, 0, 1):
+            probe = type(entity)()
+            probe.current_action = action
+            probe.time_left_in_action = time_left
+            if bool(probe.busy()) != (time_left > 0):
+                raise ValueError(f"{entity.name}.busy() is no longer time_left_in_action > 0")
+            if time_left < 1:
+                clears_action.add(probe.current_action is None)
+    if len(clears_action) > 1:
+        raise ValueError("busy() only sometimes forgets the current action once it's over")
+
+    def start(entity, fields):
+        return {name: getattr(entity, name) for name, _ in fields} | {"current_action": entity.current_action}
+
+    tarnished_actions = (None, Actions.PDODGE, Actions.PATTACK)
+    margit_actions = (None, Actions.MSLASH, Actions.MREVSLASH, Actions.MDAGGERS)
+    return {
+        "tarnished_start": start(tarnished, TARNISHED_FIELDS),
+        "margit_start": start(margit, MARGIT_FIELDS),
+        "tarnished_width": tarnished.width,
+        "margit_width": margit.width,
+        "tarnished_velocity": tarnished.velocity,
+        "tarnished_turn_speed": tarnished.turn_speed,
+        "margit_turn_speed": margit.turn_speed,
+        "dodge_time": tarnished.action_details[Actions.PDODGE]["time_in_action"],
+        "dodge_iframes": tarnished.action_details[Actions.PDODGE]["iframes"],
+        "attack_time": tarnished.action_details[Actions.PATTACK]["time_in_action"],
+        "attack_damage": tarnished.action_details[Actions.PATTACK]["damage"],
+        "slash": margit.weapon_details[Actions.MSLASH],
+        "rev_slash": margit.weapon_details[Actions.MREVSLASH],
+        "daggers": margit.weapon_details[Actions.MDAGGERS],
+        "busy_clears_action": clears_action.pop(),
+        # calculate_new_xy's step of 1 along 0 and 90 degrees, which any other angle is made of
+        "unit_0": _round(calculate_new_xy((0, 0), 1, 0)),
+        "unit_90": _round(calculate_new_xy((0, 0), 1, 90)),
+        "tarnished_moves": _probe_moves(Tarnished, (Actions.PLEFT, Actions.PRIGHT, Actions.PFORWARD, Actions.PBACK)),
+        "margit_moves": _probe_moves(Margit, (Actions.MLEFT, Actions.MRIGHT, Actions.MFORWARD, Actions.MBACK)),
+        # What current_action holds for each of our action codes, and what the networks see for it
+        "tarnished_actions": tarnished_actions,
+        "margit_actions": margit_actions,
+        "tarnished_action_values": tuple(int(action) if action else -1 for action in tarnished_actions),
+        "margit_action_values": tuple(int(action) if action else -1 for action in margit_actions),
+        "tarnished_output_map": (Actions.PLEFT, Actions.PRIGHT, Actions.PFORWARD, Actions.PBACK,
+                                 Actions.PTURNL, Actions.PTURNR, Actions.PDODGE, Actions.PATTACK),
+        "margit_output_map": (Actions.MLEFT, Actions.MRIGHT, Actions.MFORWARD, Actions.MBACK, Actions.MTURNL,
+                              Actions.MTURNR, Actions.MRETREAT, Actions.MSLASH, Actions.MREVSLASH, Actions.MDAGGERS),
+    }
+
+
+class MatchScorer:
+    """Scores one match the way play_game does, from the states of its ticks.
+
+    Each tick's state is captured before the sides act and only scored once the tick after
+    it finishes, because a death has to update it first. The tick the death happened in is
+    never scored, same as in the recorded game states.
+    """
+
+    def __init__(self):
+        from fitness_accumulators import make_fitness_accumulators
+
+        self.tarnished_fitness, self.margit_fitness = make_fitness_accumulators()
+        self.last_state = None
+        self.curr_state = None
+
+    def capture(self, tick: int, tarnished, margit, tarnished_actions: list, margit_actions: list):
+        """The state this tick starts from, with the actions chosen from it.
+        """
+        self.curr_state = {
+            "tick": tick,
+            "tarnished": {"state": tarnished.get_state(), "actions": tarnished_actions},
+            "margit": {"state": margit.get_state(), "actions": margit_actions},
+        }
+
+    def tick_done(self):
+        """The tick finished without anyone dying.
+        """
+        if self.last_state is not None:
+            self.tarnished_fitness.update(self.last_state)
+            self.margit_fitness.update(self.last_state)
+        self.last_state = self.curr_state
+
+    def died(self, side: str, entity):
+        """Someone died this tick, so the last finished tick's state takes their final state.
+
+        Args:
+            side (str): "tarnished" or "margit"
+            entity (Entity): Whoever died
+        """
+        if self.last_state is None:
+            return
+        self.last_state[side]["state"] = entity.get_state()
+
+    def finish(self, game_result: dict, ticks_skipped: int = 0) -> tuple[tuple, tuple]:
+        """Score the finished match.
+
+        Returns:
+            tuple[tuple, tuple]: <(tarnished score, details), (margit score, details)>
+        """
+        if self.last_state is not None:
+            self.tarnished_fitness.update(self.last_state)
+            self.margit_fitness.update(self.last_state)
+            if ticks_skipped:
+                self.tarnished_fitness.skip(self.last_state, ticks_skipped)
+                self.margit_fitness.skip(self.last_state, ticks_skipped)
+        return self.tarnished_fitness.finish(game_result), self.margit_fitness.finish(game_result)
+
+
+def _fitness_fields(game_result: dict, scores: tuple):
+    """Put both sides' scores into a game result under the keys play_game uses.
+    """
+    from entities.base import Entities, trainer_str
+
+    for entity, (score, details) in zip((Entities.TARNISHED, Entities.MARGIT), scores):
+        game_result[f"{trainer_str(entity)}_fitness"] = int(score)
+        game_result[f"{trainer_str(entity)}_fitness_details"] = details
+
+
+class BatchSimulator:
+    """Steps `matches` games in lockstep.
+
+    Args:
+        matches (int): How many games to play at once
+        params (dict): Game rules, from probe_object_engine() unless given
+        max_updates (int): Ticks before a match is called a stalemate
+        score_fitness (bool): Score every match like play_game does. Every live match then goes
+                              through its entity hosts once a tick, which costs most of the speedup
+    """
+
+    def __init__(self, matches: int, params: dict = None, max_updates: int = MAX_UPDATES_PER_GAME, score_fitness: bool = False):
+        from entities.exceptions import TarnishedDied, MargitDied
+
+        self.matches = matches
+        self.params = params or probe_object_engine()
+        self.max_updates = max_updates
+        self.score_fitness = score_fitness
+        self._tarnished_died = TarnishedDied
+        self._margit_died = MargitDied
+        self._action_codes = [{action: code for code, action in enumerate(self.params[side])}
+                              for side in ("tarnished_actions", "margit_actions")]
+        self.reset()
+
+    def reset(self):
+        """Put every match back to its starting positions.
+        """
+        n, p = self.matches, self.params
+        t, m = p["tarnished_start"], p["margit_start"]
+
+        self.t_x = np.full(n, t["x"], dtype=np.float64)
+        self.t_y = np.full(n, t["y"], dtype=np.float64)
+        self.t_angle = np.full(n, t["angle"], dtype=np.float64)
+        self.t_health = np.full(n, t["health"], dtype=np.int64)
+        self.t_action = np.full(n, self._action_codes[0][t["current_action"]], dtype=np.int8)
+        self.t_time = np.full(n, t["time_left_in_action"], dtype=np.int64)
+        self.t_iframes = np.full(n, t["iframes"], dtype=np.int64)
+        # Whether the match's Tarnished weapon is in the middle of something, so its host has to update
+        self.t_armed = np.zeros(n, dtype=bool)
+
+        self.m_x = np.full(n, m["x"], dtype=np.float64)
+        self.m_y = np.full(n, m["y"], dtype=np.float64)
+        self.m_angle = np.full(n, m["angle"], dtype=np.float64)
+        self.m_health = np.full(n, m["health"], dtype=np.int64)
+        self.m_action = np.full(n, self._action_codes[1][m["current_action"]], dtype=np.int8)
+        self.m_time = np.full(n, m["time_left_in_action"], dtype=np.int64)
+        self.m_lead = np.full(n, m["lead_time_before_action"], dtype=np.int64)
+        # Same for Margit's slashes and daggers
+        self.m_armed = np.zeros(n, dtype=bool)
+
+        self.active = np.ones(n, dtype=bool)
+        self.winner = np.full(n, DRAW, dtype=np.int8)
+        self.ticks = np.zeros(n, dtype=np.int64)
+        self.stalemated = np.zeros(n, dtype=bool)
+        self.ticks_skipped = np.zeros(n, dtype=np.int64)
+        self._observations = BatchObservations(n)
+
+        # (tarnished, margit) weapon hosts per match, only built once a match needs them
+        self._hosts = [None] * n
+        self._scorers = [MatchScorer() for _ in range(n)] if self.score_fitness else None
+        self._fitness = [None] * n
+
+    ### Weapon hosts ###
+
+    def _host(self, i: int) -> tuple:
+        if self._hosts[i] is None:
+            self._hosts[i] = new_entities()
+        return self._hosts[i]
+
+    def _sync(self, i: int) -> tuple:
+        """Copy match i's row into its hosts, so the real weapons see where everyone is.
+        """
+        tarnished, margit = self._host(i)
+        for entity, fields, action, actions in ((tarnished, TARNISHED_FIELDS, self.t_action, "tarnished_actions"),
+                                                (margit, MARGIT_FIELDS, self.m_action, "margit_actions")):
+            for name, column in fields:
+                value = getattr(self, column)[i]
+                setattr(entity, name, float(value) if value.dtype.kind == "f" else int(value))
+            entity.current_action = self.params[actions][action[i]]
+        return tarnished, margit
+
+    def _read(self, i: int):
+        """Copy whatever the real weapons changed on match i's hosts back into its row.
+        """
+        tarnished, margit = self._hosts[i]
+        for entity, fields in ((tarnished, TARNISHED_FIELDS), (margit, MARGIT_FIELDS)):
+            for name, column in fields:
+                getattr(self, column)[i] = getattr(entity, name)
+
+    def load_states(self, i: int, tarnished_state: dict, margit_state: dict):
+        """Start match i from recorded get_state() states instead of the default starting positions.
+        """
+        tarnished, margit = self._host(i)
+        tarnished.set_state(tarnished_state)
+        margit.set_state(margit_state)
+        self._read(i)
+        self.t_action[i] = self._action_code(0, tarnished.current_action)
+        self.m_action[i] = self._action_code(1, margit.current_action)
+        self.t_armed[i] = bool(tarnished.weapon.get_state())
+        self.m_armed[i] = self._margit_armed(margit)
+
+    def _action_code(self, side: int, action) -> int:
+        codes = self._action_codes[side]
+        if action in codes:
+            return codes[action]
+        # Recorded states come back from JSON with the plain values
+        return next(code for known, code in codes.items() if known is not None and int(known) == action)
+
+    def _margit_armed(self, margit) -> bool:
+        # Margit.update only swings the slash it's doing once the lead time is over, and flies any daggers
+        swinging = None
+        if margit.current_action == self.params["margit_actions"][M_SLASHING]:
+            swinging = margit.slash
+        elif margit.current_action == self.params["margit_actions"][M_REVSLASHING]:
+            swinging = margit.rev_slash
+        return bool(margit.daggers) or (swinging is not None and margit.lead_time_before_action < 1 and bool(swinging.get_state()))
+
+    ### Observations ###
+
+    def observations(self) -> tuple[np.ndarray, np.ndarray]:
+        """Network inputs for every match, laid out like ObservationBuffers.fill builds them.
+
+        The arrays are reused, so they are overwritten by the next call.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: <(matches, 8) tarnished inputs, (matches, 8) margit inputs>
+        """
+        # current_action or -1, whether or not the action is still going
+        t_current = np.asarray(self.params["tarnished_action_values"], dtype=np.float64)[self.t_action]
+        m_current = np.asarray(self.params["margit_action_values"], dtype=np.float64)[self.m_action]
+        return self._observations.fill_columns(self.t_x, self.t_y, self.t_angle, t_current, self.t_time,
+                                               self.m_x, self.m_y, self.m_angle, m_current, self.m_time)
+
+    ### Stepping ###
+
+    def step(self, tarnished_actions: np.ndarray, margit_actions: np.ndarray):
+        """Play one tick of every match that is still going.
+
+        Follows the same order as play_game: Tarnished acts, Margit acts, then Tarnished
+        and Margit update. A match ends at the point the object engine would have raised.
+
+        Args:
+            tarnished_actions (np.ndarray): (matches, 8) truthy where the action was chosen
+            margit_actions (np.ndarray): (matches, 10) truthy where the action was chosen
+        """
+        tarn = prune_opposing(np.asarray(tarnished_actions, dtype=bool), ((P_LEFT, P_RIGHT), (P_FORWARD, P_BACK), (P_TURNL, P_TURNR)))
+        marg = prune_opposing(np.asarray(margit_actions, dtype=bool), ((M_LEFT, M_RIGHT), (M_FORWARD, M_BACK), (M_TURNL, M_TURNR)))
+
+        # A tick is counted for every match that starts it
+        playing = self.active.copy()
+        if self.score_fitness:
+            self._capture(playing, tarn, marg)
+        self._tarnished_do_actions(tarn)
+        self._margit_do_actions(marg)
+        self._tarnished_update()
+        self._margit_update()
+
+        self.ticks[playing] += 1
+        stalemate = self.active & (self.ticks > self.max_updates)
+        self.stalemated |= stalemate
+        self.active &= ~stalemate
+        if self.score_fitness:
+            self._score(playing)
+
+    def stop(self, rows: np.ndarray, ticks_skipped: np.ndarray = 0):
+        """Call the rows a stalemate now, like an early stop policy does in play_game.
+
+        Args:
+            rows (np.ndarray): Matches to stop
+            ticks_skipped (np.ndarray): Ticks to score as if the last state held for them
+        """
+        rows = rows & self.active
+        self.stalemated |= rows
+        self.ticks_skipped[rows] = np.broadcast_to(ticks_skipped, rows.shape)[rows]
+        self.active &= ~rows
+        if self.score_fitness:
+            for i in np.nonzero(rows)[0]:
+                self._finish_fitness(i)
+
+    def run(self, policy, max_ticks: int = None):
+        """Play every match to the end.
+
+        Args:
+            policy (callable): Takes (tarnished observations, margit observations) and returns
+                               (tarnished actions, margit actions) arrays for every match
+            max_ticks (int): Optional hard stop, on top of the stalemate limit
+        """
+        tick = 0
+        while self.active.any() and (max_ticks is None or tick < max_ticks):
+            self.step(*policy(*self.observations()))
+            tick += 1
+
+    def _end(self, rows: np.ndarray, winner: int):
+        rows = rows & self.active
+        self.winner[rows] = winner
+        self.active &= ~rows
+
+    def _tarnished_do_actions(self, actions: np.ndarray):
+        p = self.params
+        live = self.active
+        busy = live & (self.t_time > 0)
+
+        # Dodging keeps carrying us along our dodge angle
+        dodging = busy & (self.t_action == T_DODGE)
+        dx, dy = self._step_xy(p["tarnished_velocity"] * DODGE_SPEEDUP, self.t_angle[dodging])
+        self.t_x[dodging] += dx
+        self.t_y[dodging] += dy
+        self.t_time[busy] -= 1
+
+        free = live & ~busy
+        if p["busy_clears_action"]:
+            self.t_action[free] = NO_ACTION
+
+        # Falling into the ravine is only checked when we aren't busy, before we get to act
+        fell = free & ((self.t_y > HEIGHT - ARENA_PADDING) | (self.t_y < ARENA_PADDING))
+        self.t_health[fell] = 0
+        free &= ~fell
+
+        attacking = free & actions[:, P_ATTACK]
+        self.t_action[attacking] = T_ATTACK
+        self.t_time[attacking] = p["attack_time"]
+        for i in np.nonzero(attacking)[0]:
+            tarnished, _ = self._sync(i)
+            # Same as do_actions, which sets the damage back since hitting zeroes it
+            tarnished.weapon.damage = p["attack_damage"]
+            tarnished.weapon.start_attack()
+            self.t_armed[i] = True
+        free &= ~attacking
+
+        move_angle = self._move(self.t_x, self.t_y, self.t_angle, actions, free,
+                                (P_FORWARD, P_BACK, P_LEFT, P_RIGHT), p["tarnished_moves"])
+
+        dodge = free & actions[:, P_DODGE]
+        self.t_action[dodge] = T_DODGE
+        self.t_time[dodge] = p["dodge_time"]
+        self.t_iframes[dodge] = p["dodge_iframes"]
+        self.t_angle[dodge] = move_angle[dodge]
+        free &= ~dodge
+
+        _turn(self.t_angle, actions, free, P_TURNL, P_TURNR, p["tarnished_turn_speed"])
+
+        # collide_walls() runs no matter how we left do_actions, and only stops us at the walls
+        half = p["tarnished_width"] / 2
+        np.clip(self.t_x, ARENA_PADDING + half, WIDTH - ARENA_PADDING - half, out=self.t_x, where=live)
+
+        self._end(fell, MARGIT_WON)
+
+    def _margit_do_actions(self, actions: np.ndarray):
+        p = self.params
+        live = self.active
+        busy = live & (self.m_time > 0)
+
+        self.m_time[busy] -= 1
+        self.m_lead[busy] -= 1
+        # Once the lead time runs out the slash starts swinging, or the dagger gets thrown
+        for i in np.nonzero(busy & (self.m_lead == 0))[0]:
+            _, margit = self._sync(i)
+            if self.m_action[i] == M_SLASHING:
+                margit.slash.start_attack()
+            elif self.m_action[i] == M_REVSLASHING:
+                margit.rev_slash.start_attack()
+            elif self.m_action[i] == M_THROWING:
+                margit.make_dagger()
+            self.m_armed[i] = True
+
+        free = live & ~busy
+        if p["busy_clears_action"]:
+            self.m_action[free] = NO_ACTION
+
+        # Attacks in order of priority
+        for column, action, details in ((M_SLASH, M_SLASHING, "slash"), (M_REVSLASH, M_REVSLASHING, "rev_slash"), (M_DAGGERS, M_THROWING, "daggers")):
+            starting = free & actions[:, column]
+            self.m_action[starting] = action
+            self.m_time[starting] = p[details]["attack_time"]
+            self.m_lead[starting] = p[details]["lead_time"]
+            if action != M_THROWING:
+                # Margit.do_actions sets the regular slash's damage back for both slashes, the reverse slash's is never reset
+                for i in np.nonzero(starting)[0]:
+                    self._host(i)[1].slash.damage = p[details]["damage"]
+            free &= ~starting
+
+        self._move(self.m_x, self.m_y, self.m_angle, actions, free,
+                   (M_FORWARD, M_BACK, M_LEFT, M_RIGHT), p["margit_moves"])
+        _turn(self.m_angle, actions, free, M_TURNL, M_TURNR, p["margit_turn_speed"])
+
+        # stay_in_arena() keeps Margit out of the walls and the ravine
+        half = p["margit_width"] / 2
+        np.clip(self.m_x, ARENA_PADDING + half, WIDTH - ARENA_PADDING - half, out=self.m_x, where=live)
+        np.clip(self.m_y, ARENA_PADDING + half, HEIGHT - ARENA_PADDING - half, out=self.m_y, where=live)
+
+    def _tarnished_update(self):
+        live = self.active
+        armed = live & self.t_armed
+        # An idle weapon has nothing to update, so these only lose an i-frame
+        self.t_iframes[live & ~armed] -= 1
+        for i in np.nonzero(armed)[0]:
+            tarnished, _ = self._sync(i)
+            try:
+                tarnished.update()
+            except self._margit_died:
+                self._read(i)
+                self._end(_row(i, self.matches), TARNISHED_WON)
+                continue
+            self._read(i)
+            self.t_armed[i] = bool(tarnished.weapon.get_state())
+
+    def _margit_update(self):
+        live = self.active
+        for i in np.nonzero(live & self.m_armed)[0]:
+            _, margit = self._sync(i)
+            try:
+                margit.update()
+            except self._tarnished_died:
+                self._read(i)
+                self._end(_row(i, self.matches), MARGIT_WON)
+                continue
+            self._read(i)
+            self.m_armed[i] = self._margit_armed(margit)
+
+    def _step_xy(self, speed, angle):
+        """calculate_new_xy's step along an angle, for arrays of angles.
+        """
+        rad = np.radians(angle)
+        cos, sin = np.cos(rad), np.sin(rad)
+        unit_0, unit_90 = self.params["unit_0"], self.params["unit_90"]
+        return speed * (cos * unit_0[0] + sin * unit_90[0]), speed * (cos * unit_0[1] + sin * unit_90[1])
+
+    def _move(self, x, y, angle, actions, rows, columns, moves) -> np.ndarray:
+        """Entity.move() for the rows that asked to, from the steps probe_object_engine measured. Returns the angle moved along.
+        """
+        forward, back, left, right = columns
+        ahead = actions[:, forward].astype(np.int64) - actions[:, back] + 1
+        side = actions[:, right].astype(np.int64) - actions[:, left] + 1
+        moving = rows & ((ahead != 1) | (side != 1))
+
+        move_angle = angle.copy()
+        a, s = ahead[moving], side[moving]
+        rad = np.radians(angle[moving])
+        cos, sin = np.cos(rad), np.sin(rad)
+        x[moving] += cos * moves["step_0"][a, s, 0] + sin * moves["step_90"][a, s, 0]
+        y[moving] += cos * moves["step_0"][a, s, 1] + sin * moves["step_90"][a, s, 1]
+        move_angle[moving] = angle[moving] + moves["angle"][a, s]
+        return move_angle
+
+    ### Fitness ###
+
+    def _capture(self, rows: np.ndarray, tarnished_actions: np.ndarray, margit_actions: np.ndarray):
+        t_map, m_map = self.params["tarnished_output_map"], self.params["margit_output_map"]
+        for i in np.nonzero(rows)[0]:
+            tarnished, margit = self._sync(i)
+            self._scorers[i].capture(int(self.ticks[i]), tarnished, margit,
+                                     [t_map[c] for c in np.nonzero(tarnished_actions[i])[0]],
+                                     [m_map[c] for c in np.nonzero(margit_actions[i])[0]])
+
+    def _score(self, rows: np.ndarray):
+        for i in np.nonzero(rows)[0]:
+            scorer = self._scorers[i]
+            if self.active[i] or self.stalemated[i]:
+                scorer.tick_done()
+            else:
+                tarnished, margit = self._sync(i)
+                if self.winner[i] == MARGIT_WON:
+                    scorer.died("tarnished", tarnished)
+                else:
+                    scorer.died("margit", margit)
+            if not self.active[i]:
+                self._finish_fitness(i)
+
+    def _finish_fitness(self, i: int):
+        game_result = self._result(i)
+        game_result["game_states"] = []
+        self._fitness[i] = self._scorers[i].finish(game_result, int(self.ticks_skipped[i]))
+
+    ### Results ###
+
+    def _result(self, i: int) -> dict:
+        result = {
+            "winner": WINNER_NAMES[int(self.winner[i])],
+            "notes": "Game stalemated" if self.stalemated[i] else "",
+            "ticks": int(self.ticks[i]),
+            "tarnished_health": int(self.t_health[i]),
+            "margit_health": int(self.m_health[i]),
+        }
+        if self.ticks_skipped[i]:
+            result["ticks_skipped"] = int(self.ticks_skipped[i])
+        return result
+
+    def results(self) -> list[dict]:
+        """Outcome of every match, with each side's fitness and its details under play_game's keys when scored.
+        """
+        results = []
+        for i in range(self.matches):
+            result = self._result(i)
+            if self._fitness[i] is not None:
+                _fitness_fields(result, self._fitness[i])
+            results.append(result)
+        return results
+
+
+def _row(i: int, matches: int) -> np.ndarray:
+    rows = np.zeros(matches, dtype=bool)
+    rows[i] = True
+    return rows
+
+
+def prune_opposing(actions: np.ndarray, pairs) -> np.ndarray:
+    """Array version of prune_actions. Opposing actions chosen together cancel out.
+
+    Args:
+        actions (np.ndarray): (matches, outputs) bool array
+        pairs: Column pairs that cancel each other out
+    """
+    actions = actions.copy()
+    for a, b in pairs:
+        both = actions[:, a] & actions[:, b]
+        actions[both, a] = False
+        actions[both, b] = False
+    return actions
+
+
+def _turn(angle, actions, rows, left, right, speed):
+    turning = rows & (actions[:, left] ^ actions[:, right])
+    angle[turning & actions[:, left]] -= speed
+    angle[turning & actions[:, right]] += speed
+
+
+### Parity ###
+
+def _iter_columns(action_log_data: dict):
+    """Yield every tick's (tarnished, margit) action columns from a recorded log.
+    """
+    for tarn, marg, count in action_log_data["runs"]:
+        columns = (np.array([bool(tarn >> bit & 1) for bit in range(8)]),
+                   np.array([bool(marg >> bit & 1) for bit in range(10)]))
+        for _ in range(count):
+            yield columns
+
+
+def replay_action_logs(action_logs: list, params: dict = None, ticks_skipped: list = None,
+                       score_fitness: bool = True) -> BatchSimulator:
+    """Play recorded action logs (see action_log.py) through the batch engine.
+
+    Each match starts from its log's initial states. A log that ends before its game did
+    was stopped early, and the match is stopped there too.
+
+    Args:
+        action_logs (list): Each game's "action_log"
+        params (dict): Game rules, from probe_object_engine() unless given
+        ticks_skipped (list): Per log, what its early stop skipped (its game's "early_stop"), 0 when it wasn't
+        score_fitness (bool): Score the matches like play_game
+    """
+    sim = BatchSimulator(len(action_logs), params, score_fitness=score_fitness)
+    ticks_skipped = np.asarray(ticks_skipped or [0] * sim.matches, dtype=np.int64)
+    for i, log in enumerate(action_logs):
+        sim.load_states(i, log["initial"]["tarnished"], log["initial"]["margit"])
+    logs = [_iter_columns(log) for log in action_logs]
+
+    tarn = np.zeros((sim.matches, 8), dtype=bool)
+    marg = np.zeros((sim.matches, 10), dtype=bool)
+    while sim.active.any():
+        exhausted = np.zeros(sim.matches, dtype=bool)
+        for i, log_ticks in enumerate(logs):
+            if not sim.active[i]:
+                continue
+            columns = next(log_ticks, None)
+            if columns is None:
+                exhausted[i] = True
+            else:
+                tarn[i], marg[i] = columns
+        sim.stop(exhausted, ticks_skipped)
+        sim.step(tarn, marg)
+    return sim
+
+
+def play_object_game(action_log_data: dict, params: dict, ticks_skipped: int = 0,
+                     max_updates: int = MAX_UPDATES_PER_GAME) -> dict:
+    """Play one recorded action log on the real Tarnished/Margit, scored like play_game scores a game.
+
+    Returns:
+        dict: Shaped like BatchSimulator.results() entries
+    """
+    from entities.exceptions import TarnishedDied, MargitDied
+    import action_log
+
+    tarnished, margit = new_entities()
+    # Seeded like play_game seeds a deterministic game, and put back the same way
+    outer_random_state = random.getstate()
+    random.seed(action_log_data["seed"])
+    tarnished.set_state(action_log_data["initial"]["tarnished"])
+    margit.set_state(action_log_data["initial"]["margit"])
+    scorer = MatchScorer()
+    result = {"winner": "draw", "notes": ""}
+    updates = 0
+    try:
+        for tarnish_actions, margit_actions in action_log.iter_actions(action_log_data, params["tarnished_output_map"], params["margit_output_map"]):
+            scorer.capture(updates, tarnished, margit, list(tarnish_actions), list(margit_actions))
+            tarnished.do_actions(tarnish_actions)
+            margit.do_actions(margit_actions)
+            tarnished.update()
+            margit.update()
+            scorer.tick_done()
+            updates += 1
+            if updates > max_updates:
+                break
+        result["notes"] = "Game stalemated"
+    except TarnishedDied:
+        result["winner"] = "margit"
+        scorer.died("tarnished", tarnished)
+        updates += 1
+    except MargitDied:
+        result["winner"] = "tarnished"
+        scorer.died("margit", margit)
+        updates += 1
+    finally:
+        random.setstate(outer_random_state)
+    result.update({
+        "ticks": updates,
+        "tarnished_health": int(tarnished.health),
+        "margit_health": int(margit.health),
+    })
+    if ticks_skipped:
+        result["ticks_skipped"] = ticks_skipped
+    game_result = dict(result, game_states=[])
+    _fitness_fields(result, scorer.finish(game_result, ticks_skipped))
+    return result
+
+
+def same_result(got, expected, rel_tol: float = 1e-9) -> bool:
+    """Whether two results match, floats up to rounding.
+
+    Array maths doesn't round the last bit the same way math.cos does, so positions (and
+    whatever fitness adds up from them) can be a few ulps apart after a long game.
+    """
+    if isinstance(got, dict) and isinstance(expected, dict):
+        return got.keys() == expected.keys() and all(same_result(got[key], expected[key], rel_tol) for key in got)
+    if isinstance(got, float) or isinstance(expected, float):
+        return math.isclose(got, expected, rel_tol=rel_tol, abs_tol=rel_tol)
+    return got == expected
+
+
+def check_parity(games: list[dict], params: dict = None) -> list[tuple[int, dict, dict]]:
+    """Play recorded deterministic games through both engines and compare everything they report.
+
+    Args:
+        games (list[dict]): Recorded game headers that have an "action_log"
+        params (dict): Game rules, from probe_object_engine() unless given
+
+    Returns:
+        list[tuple[int, dict, dict]]: <game index, batch result, object result> for every mismatch
+    """
+    params = params or probe_object_engine()
+    skipped = [game.get("early_stop", {}).get("ticks_skipped", 0) for game in games]
+    batch_results = replay_action_logs([game["action_log"] for game in games], params, skipped).results()
+    mismatches = []
+    for i, game in enumerate(games):
+        expected = play_object_game(game["action_log"], params, skipped[i])
+        if not same_result(batch_results[i], expected):
+            mismatches.append((i, batch_results[i], expected))
+    return mismatches
+
+
+def load_recorded_games(paths: list[str]) -> list[dict]:
+    """Headers of every deterministic game in the given archives, generation folders or JSON game files.
+    """
+    import recording
+
+    games = []
+    for path in paths:
+        if os.path.isdir(path):
+            archive = os.path.join(path, recording.ARCHIVE_NAME)
+            files = [archive] if os.path.exists(archive) else [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(".json")]
+        else:
+            files = [path]
+        for file in files:
+            if recording.is_archive(file):
+                headers = [header for _, header in recording.iter_headers(file)]
+            else:
+                with open(file) as f:
+                    headers = [json.load(f)]
+            games.extend(header for header in headers if header.get("action_log"))
+    return games
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Check the batch engine plays recorded --deterministic games exactly like the entities do")
+    parser.add_argument("paths", nargs="+", help="Generation folders, archives or JSON game files recorded with --deterministic")
+    args = parser.parse_args()
+
+    games = load_recorded_games(args.paths)
+    if not games:
+        sys.exit("No recorded action logs found, record some games with --deterministic first")
+    params = probe_object_engine()
+    mismatches = check_parity(games, params)
+    for i, got, expected in mismatches:
+        game = games[i]
+        print(f"Generation {game.get('generation')} population {game.get('population')} ({game.get('trainer')}):")
+        for key in sorted(set(got) | set(expected)):
+            if not same_result(got.get(key), expected.get(key)):
+                print(f"  {key}: batch {got.get(key)!r}, entities {expected.get(key)!r}")
+    print(f"{len(games) - len(mismatches)}/{len(games)} games identical on both engines")
+    sys.exit(1 if mismatches else 0)
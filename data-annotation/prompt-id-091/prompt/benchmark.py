@@ -0,0 +1,300 @@
+"""Games per second benchmark of the simulator, no display needed.
+
+Plays seeded, fixed genomes built from the tarnished and margit NEAT configs through the
+same code training uses, and measures:
+
+    single_game_ticks_per_s     play_game on its own, headless and unrecorded
+    serial_generation_s         eval_genomes for a whole population in this process
+    pool_generation_s           eval_genomes on an EvaluationPool
+    batched_generation_s        the whole population on BatchSimulator/BatchNetwork
+    peak_alloc_mb               most memory Python had allocated during a serial generation
+    peak_rss_mb                 peak resident memory of this process
+    bytes_per_game              what recording a game adds to its generation's archive
+    bytes_per_game_action_log   the same for --deterministic games, which only log actions
+
+Games are deterministic (seeded per game, no early stops), so the same tree plays the same
+games every run and the numbers only move when the code does. Results are written as JSON,
+and --compare flags every metric that got worse than a saved baseline by more than the
+tolerance:
+
+    python benchmark.py --output baseline.json
+    ...change things...
+    python benchmark.py --compare baseline.json
+"""
+from argparse import ArgumentParser
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import neat
+
+# metric -> (unit, whether higher is better)
+METRICS = {
+    "single_game_ticks_per_s": ("ticks/s", True),
+    "serial_generation_s": ("s", False),
+    "pool_generation_s": ("s", False),
+    "batched_generation_s": ("s", False),
+    "peak_alloc_mb": ("MB", False),
+    "peak_rss_mb": ("MB", False),
+    "bytes_per_game": ("B", False),
+    "bytes_per_game_action_log": ("B", False),
+}
+
+BENCHMARK_VERSION = 1
+
+
+def import_training(seed: int):
+    """Import main.py the way a headless, unrecorded, deterministic training run would set it up.
+
+    main.py reads its flags when it is imported, so they are handed over through sys.argv.
+    -c keeps it from cleaning anything up, and an empty --early-stop plays every game out.
+    """
+    argv = sys.argv
+    sys.argv = [argv[0], "--headless", "--no-record", "--deterministic", "--seed", str(seed), "-c", "--early-stop"]
+    try:
+        import main
+    finally:
+        sys.argv = argv
+    return main
+
+
+def make_genomes(config: neat.config.Config, count: int, seed: int, mutations: int) -> list[tuple]:
+    """Seeded genomes, mutated a few times so they have some structure to evaluate.
+
+    Returns:
+        list[tuple]: (key, genome) pairs, like neat hands eval functions
+    """
+    random.seed(seed)
+    # New node ids come from a counter on the config, which would carry on from the last call
+    config.genome_config.node_indexer = None
+    genomes = []
+    for key in range(1, count + 1):
+        genome = config.genome_type(key)
+        genome.configure_new(config.genome_config)
+        for _ in range(mutations):
+            genome.mutate(config.genome_config)
+        genomes.append((key, genome))
+    return genomes
+
+
+def timed(func, repeat: int) -> float:
+    """Best wall time of running func repeat times. The best run has the least noise from the rest of the machine.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+### Benchmarks ###
+
+def bench_single_game(main, genomes_tarnished, genomes_margit, games: int, repeat: int) -> float:
+    """Ticks/s of back to back play_game calls, median over the repeats.
+    """
+    nets = [(neat.nn.FeedForwardNetwork.create(t, main.tarnished_neat_config),
+             neat.nn.FeedForwardNetwork.create(m, main.margit_neat_config))
+            for (_, t), (_, m) in zip(genomes_tarnished[:games], genomes_margit[:games])]
+    rates = []
+    for _ in range(repeat):
+        main.curr_gen = 0
+        main.curr_pop = 0
+        main.early_stop_stats.take()
+        start = time.perf_counter()
+        for tarnished_net, margit_net in nets:
+            main.play_game(tarnished_net, margit_net, headless=True, record=False)
+        elapsed = time.perf_counter() - start
+        rates.append(main.early_stop_stats.take().ticks_played / elapsed)
+    return statistics.median(rates)
+
+
+def run_generation(main, genomes_tarnished, genomes_margit):
+    # eval_genomes prints its own per generation report, which would drown ours out
+    main.curr_gen = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.eval_genomes(genomes_tarnished, genomes_margit, main.tarnished_neat_config, main.margit_neat_config)
+
+
+def bench_generation(main, genomes_tarnished, genomes_margit, repeat: int, workers: int = 1, chunksize: int = 4) -> float:
+    """Wall time of eval_genomes over the whole population, serially or on a pool.
+    """
+    if workers == 1:
+        return timed(lambda: run_generation(main, genomes_tarnished, genomes_margit), repeat)
+
+    from evaluation_pool import EvaluationPool
+    main.eval_pool = EvaluationPool(workers=workers, chunksize=chunksize, initializer=main.init_eval_worker)
+    try:
+        # Workers are spun up once per training run, so don't count their first games
+        run_generation(main, genomes_tarnished, genomes_margit)
+        return timed(lambda: run_generation(main, genomes_tarnished, genomes_margit), repeat)
+    finally:
+        main.eval_pool.close()
+        main.eval_pool = None
+
+
+def bench_batched(main, genomes_tarnished, genomes_margit, repeat: int) -> float:
+    """Wall time of playing the whole population's matches in lockstep, compiling the networks included.
+    """
+    from batch_network import compile_population
+    from batch_sim import BatchSimulator, probe_object_engine
+
+    params = probe_object_engine()
+
+    def generation():
+        nets_tarnished = compile_population(genomes_tarnished, main.tarnished_neat_config)
+        nets_margit = compile_population(genomes_margit, main.margit_neat_config)
+        sim = BatchSimulator(len(genomes_tarnished), params)
+        sim.run(lambda t_obs, m_obs: (nets_tarnished.activate(t_obs) != 0, nets_margit.activate(m_obs) != 0))
+
+    return timed(generation, repeat)
+
+
+def bench_peak_alloc(main, genomes_tarnished, genomes_margit) -> float:
+    """Peak Python allocations during one serial generation, in MB.
+    """
+    tracemalloc.start()
+    try:
+        run_generation(main, genomes_tarnished, genomes_margit)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1e6
+
+
+def bench_bytes_per_game(main, genomes_tarnished, genomes_margit, games: int, seed: int, deterministic: bool) -> float:
+    """Average size a recorded game adds to its generation's archive, as training records it.
+    """
+    deterministic_before = main.DETERMINISTIC
+    main.DETERMINISTIC = deterministic
+    # Deterministic games seed themselves, the others play on from this
+    random.seed(seed)
+    main.curr_gen = 0
+    main.curr_pop = 0
+    archive = f"{main.GAMESTATES_PATH}/gen_0/{main.recording.ARCHIVE_NAME}"
+    os.makedirs(os.path.dirname(archive), exist_ok=True)
+    if os.path.exists(archive):
+        os.remove(archive)
+    for (_, t), (_, m) in zip(genomes_tarnished[:games], genomes_margit[:games]):
+        main.play_game(neat.nn.FeedForwardNetwork.create(t, main.tarnished_neat_config),
+                       neat.nn.FeedForwardNetwork.create(m, main.margit_neat_config),
+                       headless=True, record=True)
+    main.DETERMINISTIC = deterministic_before
+    return os.path.getsize(archive) / games
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+
+
+def run_benchmarks(args) -> dict:
+    main = import_training(args.seed)
+    genomes_tarnished = make_genomes(main.tarnished_neat_config, args.population, args.seed, args.mutations)
+    genomes_margit = make_genomes(main.margit_neat_config, args.population, args.seed + 1, args.mutations)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as gamestates:
+        # Anything eval_genomes or a recording writes goes here instead of the real game states
+        main.GAMESTATES_PATH = gamestates
+        print("Single games...")
+        results["single_game_ticks_per_s"] = bench_single_game(main, genomes_tarnished, genomes_margit, args.games, args.repeat)
+        print("Serial generations...")
+        results["serial_generation_s"] = bench_generation(main, genomes_tarnished, genomes_margit, args.repeat)
+        if args.workers != 1:
+            print("Pool generations...")
+            results["pool_generation_s"] = bench_generation(main, genomes_tarnished, genomes_margit, args.repeat,
+                                                            workers=args.workers, chunksize=args.chunksize)
+        try:
+            print("Batched generations...")
+            results["batched_generation_s"] = bench_batched(main, genomes_tarnished, genomes_margit, args.repeat)
+        except ImportError as e:
+            print(f"Skipping the batched backend: {e}")
+        print("Memory...")
+        results["peak_alloc_mb"] = bench_peak_alloc(main, genomes_tarnished, genomes_margit)
+        print("Recordings...")
+        results["bytes_per_game"] = bench_bytes_per_game(main, genomes_tarnished, genomes_margit, args.games, args.seed, False)
+        results["bytes_per_game_action_log"] = bench_bytes_per_game(main, genomes_tarnished, genomes_margit, args.games, args.seed, True)
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    return {
+        "benchmark_version": BENCHMARK_VERSION,
+        "game_version": main.GAME_VERSION,
+        "fitness_version": main.FITNESS_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {key: getattr(args, key) for key in ("seed", "population", "mutations", "games", "repeat", "workers", "chunksize")},
+        "results": results,
+    }
+
+
+### Comparing ###
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list[str]:
+    """Print every metric next to its baseline.
+
+    Returns:
+        list[str]: Metrics that got worse by more than tolerance (a fraction of the baseline)
+    """
+    if baseline.get("settings") != current["settings"]:
+        print(f"Warning, the baseline was run with different settings: {baseline.get('settings')}")
+    regressions = []
+    for metric, (unit, higher_is_better) in METRICS.items():
+        old = baseline["results"].get(metric)
+        new = current["results"].get(metric)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(metric)
+        print(f"  {metric:<26} {old:12.2f} -> {new:12.2f} {unit:<8} {100 * change:+6.1f}%{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Reproducible games/s benchmark of the simulator, needs no display")
+    parser.add_argument("--seed", type=int, default=0, help="Seeds the genomes and every game")
+    parser.add_argument("--population", type=int, default=50, help="Matches per generation")
+    parser.add_argument("--mutations", type=int, default=20, help="Mutations applied to each fresh genome")
+    parser.add_argument("--games", type=int, default=10, help="Games for the single game and recording benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each timing, the best (or median) is kept")
+    parser.add_argument("-w", "--workers", type=int, default=0, help="Pool workers, 0 uses one per core, 1 skips the pool")
+    parser.add_argument("--chunksize", type=int, default=4)
+    parser.add_argument("-o", "--output", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="How much worse than the baseline a metric can get before it is flagged, as a fraction")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args)
+    for metric, value in current["results"].items():
+        print(f"  {metric:<26} {value:12.2f} {METRICS[metric][0]}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=4)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared to {args.compare}:")
+        regressions = compare(baseline, current, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions past {100 * args.tolerance:.0f}%: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions")
@@ -0,0 +1,111 @@
+import atexit
+import gzip
+import os
+import queue
+import threading
+
+
+class CheckpointWriteError(Exception):
+    """A background checkpoint write failed."""
+
+
+class BackgroundCheckpointWriter:
+    """Compresses and writes checkpoints on a background thread.
+
+    The training thread only pickles the checkpoint into memory (a consistent snapshot,
+    since the population keeps changing once training continues) and hands the bytes over.
+    Compressing, writing and the atomic rename into place happen here, off the critical path.
+
+    Files are gzip'd pickles exactly like neat.Checkpointer writes them, so
+    neat.Checkpointer.restore_checkpoint reads them as usual.
+
+    Args:
+        compresslevel (int): gzip level, neat.Checkpointer uses 5
+    """
+
+    def __init__(self, compresslevel: int = 5):
+        self.compresslevel = compresslevel
+        self._queue = queue.Queue()
+        self._errors = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+        # Daemon threads get killed at exit, so make sure the last checkpoint lands first
+        atexit.register(self.close)
+
+    def submit(self, path: str, data: bytes):
+        """Queue a pickled checkpoint to be written to path.
+
+        Raises:
+            CheckpointWriteError: If an earlier write failed
+        """
+        self.submit_call(path, self._write, path, data)
+
+    def submit_call(self, name: str, func, *args):
+        """Queue any other checkpoint work, like saving into a GenomeStore, to run on the writer thread.
+
+        Whatever args hold must already be a snapshot, training carries on changing the originals.
+
+        Args:
+            name (str): What is being written, for error messages
+            func (callable): Called as func(*args) on the writer thread, in submission order
+
+        Raises:
+            CheckpointWriteError: If an earlier write failed
+        """
+        self._raise_errors()
+        if self._closed:
+            raise CheckpointWriteError(f"Checkpoint writer is closed, can't write {name}")
+        self._queue.put((name, func, args))
+
+    def flush(self):
+        """Block until every queued checkpoint is on disk.
+
+        Raises:
+            CheckpointWriteError: If any of the writes failed
+        """
+        self._queue.join()
+        self._raise_errors()
+
+    def close(self):
+        """Finish the queued writes and stop the thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_errors()
+
+    def _raise_errors(self):
+        if self._errors:
+            errors, self._errors = self._errors, []
+            raise CheckpointWriteError("; ".join(errors))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                _, func, args = item
+                func(*args)
+            except Exception as e:
+                message = f"Failed to write checkpoint {item[0]}: {e}"
+                # Report it straight away too, the next submit/flush might be a while off
+                print(message)
+                self._errors.append(message)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path: str, data: bytes):
+        directory, name = os.path.split(path)
+        # Hidden temp file next to the real one, so the rename is atomic and half written
+        # checkpoints never show up to get_newest_checkpoint_file
+        tmp_path = os.path.join(directory, f".{name}.tmp")
+        with open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(filename=name, mode="wb", compresslevel=self.compresslevel, fileobj=raw) as f:
+                f.write(data)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
@@ -0,0 +1,88 @@
+"""Steps two NEAT populations through their generations together.
+
+Every game scores both sides, so instead of each population running its own generations
+against the other's frozen population (and throwing the other side's fitness away), one
+shared set of matches per generation evaluates both populations at once.
+
+The generation loop is neat.Population.run split in two: evaluate both, then (unless one
+of them hit its fitness threshold) breed and speciate both. Reporters see the same calls
+in the same order as they would from Population.run, so StdOutReporter, StatisticsReporter
+and the checkpointers work unchanged.
+"""
+import neat
+
+
+def _evaluated(population: neat.Population) -> bool:
+    """Report a freshly evaluated generation and track its best genome.
+
+    Returns:
+        bool: Whether the population reached its fitness threshold
+    """
+    best = None
+    for genome in population.population.values():
+        if best is None or genome.fitness > best.fitness:
+            best = genome
+    population.reporters.post_evaluate(population.config, population.population, population.species, best)
+
+    # Track the best genome ever seen.
+    if population.best_genome is None or best.fitness > population.best_genome.fitness:
+        population.best_genome = best
+
+    if not population.config.no_fitness_termination:
+        fv = population.fitness_criterion(g.fitness for g in population.population.values())
+        if fv >= population.config.fitness_threshold:
+            population.reporters.found_solution(population.config, population.generation, best)
+            return True
+    return False
+
+
+def _advance(population: neat.Population):
+    """Breed and speciate the next generation, like the second half of Population.run.
+    """
+    config = population.config
+    population.population = population.reproduction.reproduce(config, population.species, config.pop_size, population.generation)
+
+    if not population.species.species:
+        population.reporters.complete_extinction()
+        if config.reset_on_extinction:
+            population.population = population.reproduction.create_new(config.genome_type, config.genome_config, config.pop_size)
+        else:
+            raise neat.CompleteExtinctionException()
+
+    population.species.speciate(config, population.population, population.generation)
+    population.reporters.end_generation(config, population.population, population.species)
+    population.generation += 1
+
+
+def run_coevolution(population_tarnished: neat.Population, population_margit: neat.Population, fitness_function, n: int) -> tuple:
+    """Run both populations for n generations off one set of matches per generation.
+
+    Stops early if either population reaches its fitness threshold, like Population.run would.
+
+    Args:
+        population_tarnished (neat.Population): Tarnished's population
+        population_margit (neat.Population): Margit's population
+        fitness_function (callable): eval_genomes style function, given both genome lists and both configs,
+                                     that assigns fitness to every genome of both
+        n (int): Number of generations
+
+    Returns:
+        tuple: <best tarnished genome, best margit genome> seen so far
+    """
+    populations = (population_tarnished, population_margit)
+    for _ in range(n):
+        for population in populations:
+            population.reporters.start_generation(population.generation)
+
+        fitness_function(list(population_tarnished.population.items()), list(population_margit.population.items()),
+                         population_tarnished.config, population_margit.config)
+
+        # Both get reported before either stops us, so a solution doesn't hide the other side's stats
+        solved = [_evaluated(population) for population in populations]
+        if any(solved):
+            break
+
+        for population in populations:
+            _advance(population)
+
+    return population_tarnished.best_genome, population_margit.best_genome
@@ -0,0 +1,227 @@
+"""Trains both trainers at the same time, each in its own process, against snapshots of the other.
+
+The alternating schedule leaves one population idle while the other trains. Here each
+trainer runs its own neat Population.run in its own process, with its own reporters and
+checkpointer. It plays against a frozen snapshot of the other side's population, which
+that side publishes into a shared folder:
+
+    tarnished process                 snapshots/                  margit process
+        publish every K gens  ----->  tarnished.pkl.gz  ----->  reloaded when it changes
+        reloaded when it changes <--  margit.pkl.gz     <-----  publish every K gens
+
+Snapshots are published every snapshot_interval generations. A side can be at most
+max_staleness generations ahead of the newest snapshot it plays against. Past that it waits
+for the other side to publish a newer one. A snapshot is the population its side is about
+to evaluate, like population.population is in the alternating schedule. The snapshot's
+generation is how many generations that side has finished, the same number its
+OneIndexedCheckpointer names checkpoints by.
+"""
+import gzip
+import multiprocessing
+import os
+import pickle
+import queue
+import time
+import traceback
+
+import neat
+
+SNAPSHOT_VERSION = 1
+# Seconds between looking for a newer snapshot while waiting on one
+SNAPSHOT_POLL_INTERVAL = 0.5
+# Seconds a side gets to stop after being terminated before it is killed
+TERMINATE_TIMEOUT = 5
+
+
+class SnapshotStore:
+    """Newest published population of each trainer, in a folder both processes can see.
+
+    Args:
+        root (str): Folder for the snapshots, like a run's checkpoint folder + "/snapshots"
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        # trainer -> (file's mtime, snapshot), so unchanged snapshots aren't loaded again
+        self._loaded = {}
+
+    def _path(self, trainer: str) -> str:
+        return os.path.join(self.root, f"{trainer}.pkl.gz")
+
+    def publish(self, trainer: str, generation: int, population: dict, finished: bool = False):
+        """Replace the trainer's snapshot. Written aside and renamed in, so readers never see half of one.
+
+        Args:
+            trainer (str): Whose population this is
+            generation (int): Generations that side has finished
+            population (dict): genome key -> genome
+            finished (bool): The side is done training, nobody should wait on it for a newer one
+        """
+        path = self._path(trainer)
+        tmp_path = os.path.join(self.root, f".{trainer}.{os.getpid()}.tmp")
+        snapshot = {"version": SNAPSHOT_VERSION, "generation": generation, "population": population, "finished": finished}
+        with gzip.open(tmp_path, "wb", compresslevel=1) as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def latest(self, trainer: str) -> dict:
+        """The trainer's newest snapshot, or None if it hasn't published one.
+        """
+        try:
+            mtime = os.stat(self._path(trainer)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        loaded = self._loaded.get(trainer)
+        if loaded is None or loaded[0] != mtime:
+            with gzip.open(self._path(trainer)) as f:
+                loaded = self._loaded[trainer] = (mtime, pickle.load(f))
+        return loaded[1]
+
+    def wait_for(self, trainer: str, min_generation: int = None, stop: multiprocessing.Event = None) -> dict:
+        """The trainer's newest snapshot, once it is from min_generation or later (or the trainer is finished).
+
+        Raises:
+            RuntimeError: If stop gets set while waiting
+        """
+        while True:
+            snapshot = self.latest(trainer)
+            if snapshot is not None and (min_generation is None or snapshot["finished"]
+                                         or snapshot["generation"] >= min_generation):
+                return snapshot
+            if stop is not None and stop.is_set():
+                raise RuntimeError(f"Stopped while waiting for a snapshot of {trainer}")
+            time.sleep(SNAPSHOT_POLL_INTERVAL)
+
+
+class SnapshotPublisher(neat.reporting.BaseReporter):
+    """Publishes its population's snapshot every interval generations.
+
+    Args:
+        store (SnapshotStore): Where to
+        trainer (str): Whose population this reporter is added to
+        interval (int): Generations between snapshots
+    """
+
+    def __init__(self, store: SnapshotStore, trainer: str, interval: int = 1):
+        self.store = store
+        self.trainer = trainer
+        self.interval = max(1, interval)
+        self.generation = 0
+
+    def start_generation(self, generation):
+        self.generation = generation
+
+    def end_generation(self, config, population, species_set):
+        finished = self.generation + 1
+        if finished % self.interval == 0:
+            self.store.publish(self.trainer, finished, population)
+
+
+def _train_side(index: int, trainers: tuple, populations: list, n: int, fitness_function, store: SnapshotStore,
+                snapshot_interval: int, max_staleness: int, stop, events, initializer, finalizer):
+    """Runs one trainer's population inside its own process.
+    """
+    trainer = trainers[index]
+    other = 1 - index
+    population = populations[index]
+    other_config = populations[other].config
+    try:
+        if initializer:
+            initializer(index, population)
+        population.add_reporter(SnapshotPublisher(store, trainer, snapshot_interval))
+
+        def evaluate(genomes, config):
+            finished = population.generation
+            needed = None if max_staleness is None else finished - max_staleness
+            snapshot = store.wait_for(trainers[other], needed, stop)
+            # In the fitness function's order, tarnished first
+            side_genomes = [None, None]
+            side_configs = [None, None]
+            side_genomes[index], side_configs[index] = genomes, config
+            side_genomes[other], side_configs[other] = list(snapshot["population"].items()), other_config
+            fitness_function(side_genomes[0], side_genomes[1], side_configs[0], side_configs[1])
+            events.put(("generation", trainer, finished + 1, snapshot["generation"]))
+
+        population.run(evaluate, n)
+        # Whatever it ended on, and nobody waits on us from here on
+        store.publish(trainer, population.generation, population.population, finished=True)
+        events.put(("done", trainer, population.generation, None))
+    except Exception:
+        stop.set()
+        events.put(("error", trainer, None, traceback.format_exc()))
+    finally:
+        if finalizer:
+            finalizer(index)
+
+
+def run_concurrent(trainers: tuple, populations: list, generations: list, fitness_function, store: SnapshotStore,
+                   snapshot_interval: int = 1, max_staleness: int = 2, initializer=None, finalizer=None, on_event=None):
+    """Train both populations at once, one process each, until both have run their generations.
+
+    Args:
+        trainers (tuple): Names of the two sides, in the fitness function's order, like ("Tarnished", "Margit")
+        populations (list[neat.Population]): Both populations, same order. Reporters added
+                                             beforehand (like checkpointers) run in the side's process
+        generations (list[int]): Generations each side is to run
+        fitness_function (callable): eval_genomes style function, both genome lists then both configs
+        store (SnapshotStore): Where the sides publish their snapshots
+        snapshot_interval (int): Generations between a side's snapshots
+        max_staleness (int): Most generations a side plays ahead of its opponent's snapshot. None never waits
+        initializer (callable): Called as initializer(index, population) in each side's process before it trains
+        finalizer (callable): Called as finalizer(index) in each side's process once it stops, however it stops
+        on_event (callable): Called in this process as on_event(kind, trainer, generation, other_generation)
+                             for every "generation" a side finishes and when it is "done"
+
+    Returns:
+        list[int]: Generation each side ended on
+    """
+    if max_staleness is not None and max_staleness < snapshot_interval:
+        # Both sides could end up waiting on a snapshot the other is waiting to publish
+        raise ValueError(f"max_staleness ({max_staleness}) can't be less than snapshot_interval ({snapshot_interval})")
+
+    # Both sides start against each other's starting populations
+    for trainer, population in zip(trainers, populations):
+        store.publish(trainer, population.generation, population.population)
+
+    stop = multiprocessing.Event()
+    events = multiprocessing.Queue()
+    processes = []
+    for index in range(2):
+        process = multiprocessing.Process(
+            target=_train_side, name=f"train-{trainers[index]}",
+            args=(index, trainers, populations, generations[index], fitness_function, store,
+                  snapshot_interval, max_staleness, stop, events, initializer, finalizer))
+        process.start()
+        processes.append(process)
+
+    ended = {}
+    try:
+        while len(ended) < 2:
+            try:
+                kind, trainer, generation, detail = events.get(timeout=1)
+            except queue.Empty:
+                for process in processes:
+                    if process.exitcode not in (None, 0):
+                        raise RuntimeError(f"{process.name} exited with code {process.exitcode}")
+                continue
+            if kind == "error":
+                raise RuntimeError(f"Training {trainer} failed:\n{detail}")
+            if kind == "done":
+                ended[trainer] = generation
+            if on_event:
+                on_event(kind, trainer, generation, detail)
+    except BaseException:
+        stop.set()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            # pygame catches SIGTERM in processes that initialised it, so it might not stop them
+            process.join(TERMINATE_TIMEOUT)
+            if process.exitcode is None:
+                process.kill()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+    return [ended[trainer] for trainer in trainers]
@@ -0,0 +1,405 @@
+"""Game evaluation spread over worker processes connected by TCP, possibly on other machines.
+
+A Coordinator listens for workers and has the same map/close/terminate interface as
+EvaluationPool, so eval_genomes hands it its games the same way. Workers connect
+whenever they like, run the coordinator's initializer, and then play the tasks they are
+sent one after another:
+
+    coordinator                         worker
+        <------------------------------ hello (name)
+        init (initializer, initargs) -->
+        task (id, func, args) --------->
+        <------------------------------ result (id, value) / error (id, traceback)
+        <------------------------------ heartbeat, every HEARTBEAT_INTERVAL
+
+Every message is a length prefixed pickle. A worker whose connection drops, or that goes
+quiet for HEARTBEAT_TIMEOUT, is dropped and its unfinished tasks go to the other workers,
+so a generation still completes when a worker is killed partway through. A task only
+counts once, whichever worker finishes it first.
+
+Functions are pickled by reference, so workers have to be able to import them the same
+way the coordinator does. For training that means running main.py on both ends
+(main.py --listen on the coordinator, main.py --connect on the workers).
+
+Pickles run code when they are loaded, so only ever listen on a network you trust.
+"""
+from argparse import ArgumentParser
+import collections
+import os
+import pickle
+import selectors
+import socket
+import struct
+import subprocess
+import threading
+import time
+import traceback
+
+# Length prefix of every message
+HEADER = struct.Struct(">I")
+# Seconds between a worker's heartbeats, and without hearing anything before it is dropped
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_TIMEOUT = 15.0
+
+
+def send_message(sock: socket.socket, message: tuple):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def recv_message(sock: socket.socket) -> tuple:
+    """Block until a whole message has arrived.
+    """
+    (size,) = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    return pickle.loads(_recv_exactly(sock, size))
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    """"host:port" or ":port" (all interfaces) to (host, port).
+    """
+    host, _, port = address.rpartition(":")
+    return host, int(port)
+
+
+class RemoteError(Exception):
+    """A task raised on a worker. Carries the worker's traceback.
+    """
+
+
+class _Worker:
+    """Coordinator side of one connected worker.
+    """
+
+    def __init__(self, sock: socket.socket, address):
+        self.sock = sock
+        self.name = f"{address[0]}:{address[1]}"
+        self.buffer = bytearray()
+        self.last_seen = time.monotonic()
+        # Task ids sent to it and not answered yet
+        self.in_flight = set()
+        self.done = 0
+        self.total_done = 0
+
+    def feed(self) -> list[tuple]:
+        """Read what has arrived and return every complete message.
+        """
+        chunk = self.sock.recv(1 << 16)
+        if not chunk:
+            raise EOFError("connection closed")
+        self.buffer += chunk
+        self.last_seen = time.monotonic()
+        messages = []
+        while len(self.buffer) >= HEADER.size:
+            (size,) = HEADER.unpack_from(self.buffer)
+            if len(self.buffer) < HEADER.size + size:
+                break
+            messages.append(pickle.loads(self.buffer[HEADER.size:HEADER.size + size]))
+            del self.buffer[:HEADER.size + size]
+        return messages
+
+
+class Coordinator:
+    """Hands tasks out to TCP workers and gathers their results, in task order.
+
+    Args:
+        host (str): Interface to listen on. "" listens on all of them
+        port (int): Port to listen on. 0 picks a free one, see address
+        prefetch (int): Tasks a worker gets ahead of time, so it never waits on us between games
+        initializer (callable): Called once in every worker as it joins, like EvaluationPool's
+        initargs (tuple): Arguments for the initializer
+        verbose (bool): Print workers joining and leaving, and their throughput after every map
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, prefetch: int = 2, initializer=None,
+                 initargs: tuple = (), verbose: bool = True):
+        self.prefetch = max(1, prefetch)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.verbose = verbose
+
+        self._server = socket.create_server((host, port))
+        self._server.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._server, selectors.EVENT_READ, None)
+        self._workers: dict[socket.socket, _Worker] = {}
+        self._local = []
+        self._map_id = 0
+        self._closed = False
+        self.lost = 0
+        self.redispatched = 0
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._server.getsockname()[:2]
+
+    @property
+    def workers(self) -> int:
+        """Connected workers right now, like EvaluationPool.workers.
+        """
+        return len(self._workers)
+
+    def _log(self, message: str):
+        if self.verbose:
+            print(message)
+
+    ### Workers ###
+
+    def start_local_workers(self, count: int, command: list[str]):
+        """Start workers as processes on this machine, for testing or to use its cores too.
+
+        Args:
+            count (int): How many
+            command (list[str]): Command that runs a worker connected to address, like
+                                 [sys.executable, "main.py", "--headless", "--connect", "127.0.0.1:PORT"]
+        """
+        for _ in range(count):
+            self._local.append(subprocess.Popen(command))
+
+    def _accept(self):
+        sock, address = self._server.accept()
+        sock.setblocking(True)
+        sock.settimeout(HEARTBEAT_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        worker = _Worker(sock, address)
+        try:
+            send_message(sock, ("init", self.initializer, self.initargs))
+        except OSError:
+            sock.close()
+            return
+        self._workers[sock] = worker
+        self._selector.register(sock, selectors.EVENT_READ, worker)
+
+    def _drop(self, worker: _Worker, reason: str, pending: collections.deque = None):
+        """Forget a worker. Its unanswered tasks go back to the front of the queue.
+        """
+        self._selector.unregister(worker.sock)
+        del self._workers[worker.sock]
+        worker.sock.close()
+        self.lost += 1
+        lost_tasks = [index for map_id, index in worker.in_flight if map_id == self._map_id]
+        if pending is not None and lost_tasks:
+            pending.extendleft(lost_tasks)
+            self.redispatched += len(lost_tasks)
+        self._log(f"Lost worker {worker.name} ({reason}), {len(lost_tasks)} tasks handed to other workers")
+
+    ### Running tasks ###
+
+    def map(self, func, tasks: list) -> list:
+        """Run func(task) for every task on the workers, keeping the task order in the results.
+
+        Blocks until every task has a result, waiting for workers to (re)connect if it has to.
+
+        Args:
+            func (callable): Top level (picklable) function that plays a single task
+            tasks (list): Arguments for each call of func
+        """
+        if self._closed:
+            raise RuntimeError("Coordinator has already been shut down")
+        self._map_id += 1
+        map_id = self._map_id
+        results = [None] * len(tasks)
+        finished = [False] * len(tasks)
+        remaining = len(tasks)
+        pending = collections.deque(range(len(tasks)))
+
+        start = time.monotonic()
+        for worker in self._workers.values():
+            # Nothing reads from them between maps, so don't hold that against them
+            worker.last_seen = start
+            worker.done = 0
+        waiting_since = None
+
+        while remaining:
+            # Keep every worker topped up to prefetch tasks
+            for worker in list(self._workers.values()):
+                while pending and len(worker.in_flight) < self.prefetch:
+                    index = pending.popleft()
+                    if finished[index]:
+                        continue
+                    try:
+                        send_message(worker.sock, ("task", (map_id, index), func, tasks[index]))
+                    except OSError as e:
+                        pending.appendleft(index)
+                        self._drop(worker, f"send failed: {e}", pending)
+                        break
+                    worker.in_flight.add((map_id, index))
+
+            if not self._workers:
+                if waiting_since is None:
+                    waiting_since = time.monotonic()
+                    self._log(f"Waiting for workers to connect to {self.address[0]}:{self.address[1]}")
+            else:
+                waiting_since = None
+
+            for key, _ in self._selector.select(timeout=HEARTBEAT_INTERVAL):
+                if key.data is None:
+                    self._accept()
+                    continue
+                worker = key.data
+                try:
+                    messages = worker.feed()
+                except (EOFError, OSError) as e:
+                    self._drop(worker, str(e) or type(e).__name__, pending)
+                    continue
+                for message in messages:
+                    kind = message[0]
+                    if kind == "hello":
+                        worker.name = message[1]
+                        self._log(f"Worker {worker.name} joined")
+                    elif kind in ("result", "error"):
+                        task_id, value = message[1], message[2]
+                        worker.in_flight.discard(task_id)
+                        task_map, index = task_id
+                        if task_map != map_id or finished[index]:
+                            # A lost task that was handed to someone else and finished there first
+                            continue
+                        if kind == "error":
+                            raise RemoteError(f"Task {index} failed on worker {worker.name}:\n{value}")
+                        results[index] = value
+                        finished[index] = True
+                        remaining -= 1
+                        worker.done += 1
+                        worker.total_done += 1
+
+            now = time.monotonic()
+            for worker in list(self._workers.values()):
+                if now - worker.last_seen > HEARTBEAT_TIMEOUT:
+                    self._drop(worker, f"no heartbeat for {now - worker.last_seen:.0f}s", pending)
+
+        self._report(time.monotonic() - start)
+        return results
+
+    def _report(self, elapsed: float):
+        if not self.verbose or not self._workers:
+            return
+        rates = ", ".join(f"{worker.name} {worker.done} ({worker.done / elapsed if elapsed else 0:.2f}/s)"
+                          for worker in self._workers.values())
+        print(f"Workers: {rates}")
+
+    def stats(self) -> dict:
+        """Tasks finished per connected worker, and workers and tasks lost so far.
+        """
+        return {
+            "workers": {worker.name: {"last_map": worker.done, "total": worker.total_done}
+                        for worker in self._workers.values()},
+            "lost_workers": self.lost,
+            "redispatched_tasks": self.redispatched,
+        }
+
+    ### Shutting down ###
+
+    def close(self):
+        """Tell the workers to stop and stop listening.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for worker in list(self._workers.values()):
+            try:
+                send_message(worker.sock, ("stop",))
+            except OSError:
+                pass
+        self._shutdown()
+        for process in self._local:
+            try:
+                process.wait(timeout=HEARTBEAT_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def terminate(self):
+        """Stop right away, killing any local workers.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._shutdown()
+        for process in self._local:
+            process.kill()
+            process.wait()
+
+    def _shutdown(self):
+        for worker in list(self._workers.values()):
+            worker.sock.close()
+        self._workers.clear()
+        self._selector.close()
+        self._server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+### Worker side ###
+
+def run_worker(host: str, port: int, name: str = None) -> int:
+    """Connect to a coordinator and play the tasks it sends until it says to stop or goes away.
+
+    Returns:
+        int: Tasks played
+    """
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    send_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def send(message):
+        with send_lock:
+            send_message(sock, message)
+
+    def heartbeat():
+        # Games can take longer than the timeout, so this keeps going while one is played
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                send(("heartbeat",))
+            except OSError:
+                return
+
+    send(("hello", name or f"{socket.gethostname()}-{os.getpid()}"))
+    played = 0
+    try:
+        _, initializer, initargs = recv_message(sock)
+        if initializer:
+            initializer(*initargs)
+        threading.Thread(target=heartbeat, name="heartbeat", daemon=True).start()
+        while True:
+            message = recv_message(sock)
+            if message[0] == "stop":
+                break
+            _, task_id, func, task = message
+            try:
+                send(("result", task_id, func(task)))
+            except Exception:
+                send(("error", task_id, traceback.format_exc()))
+            played += 1
+    except (EOFError, ConnectionError):
+        # The coordinator went away, nothing left to do
+        pass
+    finally:
+        stopped.set()
+        sock.close()
+    return played
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Evaluation worker for tasks whose functions can be imported from here. "
+                                        "Training workers are started with main.py --connect instead")
+    parser.add_argument("address", help="Coordinator's host:port")
+    parser.add_argument("--name", default=None, help="How the coordinator calls this worker, host-pid by default")
+    args = parser.parse_args()
+    host, port = parse_address(args.address)
+    print(f"Played {run_worker(host, port, args.name)} tasks")
@@ -0,0 +1,176 @@
+"""Early stopping for games that aren't going anywhere.
+
+A game that nobody is going to win still runs all the way to MAX_UPDATES_PER_GAME before
+it is called a stalemate, and early on (both networks idling or spinning in place) those
+games are most of the CPU time. An early stop policy watches the game tick by tick and
+calls it as soon as the rest of it can be predicted:
+
+    no-damage:N     nobody lost any health in the last N ticks
+    stationary:N    neither entity moved more than a pixel, got hurt or attacked in the last N ticks
+    decided:D       nobody can die in the ticks left, even taking D damage every tick
+
+A game stopped early still ends up a stalemate, and its fitness is scored as if the last
+state held for every skipped tick (see FitnessAccumulator.skip), so scores stay comparable
+with games that ran to the end.
+"""
+from collections import Counter
+
+
+class EarlyStopPolicy:
+    """Base class for early stop policies. One instance is reused for every game.
+    """
+    name = "early stop"
+
+    def reset(self, max_updates: int):
+        """Get ready for a new game that runs at most max_updates ticks.
+        """
+        self.max_updates = max_updates
+
+    def check(self, updates: int, tarnished, margit) -> bool:
+        """Called after every tick, once both entities have updated.
+
+        Args:
+            updates (int): Ticks played so far
+            tarnished (Tarnished): Tarnished
+            margit (Margit): Margit
+
+        Returns:
+            bool: Whether the game should stop here
+        """
+        raise NotImplementedError
+
+
+class NoDamagePolicy(EarlyStopPolicy):
+    """Stops when neither side has lost health for a number of ticks.
+
+    Args:
+        ticks (int): Ticks without damage before stopping
+    """
+    name = "no-damage"
+
+    def __init__(self, ticks: int):
+        self.ticks = ticks
+
+    def reset(self, max_updates: int):
+        super().reset(max_updates)
+        self.healths = None
+        self.since = 0
+
+    def check(self, updates: int, tarnished, margit) -> bool:
+        healths = (tarnished.health, margit.health)
+        if healths != self.healths:
+            self.healths = healths
+            self.since = updates
+        return updates - self.since >= self.ticks
+
+
+class StationaryPolicy(EarlyStopPolicy):
+    """Stops when both entities have stayed put, and nothing else happened, for a number of ticks.
+
+    Turning on the spot still counts as stationary, spinning in place is the usual way to idle.
+    Standing still while fighting doesn't: losing health, being busy with an action (like a
+    slash) or having daggers in flight all start the count over, since any of them can still
+    decide the game.
+
+    Args:
+        ticks (int): Ticks without moving before stopping
+        tolerance (float): Pixels an entity can drift and still count as stationary
+    """
+    name = "stationary"
+
+    def __init__(self, ticks: int, tolerance: float = 1.0):
+        self.ticks = ticks
+        self.tolerance = tolerance
+
+    def reset(self, max_updates: int):
+        super().reset(max_updates)
+        self.anchor = None
+        self.healths = None
+        self.since = 0
+
+    def check(self, updates: int, tarnished, margit) -> bool:
+        position = (tarnished.x, tarnished.y, margit.x, margit.y)
+        healths = (tarnished.health, margit.health)
+        fighting = tarnished.busy() or margit.busy() or bool(getattr(margit, "daggers", None))
+        if (self.anchor is None or fighting or healths != self.healths
+                or any(abs(a - b) > self.tolerance for a, b in zip(position, self.anchor))):
+            self.anchor = position
+            self.healths = healths
+            self.since = updates
+        return updates - self.since >= self.ticks
+
+
+class DecidedPolicy(EarlyStopPolicy):
+    """Stops once neither side can be killed in the ticks that are left.
+
+    Args:
+        max_damage_per_tick (float): Most damage either side can take in a single tick
+    """
+    name = "decided"
+
+    def __init__(self, max_damage_per_tick: float):
+        self.max_damage_per_tick = max_damage_per_tick
+
+    def check(self, updates: int, tarnished, margit) -> bool:
+        reachable = (self.max_updates - updates) * self.max_damage_per_tick
+        return min(tarnished.health, margit.health) > reachable
+
+
+POLICIES = {
+    NoDamagePolicy.name: NoDamagePolicy,
+    StationaryPolicy.name: StationaryPolicy,
+    DecidedPolicy.name: DecidedPolicy,
+}
+
+
+def make_policies(specs: list[str]) -> list[EarlyStopPolicy]:
+    """Build policies from name:value specs, like ["no-damage:300", "stationary:120"].
+    """
+    policies = []
+    for spec in specs or []:
+        name, _, value = spec.partition(":")
+        if name not in POLICIES:
+            raise ValueError(f"Unknown early stop policy {name!r}, pick from {list(POLICIES)}")
+        if not value:
+            raise ValueError(f"Early stop policy {name!r} needs a value, like {name}:100")
+        policies.append(POLICIES[name](float(value) if name == DecidedPolicy.name else int(value)))
+    return policies
+
+
+class EarlyStopStats:
+    """Tally of games stopped early and the ticks that saved.
+    """
+
+    def __init__(self):
+        self.games = 0
+        self.ticks_played = 0
+        self.ticks_skipped = 0
+        self.stopped = Counter()
+
+    def add(self, ticks_played: int, ticks_skipped: int = 0, reason: str = None):
+        self.games += 1
+        self.ticks_played += ticks_played
+        self.ticks_skipped += ticks_skipped
+        if reason:
+            self.stopped[reason] += 1
+
+    def merge(self, other: "EarlyStopStats"):
+        self.games += other.games
+        self.ticks_played += other.ticks_played
+        self.ticks_skipped += other.ticks_skipped
+        self.stopped.update(other.stopped)
+
+    def take(self) -> "EarlyStopStats":
+        """Hand over the tally so far and start a fresh one.
+        """
+        taken = EarlyStopStats()
+        taken.merge(self)
+        self.__init__()
+        return taken
+
+    def __str__(self):
+        total = self.ticks_played + self.ticks_skipped
+        skipped = 100 * self.ticks_skipped / total if total else 0
+        reasons = ", ".join(f"{count} {reason}" for reason, count in self.stopped.most_common())
+        return (f"{sum(self.stopped.values())}/{self.games} games stopped early ({reasons or 'none'}), "
+                f"{self.ticks_skipped} ticks skipped ({skipped:.0f}%)")
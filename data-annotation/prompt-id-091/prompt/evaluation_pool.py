@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+import signal
+
+
+class EvaluationPool:
+    """Long lived pool of game evaluation workers.
+
+    Created once for a whole training run so we only pay for forking and warming up
+    the workers (pygame, neat, settings images) a single time instead of every generation.
+
+    Args:
+        workers (int): Number of worker processes. 0 or None uses one per available core
+        chunksize (int): How many games get handed to a worker at a time
+        cpu_affinity (list[int]): CPUs the workers get pinned to, round robin. None leaves it up to the OS
+        initializer (callable): Called once in every worker after it is started, to warm it up
+        initargs (tuple): Arguments for the initializer
+    """
+
+    def __init__(self, workers: int = None, chunksize: int = 1, cpu_affinity: list[int] = None,
+                 initializer=None, initargs: tuple = ()):
+        self.workers = workers or len(os.sched_getaffinity(0))
+        self.chunksize = max(1, chunksize)
+        self.cpu_affinity = list(cpu_affinity) if cpu_affinity else None
+        self._pool = multiprocessing.Pool(
+            processes=self.workers,
+            initializer=_init_worker,
+            initargs=(self.cpu_affinity, initializer, initargs))
+        self._closed = False
+
+    def map(self, func, tasks: list) -> list:
+        """Run func over every task on the workers, keeping the task order in the results.
+
+        Args:
+            func (callable): Top level (picklable) function that plays a single task
+            tasks (list): Arguments for each call of func
+        """
+        if self._closed:
+            raise RuntimeError("Evaluation pool has already been shut down")
+        return self._pool.map(func, tasks, chunksize=self.chunksize)
+
+    def close(self):
+        """Let the workers finish what they have and shut them down cleanly.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        """Stop the workers right away. Used when we are interrupted mid generation.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+def _init_worker(cpu_affinity, initializer, initargs):
+    """Prepares a freshly started worker before it takes any games.
+    """
+    # Ctrl-C is handled by the main process, which tears the pool down for us.
+    # Otherwise every worker dumps its own KeyboardInterrupt traceback.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if cpu_affinity:
+        # _identity is 1 indexed and keeps counting up if workers ever get replaced
+        worker_num = multiprocessing.current_process()._identity[0] - 1
+        os.sched_setaffinity(0, {cpu_affinity[worker_num % len(cpu_affinity)]})
+
+    if initializer:
+        initializer(*initargs)
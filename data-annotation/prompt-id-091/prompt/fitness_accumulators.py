@@ -0,0 +1,154 @@
+"""Per-tick fitness scoring, fed by play_game as a match goes.
+
+play_game feeds every tick's state to one accumulator per side as the game goes, in the
+same order (and with the same final death update) as they would appear in
+game_result["game_states"], then asks each for its score and details at the end.
+
+Online accumulators would only keep running totals and score a match in constant memory,
+but the fitness functions in fitness.py only come as whole-game functions so far.
+HistoryFitnessAccumulator wraps them and keeps the history for them. Once fitness.py has
+a TarnishedFitnessAccumulator or MargitFitnessAccumulator, make_fitness_accumulators uses
+that instead.
+"""
+import itertools
+from collections.abc import Sequence
+
+import fitness
+
+
+### Accumulators ###
+
+
+class FitnessAccumulator:
+    """Base class for per-tick fitness scorers.
+
+    Subclasses keep whatever running totals they need in reset/update and turn them into
+    the same (score, details) that the whole-game fitness function returns in finish.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Get ready to score a new match. Lets one accumulator be reused across matches.
+        """
+
+    def update(self, state: dict):
+        """Account for one tick.
+
+        Args:
+            state (dict): The tick's state, shaped like an entry of game_result["game_states"]
+        """
+        raise NotImplementedError
+
+    def skip(self, state: dict, ticks: int):
+        """Account for ticks a game stopped early never played, as if its last state held for all of them.
+
+        Accumulators that keep running totals can override this to add up the ticks in one go.
+
+        Args:
+            state (dict): The last state of the game
+            ticks (int): Ticks skipped
+        """
+        for _ in range(ticks):
+            self.update(state)
+
+    def finish(self, game_result: dict) -> tuple[float, dict]:
+        """Score the finished match.
+
+        Args:
+            game_result (dict): The game's result (winner, notes, ...). Its game_states may be empty
+
+        Returns:
+            tuple[float, dict]: <score, fitness details>
+        """
+        raise NotImplementedError
+
+
+class StateHistory(Sequence):
+    """The states of a match, reading like the list play_game used to build.
+
+    A game stopped early has its last state held for the skipped ticks. That's kept as a count
+    instead of the same state appended once per skipped tick.
+    """
+
+    def __init__(self):
+        self.states = []
+        self.held = 0
+
+    def append(self, state):
+        if self.held:
+            # Never happens in play_game, where skipping is the last thing, but keep the order right
+            self.states.extend(itertools.repeat(self.states[-1], self.held))
+            self.held = 0
+        self.states.append(state)
+
+    def hold(self, state, ticks: int):
+        """Add ticks more ticks of state, which is normally the last one already in.
+        """
+        if ticks <= 0:
+            return
+        if not self.states or self.states[-1] is not state:
+            self.append(state)
+            ticks -= 1
+        self.held += ticks
+
+    def __len__(self):
+        return len(self.states) + self.held
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("state index out of range")
+        return self.states[index] if index < len(self.states) else self.states[-1]
+
+    def __iter__(self):
+        yield from self.states
+        if self.held:
+            yield from itertools.repeat(self.states[-1], self.held)
+
+
+class HistoryFitnessAccumulator(FitnessAccumulator):
+    """Adapter for whole-game fitness functions, like get_tarnished_fitness, that need every state.
+
+    Args:
+        fitness_function (callable): Takes a game_result with its game_states and returns (score, details)
+    """
+
+    def __init__(self, fitness_function):
+        self.fitness_function = fitness_function
+        super().__init__()
+
+    def reset(self):
+        self.states = StateHistory()
+
+    def update(self, state: dict):
+        self.states.append(state)
+
+    def skip(self, state: dict, ticks: int):
+        self.states.hold(state, ticks)
+
+    def finish(self, game_result: dict) -> tuple[float, dict]:
+        scored = dict(game_result)
+        scored["game_states"] = self.states
+        return self.fitness_function(scored)
+
+
+def make_fitness_accumulators() -> tuple[FitnessAccumulator, FitnessAccumulator]:
+    """Build the accumulators for both sides of a match.
+
+    Uses the online versions from fitness.py (TarnishedFitnessAccumulator/MargitFitnessAccumulator)
+    when they are there, otherwise falls back to wrapping the whole-game functions.
+
+    Returns:
+        tuple[FitnessAccumulator, FitnessAccumulator]: <tarnished, margit>
+    """
+    accumulators = []
+    for online_name, whole_game in (("TarnishedFitnessAccumulator", fitness.get_tarnished_fitness),
+                                    ("MargitFitnessAccumulator", fitness.get_margit_fitness)):
+        online = getattr(fitness, online_name, None)
+        accumulators.append(online() if online else HistoryFitnessAccumulator(whole_game))
+    return tuple(accumulators)
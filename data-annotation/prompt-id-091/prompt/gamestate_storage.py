@@ -0,0 +1,267 @@
+"""Retention and cleanup for recorded game states.
+
+Every generation gets its own gen_N directory under the game states folder, and without
+anything tidying up they pile up until the disk is full. GameStateStorage decides which
+generations to keep:
+
+    keep_last   the newest N generations are kept whole
+    keep_every  every Kth generation is kept whole too
+    keep_top    of every other generation, only the top K games per trainer are kept
+
+All deleting happens on a background thread. Clearing out the previous run at startup
+just renames it into a hidden trash folder (instant on the same filesystem), so training
+starts straight away while the old files are removed behind it.
+
+Only closed generations are pruned. The alternating schedule plays the same generation
+numbers again for the other trainer, so handing out a generation's directory reopens it,
+and retention leaves it alone until it is finished again. Cutting an archive down also
+holds the archive's lock (see recording.keep_records), like appending to it does.
+"""
+import itertools
+import os
+import queue
+import shutil
+import threading
+
+import recording
+from replay_reader import ReplayReader
+
+TRASH_DIR = ".trash"
+
+
+def _gen_num(name: str):
+    """Generation number of a gen_N directory name, None for anything else.
+    """
+    if name.startswith("gen_") and name[4:].isdigit():
+        return int(name[4:])
+    return None
+
+
+def _ranked_for(header: dict) -> list:
+    """Trainers a game counts towards. Co-evolved games scored every side, so they count for each.
+    """
+    trainer = header["trainer"]
+    if f"{trainer}_fitness" in header:
+        return [trainer]
+    return [key[:-len("_fitness")] for key in header if key.endswith("_fitness")]
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    total += _dir_size(entry.path)
+                else:
+                    total += entry.stat(follow_symlinks=False).st_size
+    except FileNotFoundError:
+        pass
+    return total
+
+
+class GameStateStorage:
+    """Owns the game states folder while training: hands out generation directories and prunes old ones.
+
+    Only generations finished by this run are ever pruned, so game states kept on purpose from
+    earlier runs (SAVE_GAMESTATES) are left alone unless discard_existing is called.
+
+    Args:
+        root (str): Game states folder, GAMESTATES_PATH
+        keep_last (int): Newest generations kept whole. None keeps everything
+        keep_every (int): Also keep every Kth generation whole. 0 keeps none extra
+        keep_top (int): Games per trainer kept from pruned generations. 0 deletes them entirely
+    """
+
+    def __init__(self, root: str, keep_last: int = None, keep_every: int = 0, keep_top: int = 0):
+        self.root = root
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.keep_top = keep_top
+        os.makedirs(root, exist_ok=True)
+
+        # Generations this run has finished, the ones already cut down to their top games,
+        # the ones being written to, and the one being pruned right now
+        self._finished = set()
+        self._trimmed = set()
+        self._open = set()
+        self._pruning = None
+        self._trash_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._pruned = threading.Condition(self._lock)
+        self._sizes = {}
+        self.freed = 0
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="gamestate-cleanup", daemon=True)
+        self._thread.start()
+
+    ### Training thread ###
+
+    def discard_existing(self):
+        """Clear out everything already in the folder without waiting for it to be deleted.
+        """
+        trash = os.path.join(self.root, TRASH_DIR)
+        os.makedirs(trash, exist_ok=True)
+        for name in os.listdir(self.root):
+            if name == TRASH_DIR:
+                continue
+            try:
+                os.replace(os.path.join(self.root, name), os.path.join(trash, f"{os.getpid()}_{next(self._trash_ids)}_{name}"))
+            except OSError as e:
+                print('Failed to delete %s. Reason: %s' % (name, e))
+        # Also picks up anything a previous run didn't get to finish deleting
+        self._queue.put((self._empty_trash, ()))
+
+    def generation_dir(self, generation: int) -> str:
+        """Directory a generation's games get written to. Created if needed.
+
+        The generation is open until finish_generation, and retention won't touch it. If it is
+        being pruned right now (only when a generation number is played again), waits for that.
+        """
+        with self._lock:
+            while self._pruning == generation:
+                self._pruned.wait()
+            self._open.add(generation)
+            self._finished.discard(generation)
+            self._trimmed.discard(generation)
+        path = os.path.join(self.root, f"gen_{generation}")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def finish_generation(self, generation: int):
+        """Mark a generation as done being written, and prune older ones in the background.
+        """
+        with self._lock:
+            self._open.discard(generation)
+            self._finished.add(generation)
+        self._queue.put((self._apply_retention, (generation,)))
+
+    def usage(self) -> dict:
+        """Disk usage as of the last background pass.
+
+        Returns:
+            dict: total bytes, bytes per generation, and bytes freed so far this run
+        """
+        with self._lock:
+            sizes = dict(self._sizes)
+            return {"bytes": sum(sizes.values()), "generations": sizes, "freed": self.freed}
+
+    def flush(self):
+        """Block until every queued cleanup has run.
+        """
+        self._queue.join()
+
+    def close(self):
+        """Finish the queued cleanups and stop the thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    ### Background thread ###
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                task, task_args = item
+                task(*task_args)
+            except Exception as e:
+                # Cleanup failing should never take training down with it
+                print(f"Game state cleanup failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _empty_trash(self):
+        trash = os.path.join(self.root, TRASH_DIR)
+        freed = _dir_size(trash)
+        shutil.rmtree(trash, ignore_errors=True)
+        with self._lock:
+            self.freed += freed
+
+    def _keep_whole(self, generation: int, newest: int) -> bool:
+        if self.keep_last is None or generation > newest - self.keep_last:
+            return True
+        return bool(self.keep_every) and generation % self.keep_every == 0
+
+    def _apply_retention(self, newest: int):
+        with self._lock:
+            finished = sorted(self._finished)
+        for gen in finished:
+            if self._keep_whole(gen, newest):
+                continue
+            with self._lock:
+                # Reopened since, or done already
+                if gen not in self._finished or gen in self._open or gen in self._trimmed:
+                    continue
+                self._pruning = gen
+            try:
+                gen_dir = os.path.join(self.root, f"gen_{gen}")
+                before = _dir_size(gen_dir)
+                if self.keep_top:
+                    self._keep_top_games(gen_dir)
+                else:
+                    shutil.rmtree(gen_dir, ignore_errors=True)
+                freed = before - _dir_size(gen_dir)
+            finally:
+                with self._lock:
+                    self._pruning = None
+                    self._pruned.notify_all()
+            with self._lock:
+                if self.keep_top:
+                    self._trimmed.add(gen)
+                else:
+                    self._finished.discard(gen)
+                self.freed += freed
+        self._account()
+
+    def _keep_top_games(self, gen_dir: str):
+        """Cut a generation down to its keep_top best games for each trainer.
+        """
+        # trainer -> [(fitness, file name, record offset or None)]
+        games = {}
+        for name in os.listdir(gen_dir):
+            path = os.path.join(gen_dir, name)
+            if recording.is_archive(name):
+                for offset, header in recording.iter_headers(path):
+                    for trainer in _ranked_for(header):
+                        games.setdefault(trainer, []).append((header[f"{trainer}_fitness"], name, offset))
+            elif name.endswith(".json"):
+                header = ReplayReader(path).header
+                for trainer in _ranked_for(header):
+                    games.setdefault(trainer, []).append((header[f"{trainer}_fitness"], name, None))
+
+        kept_files = set()
+        kept_offsets = {}
+        for trainer_games in games.values():
+            trainer_games.sort(key=lambda game: game[0], reverse=True)
+            for _, name, offset in trainer_games[:self.keep_top]:
+                if offset is None:
+                    kept_files.add(name)
+                elif offset not in kept_offsets.setdefault(name, []):
+                    kept_offsets[name].append(offset)
+
+        # A co-evolved game is ranked for every trainer, so the same file can be in several lists
+        json_files = {name for trainer_games in games.values() for _, name, offset in trainer_games if offset is None}
+        for name in json_files - kept_files:
+            os.unlink(os.path.join(gen_dir, name))
+        for name in {name for trainer_games in games.values() for _, name, offset in trainer_games if offset is not None}:
+            if name in kept_offsets:
+                recording.keep_records(os.path.join(gen_dir, name), kept_offsets[name])
+            else:
+                os.unlink(os.path.join(gen_dir, name))
+
+    def _account(self):
+        sizes = {}
+        for name in os.listdir(self.root):
+            gen = _gen_num(name)
+            if gen is not None:
+                sizes[gen] = _dir_size(os.path.join(self.root, name))
+        with self._lock:
+            self._sizes = sizes
@@ -0,0 +1,326 @@
+"""Content addressed checkpoint store.
+
+Most genomes (elites, survivors that didn't mutate) are identical from one checkpoint to
+the next, so every unique genome is written once, named by a hash of its contents. A
+checkpoint is then just a small manifest: which genomes made up the population, their
+fitness, the species set (with genome references in place of genomes), and enough
+reproduction state to carry on numbering new genomes.
+
+    <root>/objects/ab/abcdef...     gzip'd pickle of one genome (or config)
+    <root>/manifests/<prefix><gen>  gzip'd pickle of one checkpoint's manifest
+
+Saving and pruning take an exclusive flock on <root>/.lock, so several processes (like
+both trainers of --schedule concurrent) can share a store without one collecting the
+garbage of a checkpoint another is halfway through writing.
+"""
+from argparse import ArgumentParser
+import contextlib
+import copy
+import fcntl
+import gzip
+import hashlib
+import itertools
+import os
+import pickle
+import random
+
+import neat
+
+MANIFEST_VERSION = 1
+
+
+def genome_digest(genome, include_key: bool = True) -> str:
+    """Hash of a genome's structure and weights.
+
+    Args:
+        genome (neat.DefaultGenome): Genome to hash
+        include_key (bool): Whether the genome's key is part of it. Leave it out to compare networks only
+
+    Returns:
+        str: Hex sha256 digest
+    """
+    h = hashlib.sha256()
+    if include_key:
+        h.update(repr(genome.key).encode())
+    # Gene attributes are plain numbers and strings, so their repr is stable
+    for section in (genome.nodes, genome.connections):
+        h.update(b"|")
+        for key in sorted(section):
+            h.update(repr(sorted(vars(section[key]).items())).encode())
+    return h.hexdigest()
+
+
+class _GenomeRef:
+    """Stands in for a genome inside a stored species set.
+    """
+
+    def __init__(self, digest: str, fitness):
+        self.digest = digest
+        self.fitness = fitness
+
+
+class GenomeStore:
+    """Saves and restores checkpoints out of a deduplicated genome store.
+
+    Args:
+        root (str): Directory holding the store, like a run's checkpoint directory
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.objects_dir = os.path.join(root, "objects")
+        self.manifests_dir = os.path.join(root, "manifests")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        # Objects already loaded, so restoring both trainers doesn't read shared ones twice
+        self._loaded = {}
+
+    def __getstate__(self):
+        # Checkpointers holding a store get pickled into every checkpoint (the species set keeps
+        # its reporters), so leave the loaded objects behind
+        state = self.__dict__.copy()
+        state["_loaded"] = {}
+        return state
+
+    @contextlib.contextmanager
+    def _lock(self):
+        """Hold the store to ourselves, against other processes and threads using it.
+        """
+        with open(os.path.join(self.root, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    ### Objects ###
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _put(self, digest: str, obj) -> bool:
+        """Write an object unless it is already stored. True if it was new.
+
+        Always asks the filesystem, since another process may have collected it since we last looked.
+        """
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _atomic_write(path, obj)
+        return True
+
+    def _get(self, digest: str):
+        if digest not in self._loaded:
+            with gzip.open(self._object_path(digest)) as f:
+                self._loaded[digest] = pickle.load(f)
+        # Hand out copies, restored populations are going to be mutated
+        return copy.deepcopy(self._loaded[digest])
+
+    ### Checkpoints ###
+
+    def save(self, prefix: str, generation: int, config, population: dict, species_set, random_state: tuple = None) -> int:
+        """Save a checkpoint, only writing genomes the store hasn't seen before.
+
+        Args:
+            prefix (str): Which trainer this is for, like TARNISHED_CHECKPOINT_PREFIX
+            generation (int): Generation number the checkpoint is named by
+            config (neat.config.Config): The population's config
+            population (dict): genome key -> genome
+            species_set (neat.DefaultSpeciesSet): The population's species
+            random_state (tuple): random.getstate() as of the checkpoint. Defaults to the current one,
+                                  which is only right when saving on the training thread
+
+        Returns:
+            int: Number of new genomes written
+        """
+        with self._lock():
+            return self._save(prefix, generation, config, population, species_set,
+                              random.getstate() if random_state is None else random_state)
+
+    def save_pickled(self, prefix: str, data: bytes) -> int:
+        """Save a checkpoint pickled the way neat.Checkpointer pickles them.
+
+        The training thread only has to pickle the population, a consistent snapshot, and the
+        hashing and writing can happen on a BackgroundCheckpointWriter's thread.
+
+        Args:
+            prefix (str): Which trainer this is for
+            data (bytes): Pickled (generation, config, population, species_set, random state)
+
+        Returns:
+            int: Number of new genomes written
+        """
+        generation, config, population, species_set, random_state = pickle.loads(data)
+        return self.save(prefix, generation, config, population, species_set, random_state)
+
+    def _save(self, prefix: str, generation: int, config, population: dict, species_set, random_state: tuple) -> int:
+        refs = {}
+        new = 0
+        for key, genome in population.items():
+            digest = genome_digest(genome)
+            # Fitness is kept in the manifest, so the stored genome doesn't depend on it
+            new += self._put(digest, _without_fitness(genome))
+            refs[key] = _GenomeRef(digest, genome.fitness)
+
+        config_bytes = pickle.dumps(config, protocol=pickle.HIGHEST_PROTOCOL)
+        config_digest = hashlib.sha256(config_bytes).hexdigest()
+        self._put(config_digest, config)
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "generation": generation,
+            "config": config_digest,
+            "population": refs,
+            "species_set": self._species_with_refs(species_set),
+            "next_genome_key": max(population, default=0) + 1,
+            "random_state": random_state,
+        }
+        _atomic_write(self._manifest_path(prefix, generation), manifest)
+        return new
+
+    def _species_with_refs(self, species_set):
+        stored = copy.copy(species_set)
+        # The reporters (StatisticsReporter's history of every generation, the checkpointers)
+        # would make every manifest bigger than the last. restore hands it the new population's
+        stored.reporters = None
+        stored.species = {}
+        for sid, species in species_set.species.items():
+            s = copy.copy(species)
+            s.members = {key: _GenomeRef(genome_digest(g), g.fitness) for key, g in species.members.items()}
+            if species.representative is not None:
+                rep = species.representative
+                s.representative = _GenomeRef(genome_digest(rep), rep.fitness)
+                self._put(s.representative.digest, _without_fitness(rep))
+            stored.species[sid] = s
+        return stored
+
+    def _resolve(self, ref: _GenomeRef, genomes: dict):
+        """Load a referenced genome, sharing one object per digest like the original population did.
+        """
+        if ref.digest not in genomes:
+            genome = self._get(ref.digest)
+            genome.fitness = ref.fitness
+            genomes[ref.digest] = genome
+        return genomes[ref.digest]
+
+    def restore(self, prefix: str, generation: int) -> neat.Population:
+        """Rebuild the population saved for a generation, like neat.Checkpointer.restore_checkpoint.
+        """
+        with gzip.open(self._manifest_path(prefix, generation)) as f:
+            manifest = pickle.load(f)
+        if manifest["version"] > MANIFEST_VERSION:
+            raise ValueError(f"Checkpoint manifest was written by a newer store (v{manifest['version']})")
+
+        config = self._get(manifest["config"])
+        genomes = {}
+        population = {key: self._resolve(ref, genomes) for key, ref in manifest["population"].items()}
+        species_set = manifest["species_set"]
+        for species in species_set.species.values():
+            species.members = {key: self._resolve(ref, genomes) for key, ref in species.members.items()}
+            if species.representative is not None:
+                species.representative = self._resolve(species.representative, genomes)
+
+        random.setstate(manifest["random_state"])
+        restored = neat.Population(config, (population, species_set, manifest["generation"]))
+        species_set.reporters = restored.reporters
+        # Carry on numbering from where we left off, so new children don't reuse keys
+        restored.reproduction.genome_indexer = itertools.count(manifest["next_genome_key"])
+        return restored
+
+    ### Housekeeping ###
+
+    def _manifest_path(self, prefix: str, generation: int) -> str:
+        return os.path.join(self.manifests_dir, f"{os.path.basename(prefix)}{generation}")
+
+    def generations(self, prefix: str) -> list[int]:
+        """Every generation with a checkpoint for this prefix, oldest first.
+        """
+        prefix = os.path.basename(prefix)
+        gens = []
+        for name in os.listdir(self.manifests_dir):
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                gens.append(int(name[len(prefix):]))
+        return sorted(gens)
+
+    def prune(self, prefix: str, keep_last: int = 1, keep_every: int = 0) -> tuple[int, int]:
+        """Delete old checkpoints for a prefix, then any genomes no remaining checkpoint uses.
+
+        Args:
+            prefix (str): Which trainer's checkpoints to prune
+            keep_last (int): Always keep this many of the newest generations
+            keep_every (int): Also keep every Kth generation. 0 keeps none extra
+
+        Returns:
+            tuple[int, int]: <manifests removed, objects removed>
+        """
+        with self._lock():
+            gens = self.generations(prefix)
+            keep = set(gens[-keep_last:]) if keep_last > 0 else set()
+            if keep_every:
+                keep.update(g for g in gens if g % keep_every == 0)
+            removed = 0
+            for gen in gens:
+                if gen not in keep:
+                    os.unlink(self._manifest_path(prefix, gen))
+                    removed += 1
+            return removed, self._collect_garbage()
+
+    def collect_garbage(self) -> int:
+        """Remove stored objects that no manifest refers to any more.
+        """
+        with self._lock():
+            return self._collect_garbage()
+
+    def _collect_garbage(self) -> int:
+        live = set()
+        for name in os.listdir(self.manifests_dir):
+            if name.startswith("."):
+                continue
+            with gzip.open(os.path.join(self.manifests_dir, name)) as f:
+                manifest = pickle.load(f)
+            live.add(manifest["config"])
+            live.update(ref.digest for ref in manifest["population"].values())
+            for species in manifest["species_set"].species.values():
+                live.update(ref.digest for ref in species.members.values())
+                if species.representative is not None:
+                    live.add(species.representative.digest)
+
+        removed = 0
+        for bucket in os.listdir(self.objects_dir):
+            for digest in os.listdir(os.path.join(self.objects_dir, bucket)):
+                if digest not in live:
+                    os.unlink(os.path.join(self.objects_dir, bucket, digest))
+                    self._loaded.pop(digest, None)
+                    removed += 1
+        return removed
+
+
+def _without_fitness(genome):
+    stored = copy.copy(genome)
+    stored.fitness = None
+    return stored
+
+
+def _atomic_write(path: str, obj):
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    with gzip.open(tmp_path, "wb", compresslevel=5) as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="List or prune checkpoints in a genome store")
+    parser.add_argument("root", help="Store directory, like checkpoints/<fitness version>/run_1/store")
+    parser.add_argument("prefix", help="Checkpoint prefix, like neat-checkpoint-tarnished-")
+    parser.add_argument("--prune", action="store_true", default=False, help="Delete old checkpoints")
+    parser.add_argument("--keep-last", type=int, default=1, help="Newest generations to keep when pruning")
+    parser.add_argument("--keep-every", type=int, default=0, help="Also keep every Kth generation when pruning")
+    args = parser.parse_args()
+
+    store = GenomeStore(args.root)
+    if args.prune:
+        manifests, objects = store.prune(args.prefix, args.keep_last, args.keep_every)
+        print(f"Removed {manifests} checkpoints and {objects} unused objects")
+    print(f"Checkpoints for {args.prefix}: {store.generations(args.prefix)}")
@@ -0,0 +1,122 @@
+"""Replay HUD drawing with cached text and dirty rectangle updates.
+
+draw_replay used to build a SysFont and render every HUD string from scratch each frame,
+then repaint the whole background and push the whole window to the screen. On a big
+window that is most of a frame's time, while nearly all of it is unchanged: the HUD
+strings hardly ever change and the entities cover a small part of the arena.
+
+TextCache keeps fonts per size and rendered surfaces per (string, size, colour). Hud
+draws a frame by only repainting the background under the scene's old and new
+positions (the dirty rects) and under HUD lines whose text changed, and only pushes
+those rects to the display. Every so often (and on the first frame) it does a full
+redraw, so anything drawn outside the dirty rects can't linger.
+"""
+from collections import OrderedDict
+
+import pygame
+
+
+class TextCache:
+    """Fonts and rendered text surfaces, so the same string is only rendered once.
+
+    Args:
+        max_entries (int): Most rendered surfaces kept. The least recently used go first
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._fonts = {}
+        self._surfaces = OrderedDict()
+
+    def font(self, size: int) -> pygame.font.Font:
+        font = self._fonts.get(size)
+        if font is None:
+            font = self._fonts[size] = pygame.font.SysFont(None, size)
+        return font
+
+    def render(self, text: str, size: int, color: tuple) -> pygame.Surface:
+        key = (text, size, tuple(color))
+        surface = self._surfaces.get(key)
+        if surface is None:
+            surface = self._surfaces[key] = self.font(size).render(text, True, color)
+            if len(self._surfaces) > self.max_entries:
+                self._surfaces.popitem(last=False)
+        else:
+            self._surfaces.move_to_end(key)
+        return surface
+
+
+# Shared by draw_text and the HUD, fonts are slow to load
+TEXT_CACHE = TextCache()
+
+
+class Hud:
+    """Draws frames of a scene plus HUD text, updating only the parts of the window that changed.
+
+    Args:
+        background (pygame.Surface): What is underneath everything, like BG
+        full_redraw_interval (int): Frames between full redraws. 0 only does one on the first frame
+        text_cache (TextCache): Where text surfaces come from, TEXT_CACHE unless given
+    """
+
+    def __init__(self, background: pygame.Surface, full_redraw_interval: int = 0, text_cache: TextCache = None):
+        self.background = background
+        self.full_redraw_interval = full_redraw_interval
+        self.text_cache = text_cache or TEXT_CACHE
+        self.invalidate()
+
+    def invalidate(self):
+        """Make the next frame a full redraw, like at the start of a new game.
+        """
+        self._frame = 0
+        self._full = True
+        self._scene_rects = []
+        # (x, y) -> (text surface, its rect) currently on screen
+        self._lines = {}
+
+    def draw_frame(self, surface: pygame.Surface, scene_rects: list, draw_scene, lines: list):
+        """Draw one frame and push it to the display.
+
+        Args:
+            surface (pygame.Surface): The window
+            scene_rects (list[pygame.Rect]): Everywhere draw_scene is going to draw this frame
+            draw_scene (callable): Draws the scene (entities, weapons) onto surface
+            lines (list[tuple]): HUD text as (text, x, y, font size, colour), drawn over the scene
+        """
+        full = self._full or (self.full_redraw_interval and self._frame % self.full_redraw_interval == 0)
+        self._frame += 1
+        self._full = False
+
+        rendered = {}
+        for text, x, y, size, color in lines:
+            text_surface = self.text_cache.render(text, size, color)
+            rendered[(x, y)] = (text_surface, text_surface.get_rect(topleft=(x, y)))
+
+        if full:
+            surface.blit(self.background, (0, 0))
+            draw_scene()
+            for text_surface, rect in rendered.values():
+                surface.blit(text_surface, rect)
+            pygame.display.update()
+        else:
+            # Where the scene was and is going to be, and where a line's text changed or went away
+            restore = self._scene_rects + scene_rects
+            changed = []
+            for slot, (text_surface, rect) in self._lines.items():
+                if rendered.get(slot, (None,))[0] is not text_surface:
+                    restore.append(rect)
+            for slot, (text_surface, rect) in rendered.items():
+                if self._lines.get(slot, (None,))[0] is not text_surface:
+                    changed.append(rect)
+            for rect in restore:
+                surface.blit(self.background, rect, rect)
+
+            draw_scene()
+            for text_surface, rect in rendered.values():
+                # Redrawing text that is still on screen would stack its antialiased edges
+                if rect in changed or rect.collidelist(restore) != -1:
+                    surface.blit(text_surface, rect)
+            pygame.display.update(restore + changed)
+
+        self._scene_rects = list(scene_rects)
+        self._lines = rendered
@@ -0,0 +1,364 @@
+"""Island model: several sub-populations of both trainers, each evolving in its own process.
+
+Coevolution evolves one tarnished and one margit population, so only the games can be
+spread over cores. Reproduction and speciation stay in one process, and that process
+limits how big a population can get. Here every island is a process with its own pair
+of populations. Each population has its own DefaultReproduction and DefaultSpeciesSet,
+and every generation it plays its games, breeds and speciates without waiting on the
+others. The total population is islands x pop_size, so it grows with the cores.
+
+Islands run in epochs of migration_interval generations. Between epochs every island
+sends copies of its best genomes of each trainer to the next island around the ring,
+where they replace that island's newest unevaluated offspring:
+
+    island 0 -> island 1 -> ... -> island K-1 -> island 0
+
+Every island's state goes into a single checkpoint (see IslandModel.save_checkpoint), so
+restoring brings back every island right where it was, RNG included.
+"""
+import copy
+import gzip
+import itertools
+import multiprocessing
+import os
+import pickle
+import random
+import traceback
+
+import neat
+
+from coevolution import run_coevolution
+
+# Node ids of different islands start this far apart. A migrant never brings a node id
+# its new island could later hand out itself
+NODE_ID_STRIDE = 1_000_000
+CHECKPOINT_VERSION = 1
+# Seconds an island gets to stop after being terminated before it is killed
+TERMINATE_TIMEOUT = 5
+
+# Population order of everything per trainer
+TRAINERS = ("tarnished", "margit")
+
+
+class _IslandReporter(neat.reporting.BaseReporter):
+    """Remembers an island population's best genomes and a summary of every evaluated generation.
+
+    Only holds plain data, since the species set (and so its reporters) goes into checkpoints.
+    """
+
+    def __init__(self, keep: int):
+        self.keep = keep
+        self.top = []
+        self.history = []
+
+    def post_evaluate(self, config, population, species, best_genome):
+        ranked = sorted(population.values(), key=lambda g: g.fitness, reverse=True)
+        # Copies, breeding the next generation mustn't change the migrants
+        self.top = [copy.deepcopy(genome) for genome in ranked[:self.keep]]
+        fitnesses = [genome.fitness for genome in ranked]
+        self.history.append({
+            "best": best_genome.fitness,
+            "mean": sum(fitnesses) / len(fitnesses),
+            "species": len(species.species),
+            "size": len(population),
+        })
+
+
+class Island:
+    """Both populations of one island, living in that island's process.
+
+    Args:
+        index (int): Position in the ring
+        configs (tuple): (tarnished config, margit config)
+        migrants (int): Best genomes per trainer handed to the next island each migration
+        state (dict): From state(), to carry on from a checkpoint. None starts fresh populations
+        seed (int): Seeds a fresh island's RNG, together with its index. None seeds from the OS
+    """
+
+    def __init__(self, index: int, configs: tuple, migrants: int, state: dict = None, seed: int = None):
+        self.index = index
+        self.populations = []
+        if state is None:
+            random.seed(None if seed is None else f"{seed}-island-{index}")
+            for config in configs:
+                config.genome_config.node_indexer = itertools.count(NODE_ID_STRIDE * (index + 1))
+                self.populations.append(neat.Population(config))
+        else:
+            random.setstate(state["random"])
+            for config, saved in zip(configs, state["populations"]):
+                config.genome_config.node_indexer = itertools.count(saved["next_node_key"])
+                population = neat.Population(config, (saved["population"], saved["species"], saved["generation"]))
+                population.reproduction.genome_indexer = itertools.count(saved["next_genome_key"])
+                population.best_genome = saved["best_genome"]
+                # The pickled species set still points at the reporters it was saved with
+                population.species.reporters = population.reporters
+                self.populations.append(population)
+
+        self.reporters = []
+        for population in self.populations:
+            reporter = _IslandReporter(migrants)
+            population.add_reporter(reporter)
+            self.reporters.append(reporter)
+
+    @property
+    def generation(self) -> int:
+        return self.populations[0].generation
+
+    def run(self, fitness_function, n: int) -> dict:
+        """Evolve both populations n generations, or until one of them reaches its fitness threshold.
+
+        Returns:
+            dict: Per trainer summaries of every generation evaluated, and whether it was solved
+        """
+        start = self.generation
+        run_coevolution(*self.populations, fitness_function, n)
+        # Population.generation only moves on past generations that didn't solve it
+        solved = self.generation - start < n
+        history = {}
+        for trainer, reporter in zip(TRAINERS, self.reporters):
+            history[trainer] = reporter.history
+            reporter.history = []
+        return {"generation": self.generation, "solved": solved, "history": history}
+
+    def emigrants(self) -> list[list]:
+        """Copies of the best genomes of the last evaluated generation, per trainer.
+        """
+        return [reporter.top for reporter in self.reporters]
+
+    def immigrants(self, genomes: list[list]):
+        """Take in another island's best genomes, per trainer, in place of the newest offspring.
+
+        They get new keys from this island's reproduction and are evaluated again here
+        with everyone else, against this island's opponents.
+        """
+        for population, arrivals in zip(self.populations, genomes):
+            if not arrivals:
+                continue
+            # Unevaluated offspring first (elites keep their fitness), newest first
+            replaceable = sorted(population.population.values(),
+                                 key=lambda g: (g.fitness is not None, g.fitness or 0, -g.key))
+            for old, genome in zip(replaceable, arrivals):
+                del population.population[old.key]
+                population.reproduction.ancestors.pop(old.key, None)
+                genome.key = next(population.reproduction.genome_indexer)
+                genome.fitness = None
+                population.population[genome.key] = genome
+                population.reproduction.ancestors[genome.key] = tuple()
+            population.species.speciate(population.config, population.population, population.generation)
+
+    def state(self) -> dict:
+        """Everything needed to rebuild this island exactly where it is.
+        """
+        populations = []
+        for population in self.populations:
+            # Taking the next keys uses them up, so carry on counting from them
+            next_genome_key = next(population.reproduction.genome_indexer)
+            population.reproduction.genome_indexer = itertools.count(next_genome_key)
+            genome_config = population.config.genome_config
+            next_node_key = next(genome_config.node_indexer)
+            genome_config.node_indexer = itertools.count(next_node_key)
+            populations.append({
+                "generation": population.generation,
+                "population": population.population,
+                "species": population.species,
+                "best_genome": population.best_genome,
+                "next_genome_key": next_genome_key,
+                "next_node_key": next_node_key,
+            })
+        return {"index": self.index, "populations": populations, "random": random.getstate()}
+
+
+def _island_process(connection, index, configs, migrants, state, seed, fitness_function, initializer):
+    """Runs an island, doing whatever the IslandModel sends it until told to stop.
+    """
+    try:
+        island = Island(index, configs, migrants, state, seed)
+        if initializer:
+            initializer(index, island.generation)
+    except Exception:
+        connection.send(("error", traceback.format_exc()))
+        return
+    connection.send(("ok", island.generation))
+
+    while True:
+        command, payload = connection.recv()
+        if command == "stop":
+            connection.send(("ok", None))
+            return
+        try:
+            if command == "run":
+                result = island.run(fitness_function, payload)
+            elif command == "emigrants":
+                result = island.emigrants()
+            elif command == "immigrants":
+                result = island.immigrants(payload)
+            elif command == "state":
+                result = island.state()
+            else:
+                raise ValueError(f"Unknown island command {command}")
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
+            continue
+        connection.send(("ok", result))
+
+
+class IslandError(Exception):
+    """An island process failed. Carries the island's traceback.
+    """
+
+
+class IslandModel:
+    """Runs islands of both trainers in their own processes, with migrations between them.
+
+    Args:
+        islands (int): Number of islands. Ignored when restoring, the checkpoint decides
+        configs (tuple): (tarnished config, margit config). pop_size is per island
+        fitness_function (callable): eval_genomes style function each island scores its generations with
+        migration_interval (int): Generations between migrations
+        migrants (int): Best genomes per trainer each island sends on every migration
+        checkpoint (dict): From load_checkpoint, to carry on from it
+        seed (int): Seeds the fresh islands. None seeds them from the OS
+        initializer (callable): Called as initializer(index, generation) in every island process
+                                before it starts, to set up the fitness function's process
+    """
+
+    def __init__(self, islands: int, configs: tuple, fitness_function, migration_interval: int = 5, migrants: int = 2,
+                 checkpoint: dict = None, seed: int = None, initializer=None):
+        self.migration_interval = max(1, migration_interval)
+        self.migrants = migrants
+        states = checkpoint["islands"] if checkpoint else [None] * islands
+        self.generation = checkpoint["generation"] if checkpoint else 0
+
+        self._connections = []
+        self._processes = []
+        for index, state in enumerate(states):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_island_process, name=f"island-{index}", daemon=True,
+                args=(child, index, configs, migrants, state, seed, fitness_function, initializer))
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+        # Every island reports in once it is built, with its generation
+        self._gather()
+
+    def __len__(self):
+        return len(self._processes)
+
+    def _gather(self) -> list:
+        results = []
+        errors = []
+        for index, connection in enumerate(self._connections):
+            try:
+                status, result = connection.recv()
+            except EOFError:
+                status, result = "error", "island process died"
+            if status == "error":
+                errors.append(f"Island {index}:\n{result}")
+            results.append(result)
+        if errors:
+            raise IslandError("\n".join(errors))
+        return results
+
+    def _call(self, command: str, payloads: list = None) -> list:
+        """Send every island a command at once, then wait for all of their answers, in island order.
+        """
+        payloads = payloads or [None] * len(self)
+        for connection, payload in zip(self._connections, payloads):
+            connection.send((command, payload))
+        return self._gather()
+
+    def run(self, n: int, on_epoch=None) -> bool:
+        """Run every island n more generations, migrating every migration_interval of them.
+
+        Args:
+            n (int): Generations
+            on_epoch (callable): Called as on_epoch(model, results) after every epoch, with each
+                                 island's result from Island.run. Before the migration, so
+                                 a checkpoint taken there is the generation as it was bred
+
+        Returns:
+            bool: Whether an island reached its fitness threshold, which stops the run
+        """
+        remaining = n
+        while remaining > 0:
+            epoch = min(self.migration_interval, remaining)
+            results = self._call("run", [epoch] * len(self))
+            self.generation = max(result["generation"] for result in results)
+            remaining -= epoch
+            if on_epoch:
+                on_epoch(self, results)
+            if any(result["solved"] for result in results):
+                return True
+            if remaining > 0:
+                self.migrate()
+        return False
+
+    def migrate(self):
+        """Send every island's best genomes on to the next island around the ring.
+        """
+        if len(self) < 2 or not self.migrants:
+            return
+        emigrants = self._call("emigrants")
+        # Island i takes in island i - 1's
+        self._call("immigrants", emigrants[-1:] + emigrants[:-1])
+
+    def best_genomes(self) -> list[list]:
+        """Best genomes of every island's last evaluated generation, as [[tarnished...], [margit...]] per island.
+        """
+        return self._call("emigrants")
+
+    ### Checkpoints ###
+
+    def save_checkpoint(self, path: str):
+        """Write every island's state into one file, written aside first so a crash can't leave half of it.
+        """
+        checkpoint = {
+            "version": CHECKPOINT_VERSION,
+            "generation": self.generation,
+            "migration_interval": self.migration_interval,
+            "migrants": self.migrants,
+            "islands": self._call("state"),
+        }
+        directory, name = os.path.split(path)
+        tmp_path = os.path.join(directory, f".{name}.tmp")
+        with gzip.open(tmp_path, "wb", compresslevel=5) as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load_checkpoint(path: str) -> dict:
+        with gzip.open(path) as f:
+            checkpoint = pickle.load(f)
+        if checkpoint.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"{path} is an island checkpoint version {checkpoint.get('version')}, expected {CHECKPOINT_VERSION}")
+        return checkpoint
+
+    ### Shutting down ###
+
+    def close(self):
+        """Let every island finish what it's doing and stop.
+        """
+        for connection in self._connections:
+            try:
+                connection.send(("stop", None))
+                connection.recv()
+            except (EOFError, BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def terminate(self):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            # pygame catches SIGTERM in processes that initialised it, so it might not stop them
+            process.join(TERMINATE_TIMEOUT)
+            if process.exitcode is None:
+                process.kill()
+                process.join()
+        self._connections = []
+        self._processes = []
@@ -1,18 +1,40 @@
 from argparse import ArgumentParser
+import copy
 import datetime as dt
 import json
 import math
+import multiprocessing
 import neat
 import os
 import pathlib
+import pickle
 import pygame
-import shutil
+import queue
+import random
 import string
 import sys
+import tempfile
 import time
 
 
-from fitness import get_tarnished_fitness, get_margit_fitness
+from evaluation_pool import EvaluationPool
+from distributed import Coordinator, parse_address, run_worker
+from genome_store import GenomeStore, genome_digest
+from gamestate_storage import GameStateStorage
+from coevolution import run_coevolution
+from islands import IslandModel
+from concurrent_training import SnapshotStore, run_concurrent
+from match_cache import MatchCache
+from hud import Hud, TEXT_CACHE
+from early_stop import EarlyStopStats, make_policies
+from profiler import PhaseProfiler, ProfileReporter
+import action_log
+from action_mask import ActionMask
+from checkpoint_writer import BackgroundCheckpointWriter
+import recording
+from replay_reader import ReplayReader
+from observations import ObservationBuffers
+from fitness_accumulators import make_fitness_accumulators
 
 from entities.tarnished import Tarnished
 from entities.margit import Margit
@@ -43,31 +65,127 @@ parser.add_argument("-g", "--generations", dest="gens", default=None, type=int,
 parser.add_argument("-t", "--trainer", dest="trainer", default=None, type=str, 
                     choices=[trainer_str(Entities.TARNISHED).lower(), trainer_str(Entities.MARGIT).lower()],
                     help="Specify which trainer to show for the best replays. If None provided, will train both")
+parser.add_argument("-s", "--speed", dest="replay_speed", default=1.0, type=float,
+                    help="Replay speed as a multiple of REPLAY_TPS. 0 replays as fast as frames can be drawn")
 parser.add_argument("-q", "--quiet",
                     action="store_true", dest="quiet", default=False,
                     help="don't print status messages to stdout. Unused")
 parser.add_argument("-c", "--clean", dest="clean", action="store_false", default=True,
                     help="Should we clean up our previous gamestates?")
+parser.add_argument("--schedule", dest="schedule", default="alternate", choices=["coevolve", "alternate", "concurrent"],
+                    help="alternate (the default) trains each for TRAINING_INTERVAL generations against the other's frozen population, "
+                         "coevolve scores both trainers from one set of games per generation, "
+                         "concurrent trains both at once in their own processes against snapshots of each other")
+parser.add_argument("--snapshot-interval", dest="snapshot_interval", default=1, type=int,
+                    help="With --schedule concurrent, generations between a trainer publishing a snapshot of its population")
+parser.add_argument("--max-staleness", dest="max_staleness", default=2, type=int,
+                    help="With --schedule concurrent, most generations a trainer gets ahead of the other's newest snapshot "
+                         "before it waits for a newer one. At least --snapshot-interval, negative never waits")
+parser.add_argument("--early-stop", dest="early_stop", default=[], nargs='*',
+                    help="Early stop policies for games going nowhere, as name:value (no-damage:TICKS, stationary:TICKS, "
+                         "decided:MAX_DAMAGE_PER_TICK), like --early-stop no-damage:300 stationary:120. "
+                         "Off by default, games play to MAX_UPDATES_PER_GAME")
+parser.add_argument("--keep-gens", dest="keep_gens", default=10, type=int,
+                    help="Newest generations of game states to keep whole. Negative keeps every generation")
+parser.add_argument("--keep-every", dest="keep_every", default=10, type=int,
+                    help="Also keep every Kth generation of game states whole. 0 keeps none extra")
+parser.add_argument("--keep-top", dest="keep_top", default=None, type=int,
+                    help="Best games per trainer kept from older generations. Defaults to DEFAULT_NUM_BEST_GENS, 0 deletes them")
+parser.add_argument("--keep-checkpoints", dest="keep_checkpoints", default=5, type=int,
+                    help="Newest checkpoints per trainer kept in the genome store, older ones (and genomes only they used) "
+                         "are pruned after every checkpoint. Negative keeps every checkpoint")
+parser.add_argument("--keep-checkpoint-every", dest="keep_checkpoint_every", default=100, type=int,
+                    help="Also keep the checkpoint of every Kth generation in the genome store. 0 keeps none extra")
+parser.add_argument("--headless", dest="headless", action="store_true", default=False,
+                    help="Train without a window. Games never touch the display, clock or event queue and run as fast as the CPU allows")
+parser.add_argument("--no-record", dest="record", action="store_false", default=True,
+                    help="Don't keep or write out the game states of training games. Fitness is still scored as the games run")
+parser.add_argument("--deterministic", dest="deterministic", action="store_true", default=False,
+                    help="Seeded games on an integer tick counter. Games are recorded as action logs and replayed by re-simulating them")
+parser.add_argument("--seed", dest="seed", default=0, type=int,
+                    help="Base seed for deterministic games")
+parser.add_argument("-w", "--workers", dest="workers", default=1, type=int,
+                    help="Number of processes to evaluate games with. 1 plays them in this process, 0 uses one per core")
+parser.add_argument("--chunksize", dest="chunksize", default=4, type=int,
+                    help="How many games are handed to an evaluation worker at a time")
+parser.add_argument("--affinity", dest="affinity", default=None, type=int, nargs='+',
+                    help="CPUs to pin the evaluation workers to")
+parser.add_argument("--listen", dest="listen", default=None,
+                    help="Hand games to evaluation workers connecting over TCP to this host:port, instead of playing them here. "
+                         "Only listen on networks you trust")
+parser.add_argument("--local-workers", dest="local_workers", default=0, type=int,
+                    help="With --listen, also start this many workers on this machine")
+parser.add_argument("--connect", dest="connect", default=None,
+                    help="Run as an evaluation worker for the training run listening on host:port")
+parser.add_argument("--islands", dest="islands", default=0, type=int,
+                    help="Evolve this many islands of both trainers, each in its own process, instead of one population each. "
+                         "pop_size is per island. 0 turns islands off")
+parser.add_argument("--migration-interval", dest="migration_interval", default=5, type=int,
+                    help="Generations between islands sending their best genomes to the next island")
+parser.add_argument("--migrants", dest="migrants", default=2, type=int,
+                    help="Best genomes per trainer each island sends on every migration")
+parser.add_argument("--profile", dest="profile", action="store_true", default=False,
+                    help="Time each phase of the training games and print a breakdown every generation")
 
 args = parser.parse_args()
 
 replays = True if any([args.replay, args.best, args.gens != None]) else False
 
+# How finished games are written out. "archive" appends to one binary recording per generation
+# (see recording.py), "json" keeps the old one indented JSON file per game
+GAMESTATES_FORMAT = "archive"
+GAMESTATES_COMPRESSION = "zlib"
+# "store" checkpoints into a deduplicated genome store in the run's folder (see genome_store.py),
+# "pickle" writes neat's full pickle per checkpoint
+CHECKPOINT_FORMAT = "store"
+# Store checkpoints kept per trainer as training goes (see --keep-checkpoints), None keeps them all
+CHECKPOINT_KEEP_LAST = args.keep_checkpoints if args.keep_checkpoints >= 0 else None
+CHECKPOINT_KEEP_EVERY = args.keep_checkpoint_every
+
+# Matches remembered so unchanged pairings aren't played again (see match_cache.py). 0 turns the cache off
+MATCH_CACHE_SIZE = 20000
+# Kept in the run's checkpoint folder so it survives restarts
+MATCH_CACHE_FILE = "match_cache.pkl.gz"
+
+# Policies that call a stalemate before MAX_UPDATES_PER_GAME (see early_stop.py)
+EARLY_STOP_POLICIES = make_policies(args.early_stop)
+
+# How the two trainers share generations, see --schedule
+TRAINING_SCHEDULE = args.schedule
+# Trainer recorded on games that score both sides at once
+COEVOLUTION_TRAINER = "Both"
+# Concurrent training's snapshots of both populations, see concurrent_training.py. Kept in the run's checkpoint folder
+SNAPSHOTS_DIR = "snapshots"
+SNAPSHOT_INTERVAL = args.snapshot_interval
+MAX_STALENESS = args.max_staleness if args.max_staleness >= 0 else None
+
+# Island model, see islands.py. 0 islands trains the one population per trainer
+ISLANDS = args.islands
+MIGRATION_INTERVAL = args.migration_interval
+MIGRANTS = args.migrants
+# Every island goes into the one checkpoint, in the run's checkpoint folder
+ISLAND_CHECKPOINT_PREFIX = "islands-gen-"
+
+# Whether training games keep their full state history and write it out for replays
+RECORD_GAMESTATES = args.record
+# Deterministic games only record their starting states, seed and actions (see action_log.py)
+DETERMINISTIC = args.deterministic
+SEED = args.seed
+# Replays always need the window, so headless only ever applies to training
+HEADLESS = (args.headless or bool(args.connect)) and not replays
+
+# Game state retention while training (see gamestate_storage.py)
+GAMESTATES_KEEP_LAST = args.keep_gens if args.keep_gens >= 0 else None
+GAMESTATES_KEEP_EVERY = args.keep_every
+GAMESTATES_KEEP_TOP = DEFAULT_NUM_BEST_GENS if args.keep_top is None else args.keep_top
+
+# Owns the game states folder while training, created in main()
+game_storage: GameStateStorage = None
+
 ########## STARTUP CLEANUP
-if not replays and args.clean and not SAVE_GAMESTATES:
+if not replays and args.clean and not SAVE_GAMESTATES and not args.connect:
     print("Cleaning up old data")
-    # DELETE GAME STATES #
-    print("Cleaning up old game states")
-    folder = GAMESTATES_PATH
-    for filename in os.listdir(folder):
-        file_path = os.path.join(folder, filename)
-        try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        except Exception as e:
-            print('Failed to delete %s. Reason: %s' % (file_path, e))
+    # Old game states get cleared out in the background by game_storage once training starts
 
     print("remove debug.txt")
     # Delete debug file to ensure we arent looking at old exceptions
@@ -79,12 +197,21 @@ pygame.init()
 
 # Set up the display
 BG = pygame.image.load("assets/stage.png")
-WIN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Flatten Ring")
+WIN = None
+if not HEADLESS:
+    WIN = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Flatten Ring")
 
 tarnished = None
 margit = None
 
+# Replays only redraw what changed. Anything drawn further than this from an entity's center
+# could be left behind until the next full redraw, which happens about once a second
+REPLAY_DIRTY_RADIUS = 200
+# Top of the window, where both health bars and their names are drawn
+REPLAY_HEALTH_BAR_BAND = 3 * (HEALTH_BAR_HEIGHTS + DEFAULT_HEALTH_BAR_PADDING)
+replay_hud = Hud(BG, full_redraw_interval=REPLAY_TPS)
+
 tarnished_neat_config = neat.config.Config(neat.DefaultGenome, neat.DefaultReproduction,
                             neat.DefaultSpeciesSet, neat.DefaultStagnation,
                             TARNISH_NEAT_PATH)
@@ -100,14 +227,38 @@ population_margit = neat.Population(margit_neat_config)
 curr_pop = 0
 curr_gen = 0
 curr_trainer: str = None
+# Added to the population numbers this process hands out, so islands' games don't share numbers
+population_offset = 0
+# In an island's process, its index. Its per generation lines go on island_reports for the main process to print
+island_index: int = None
+island_reports: multiprocessing.Queue = None
+
+# Persistent evaluation workers, only created when training with more than one worker.
+# A Coordinator instead when the workers connect over TCP (--listen)
+eval_pool: EvaluationPool = None
+# Writes checkpoints for both trainers off the training thread
+checkpoint_writer: BackgroundCheckpointWriter = None
+# Results of matches already played, None when turned off
+match_cache: MatchCache = None
 
 def main():
     global curr_pop
     global curr_gen
     global curr_trainer
+    global checkpoint_writer
+    global population_tarnished
+    global population_margit
+    global game_storage
+    global match_cache
+
+    game_storage = GameStateStorage(GAMESTATES_PATH, GAMESTATES_KEEP_LAST, GAMESTATES_KEEP_EVERY, GAMESTATES_KEEP_TOP)
+    if args.clean and not SAVE_GAMESTATES:
+        print("Cleaning up old game states")
+        game_storage.discard_existing()
     
     # Add reporters, including a Checkpointer
     if CACHE_CHECKPOINTS:
+        checkpoint_writer = BackgroundCheckpointWriter()
         # Setup checkpoints
         curr_fitness_checkpoints = f"{CHECKPOINTS_PATH}/{FITNESS_VERSION}"
         pathlib.Path(curr_fitness_checkpoints).mkdir(parents=True, exist_ok=True)
@@ -138,24 +289,39 @@ def main():
         # first to catch up to tarnished (incase a run is stopped during margit's training, meaning he will be
         # behind in training one full cycle)
         start_gen_nums = [0, 0]
+        store = GenomeStore(f"{this_runs_checkpoints}/store") if CHECKPOINT_FORMAT == "store" else None
         if RESTORE_CHECKPOINTS and not args.reset:
             # We gotta find the right run to restore
-            existing_checkpoint_files = os.listdir(this_runs_checkpoints)
+            existing_checkpoint_files = [f for f in os.listdir(this_runs_checkpoints)
+                                         if f not in ("store", MATCH_CACHE_FILE, SNAPSHOTS_DIR) and not f.startswith(ISLAND_CHECKPOINT_PREFIX)]
             print(f"This is our existing checkpoints from {this_runs_checkpoints}:\n{existing_checkpoint_files}")
-            if existing_checkpoint_files: 
+            if store and store.generations(TARNISHED_CHECKPOINT_PREFIX) and store.generations(MARGIT_CHECKPOINT_PREFIX):
+                start_gen_nums[0] = store.generations(TARNISHED_CHECKPOINT_PREFIX)[-1]
+                population_tarnished = store.restore(TARNISHED_CHECKPOINT_PREFIX, start_gen_nums[0])
+                print(f"We are using stored generation {start_gen_nums[0]} for tarnished")
+                start_gen_nums[1] = store.generations(MARGIT_CHECKPOINT_PREFIX)[-1]
+                population_margit = store.restore(MARGIT_CHECKPOINT_PREFIX, start_gen_nums[1])
+                print(f"We are using stored generation {start_gen_nums[1]} for margit")
+            elif existing_checkpoint_files: 
 
                 tarn_checkpoint, start_gen_nums[0] = get_newest_checkpoint_file(existing_checkpoint_files, TARNISHED_CHECKPOINT_PREFIX)
-                checkpointer_tarnished = OneIndexedCheckpointer.restore_checkpoint(f"{this_runs_checkpoints}/{tarn_checkpoint}")
+                population_tarnished = OneIndexedCheckpointer.restore_checkpoint(f"{this_runs_checkpoints}/{tarn_checkpoint}")
                 print(f"We are using {tarn_checkpoint} for tarnished")
                 margit_checkpoint, start_gen_nums[1] = get_newest_checkpoint_file(existing_checkpoint_files, MARGIT_CHECKPOINT_PREFIX)
-                checkpointer_margit = OneIndexedCheckpointer.restore_checkpoint(f"{this_runs_checkpoints}/{margit_checkpoint}")
+                population_margit = OneIndexedCheckpointer.restore_checkpoint(f"{this_runs_checkpoints}/{margit_checkpoint}")
                 print(f"We are using {margit_checkpoint} for margit")
             else:
                 # We didn't have any existing checkpoints within the run's folder
                 print("Warning, attempted to restore checkpoints, but no checkpoints were present. If this was expected, disregard.")
 
-        checkpointer_tarnished = OneIndexedCheckpointer(generation_interval=CHECKPOINT_INTERVAL, filename_prefix=f'{this_runs_checkpoints}/{TARNISHED_CHECKPOINT_PREFIX}')
-        checkpointer_margit = OneIndexedCheckpointer(generation_interval=CHECKPOINT_INTERVAL, filename_prefix=f'{this_runs_checkpoints}/{MARGIT_CHECKPOINT_PREFIX}')
+        if store:
+            checkpointer_tarnished = GenomeStoreCheckpointer(store, generation_interval=CHECKPOINT_INTERVAL, filename_prefix=TARNISHED_CHECKPOINT_PREFIX,
+                                                             writer=checkpoint_writer, keep_last=CHECKPOINT_KEEP_LAST, keep_every=CHECKPOINT_KEEP_EVERY)
+            checkpointer_margit = GenomeStoreCheckpointer(store, generation_interval=CHECKPOINT_INTERVAL, filename_prefix=MARGIT_CHECKPOINT_PREFIX,
+                                                          writer=checkpoint_writer, keep_last=CHECKPOINT_KEEP_LAST, keep_every=CHECKPOINT_KEEP_EVERY)
+        else:
+            checkpointer_tarnished = OneIndexedCheckpointer(generation_interval=CHECKPOINT_INTERVAL, filename_prefix=f'{this_runs_checkpoints}/{TARNISHED_CHECKPOINT_PREFIX}', writer=checkpoint_writer)
+            checkpointer_margit = OneIndexedCheckpointer(generation_interval=CHECKPOINT_INTERVAL, filename_prefix=f'{this_runs_checkpoints}/{MARGIT_CHECKPOINT_PREFIX}', writer=checkpoint_writer)
         
         population_tarnished.add_reporter(neat.StdOutReporter(True))
         population_tarnished.add_reporter(neat.StatisticsReporter())
@@ -164,7 +330,54 @@ def main():
         population_margit.add_reporter(neat.StatisticsReporter())
         population_margit.add_reporter(checkpointer_margit)
 
+    if MATCH_CACHE_SIZE and (ISLANDS or TRAINING_SCHEDULE == "concurrent"):
+        # Every process would fill its own copy, and none of them would ever be saved
+        print("Match cache is off, islands and concurrent trainers play in processes that can't share it")
+    elif MATCH_CACHE_SIZE:
+        cache_path = f"{this_runs_checkpoints}/{MATCH_CACHE_FILE}" if CACHE_CHECKPOINTS else None
+        # Anything that changes how a game plays out or is scored changes its result too
+        match_cache = MatchCache(MATCH_CACHE_SIZE, (GAME_VERSION, FITNESS_VERSION, MAX_UPDATES_PER_GAME, tuple(args.early_stop)), cache_path)
+        print(f"Match cache starting with {len(match_cache)} matches")
+
+    global eval_pool
+    if args.listen:
+        host, port = parse_address(args.listen)
+        eval_pool = Coordinator(host, port, prefetch=args.chunksize, initializer=init_remote_worker,
+                                initargs=(remote_worker_settings(),))
+        print(f"Listening for evaluation workers on {eval_pool.address[0]}:{eval_pool.address[1]}")
+        if args.local_workers:
+            # Listening on every interface still takes local connections
+            local_host = host if host not in ("", "0.0.0.0") else "127.0.0.1"
+            eval_pool.start_local_workers(args.local_workers, [sys.executable, os.path.abspath(__file__),
+                                                               "--connect", f"{local_host}:{eval_pool.address[1]}"])
+    # Islands are already one process each, and concurrent trainers start their own
+    elif args.workers != 1 and not ISLANDS and TRAINING_SCHEDULE != "concurrent":
+        # Spin the workers up once, so every generation after reuses the same warm processes
+        eval_pool = EvaluationPool(workers=args.workers, chunksize=args.chunksize, cpu_affinity=args.affinity,
+                                   initializer=init_eval_worker)
+        print(f"Evaluating games with {eval_pool.workers} worker processes")
+    if PROFILER.enabled:
+        # Added last, so the breakdown comes after StdOutReporter's generation summary
+        profile_reporter = ProfileReporter(PROFILER, eval_pool.workers if eval_pool else 1)
+        population_tarnished.add_reporter(profile_reporter)
+        population_margit.add_reporter(profile_reporter)
+
     try:
+        if ISLANDS:
+            run_islands(this_runs_checkpoints if CACHE_CHECKPOINTS else None)
+            return
+        if TRAINING_SCHEDULE == "coevolve":
+            catch_up(start_gen_nums)
+            # Every game already scores both sides, so one set of games per generation trains both
+            curr_gen = max(start_gen_nums)
+            curr_trainer = COEVOLUTION_TRAINER
+            winner_tarnished, winner_margit = run_coevolution(population_tarnished, population_margit, eval_genomes,
+                                                              max(0, GENERATIONS - curr_gen))
+            return
+        if TRAINING_SCHEDULE == "concurrent":
+            snapshots_dir = f"{this_runs_checkpoints}/{SNAPSHOTS_DIR}" if CACHE_CHECKPOINTS else tempfile.mkdtemp(prefix="snapshots-")
+            run_concurrent_training(SnapshotStore(snapshots_dir), start_gen_nums)
+            return
         # Co train margit/tarnished so they learn together
         for gen in range(start_gen_nums[0], GENERATIONS, TRAINING_INTERVAL):
             # Run NEAT for player and enemy separately
@@ -174,17 +387,225 @@ def main():
             curr_gen = gen
             curr_trainer = trainer_str(Entities.MARGIT)
             winner_margit = population_margit.run(lambda genomes, config: eval_genomes(population_tarnished.population, genomes, tarnished_neat_config, config), n=TRAINING_INTERVAL)
+    except KeyboardInterrupt:
+        print("Training interrupted, stopping evaluation workers")
+        if eval_pool:
+            eval_pool.terminate()
+        raise
     except Exception as e:
+        if eval_pool:
+            eval_pool.terminate()
         with open("debug.txt", "w") as f:
             f.write(str(e))
         raise
+    finally:
+        if eval_pool:
+            # No-op if we already had to terminate it above
+            eval_pool.close()
+            eval_pool = None
+        if checkpoint_writer:
+            # Make sure the last checkpoints are on disk, and hear about it if they failed
+            print("Waiting for checkpoints to finish writing")
+            checkpoint_writer.close()
+        if match_cache is not None:
+            match_cache.save()
+            print(f"Match cache: {match_cache.total_hits} hits, {match_cache.total_misses} misses this run")
+        if game_storage:
+            game_storage.close()
+            usage = game_storage.usage()
+            print(f"Game states use {usage['bytes'] / 1e6:.1f} MB over {len(usage['generations'])} generations, "
+                  f"{usage['freed'] / 1e6:.1f} MB freed this run")
+
+def catch_up(start_gen_nums: list[int]):
+    """Train whichever side resumed from an older generation up to the other, so both can coevolve from the same one.
+
+    Checkpoints from the alternating schedule (or a checkpoint that didn't get written) can leave
+    the two sides at different generations. The side behind trains against the other's frozen
+    population, like it would in the alternating schedule.
+
+    Args:
+        start_gen_nums (list[int]): Generation each side resumed from, tarnished then margit
+    """
+    global curr_gen
+    global curr_trainer
+    behind = min(start_gen_nums)
+    generations = min(max(start_gen_nums), GENERATIONS) - behind
+    if generations <= 0:
+        return
+    curr_gen = behind
+    if start_gen_nums[0] < start_gen_nums[1]:
+        curr_trainer = trainer_str(Entities.TARNISHED)
+        print(f"Catching {curr_trainer} up from generation {behind} to margit's {start_gen_nums[1]}")
+        population_tarnished.run(lambda genomes, config: eval_genomes(genomes, population_margit.population, config, margit_neat_config), n=generations)
+    else:
+        curr_trainer = trainer_str(Entities.MARGIT)
+        print(f"Catching {curr_trainer} up from generation {behind} to tarnished's {start_gen_nums[0]}")
+        population_margit.run(lambda genomes, config: eval_genomes(population_tarnished.population, genomes, tarnished_neat_config, config), n=generations)
+
+def run_islands(checkpoints_dir: str = None):
+    """Train both trainers on ISLANDS islands, carrying on from the newest island checkpoint unless resetting.
+
+    Args:
+        checkpoints_dir (str): The run's checkpoint folder. None doesn't restore or save checkpoints
+    """
+    global curr_gen
+    global island_reports
+    checkpoint = None
+    if checkpoints_dir and RESTORE_CHECKPOINTS and not args.reset:
+        checkpoint_file, _ = get_newest_checkpoint_file(os.listdir(checkpoints_dir), ISLAND_CHECKPOINT_PREFIX)
+        if checkpoint_file:
+            checkpoint = IslandModel.load_checkpoint(f"{checkpoints_dir}/{checkpoint_file}")
+            print(f"We are using {checkpoint_file} for all {len(checkpoint['islands'])} islands")
+
+    island_reports = multiprocessing.Queue()
+    model = IslandModel(ISLANDS, (tarnished_neat_config, margit_neat_config), eval_genomes,
+                        migration_interval=MIGRATION_INTERVAL, migrants=MIGRANTS, checkpoint=checkpoint,
+                        seed=SEED if DETERMINISTIC else None, initializer=init_island)
+    print(f"Training {len(model)} islands from generation {model.generation}, "
+          f"migrating {MIGRANTS} genomes every {MIGRATION_INTERVAL} generations")
+
+    def on_epoch(model: IslandModel, results: list):
+        global curr_gen
+        print_island_reports()
+        first_gen = curr_gen + 1
+        curr_gen = model.generation
+        for index, result in enumerate(results):
+            tarnished_history = result["history"]["tarnished"]
+            margit_history = result["history"]["margit"]
+            for gen, t, m in zip(range(first_gen, curr_gen + 1), tarnished_history, margit_history):
+                print(f"Island {index} generation {gen}: "
+                      f"tarnished best {t['best']:.1f} mean {t['mean']:.1f} ({t['species']} species), "
+                      f"margit best {m['best']:.1f} mean {m['mean']:.1f} ({m['species']} species)")
+        # The islands leave game state retention to us
+        for gen in range(first_gen, curr_gen + 1):
+            curr_gen = gen
+            finish_generation()
+        if checkpoints_dir and curr_gen // CHECKPOINT_INTERVAL > (first_gen - 1) // CHECKPOINT_INTERVAL:
+            filename = f"{checkpoints_dir}/{ISLAND_CHECKPOINT_PREFIX}{curr_gen}"
+            print(f"Saving checkpoint to {filename}")
+            model.save_checkpoint(filename)
+
+    curr_gen = model.generation
+    try:
+        model.run(max(0, GENERATIONS - model.generation), on_epoch)
+    except BaseException:
+        model.terminate()
+        raise
+    model.close()
+    print_island_reports()
+
+def print_island_reports():
+    """Print the lines the islands have reported so far, see report.
+    """
+    while True:
+        try:
+            index, line = island_reports.get_nowait()
+        except queue.Empty:
+            return
+        print(f"Island {index}: {line}")
+
+def run_concurrent_training(store: SnapshotStore, start_gen_nums: list[int]):
+    """Train tarnished and margit at the same time in their own processes, see --schedule concurrent.
+
+    Each side's reporters, checkpointer included, come along into its process. Game state
+    retention stays here and finishes a generation once both sides have played it.
+    """
+    global curr_gen
+    trainers = (trainer_str(Entities.TARNISHED), trainer_str(Entities.MARGIT))
+    generations = [max(0, GENERATIONS - start) for start in start_gen_nums]
+    print(f"Training {trainers[0]} from generation {start_gen_nums[0]} and {trainers[1]} from generation {start_gen_nums[1]} "
+          f"concurrently, snapshots every {SNAPSHOT_INTERVAL} generations, at most {MAX_STALENESS} generations stale")
+
+    # Generations each side has finished, None once it is done and holds nobody up
+    finished = dict(zip(trainers, start_gen_nums))
+    # [newest generation handed to retention, newest generation either side has played]
+    retained = [min(start_gen_nums), max(start_gen_nums)]
+    def on_event(kind: str, trainer: str, generation: int, other_generation: int):
+        global curr_gen
+        if kind == "generation":
+            print(f"{trainer} finished generation {generation} against the other side's generation {other_generation}")
+            finished[trainer] = generation
+            retained[1] = max(retained[1], generation)
+        else:
+            print(f"{trainer} is done training at generation {generation}")
+            finished[trainer] = None
+        training = [gen for gen in finished.values() if gen is not None]
+        newest = min(training) if training else retained[1]
+        for gen in range(retained[0] + 1, newest + 1):
+            curr_gen = gen
+            finish_generation()
+        retained[0] = max(retained[0], newest)
+
+    run_concurrent(trainers, [population_tarnished, population_margit], generations, eval_genomes, store,
+                   SNAPSHOT_INTERVAL, MAX_STALENESS, initializer=init_concurrent_trainer,
+                   finalizer=finish_concurrent_trainer, on_event=on_event)
+
+def init_concurrent_trainer(index: int, population: neat.Population):
+    """Sets up a concurrently training side's process before it trains.
+
+    It gets its own checkpoint writer and evaluation workers (half of --workers each),
+    since the threads and processes of the main process' ones didn't come along.
+    """
+    global curr_gen
+    global curr_trainer
+    global game_storage
+    global eval_pool
+    global checkpoint_writer
+    curr_trainer = trainer_str((Entities.TARNISHED, Entities.MARGIT)[index])
+    curr_gen = population.generation
+    game_storage = None
+    if checkpoint_writer:
+        checkpoint_writer = BackgroundCheckpointWriter()
+        for reporter in population.reporters.reporters:
+            if isinstance(reporter, OneIndexedCheckpointer) and reporter.writer:
+                reporter.writer = checkpoint_writer
+    eval_pool = None
+    if args.workers != 1:
+        workers = max(1, (args.workers or len(os.sched_getaffinity(0))) // 2)
+        if workers > 1:
+            eval_pool = EvaluationPool(workers=workers, chunksize=args.chunksize, cpu_affinity=args.affinity,
+                                       initializer=init_eval_worker)
+
+def finish_concurrent_trainer(index: int):
+    """Shuts down what init_concurrent_trainer started, making sure the side's last checkpoints are written.
+    """
+    global eval_pool
+    if eval_pool:
+        eval_pool.close()
+        eval_pool = None
+    if checkpoint_writer:
+        checkpoint_writer.close()
+
+def init_island(index: int, generation: int):
+    """Sets up an island's process before it evolves anything.
+
+    Islands play their games headless, one after another, and leave game state retention
+    and reporting to the main process. Their per generation lines go to it through report.
+    """
+    global HEADLESS
+    global curr_gen
+    global curr_trainer
+    global population_offset
+    global island_index
+    global game_storage
+    global eval_pool
+    global checkpoint_writer
+    HEADLESS = True
+    curr_gen = generation
+    curr_trainer = COEVOLUTION_TRAINER
+    population_offset = index * tarnished_neat_config.pop_size
+    island_index = index
+    # Copies of the main process', their threads didn't come along
+    game_storage = None
+    eval_pool = None
+    checkpoint_writer = None
 
 def process_replays():
     """Process all replays that are requested
     """
     # Figure out which generations that we need to process.
     existing_gens = os.listdir(GAMESTATES_PATH)
-    gen_nums = [int(name[4:]) for name in existing_gens]
+    gen_nums = [int(name[4:]) for name in existing_gens if name.startswith("gen_")]
     gen_nums.sort()
     
     gens_needed = []
@@ -243,7 +664,10 @@ def eval_genomes(genomes_tarnished, genomes_margit, config_tarnished, config_mar
     global curr_pop
     curr_pop = 0
     curr_gen += 1
-    pathlib.Path(f"{GAMESTATES_PATH}/gen_{curr_gen}").mkdir(parents=True, exist_ok=True)
+    if game_storage:
+        game_storage.generation_dir(curr_gen)
+    else:
+        pathlib.Path(f"{GAMESTATES_PATH}/gen_{curr_gen}").mkdir(parents=True, exist_ok=True)
 
     if type(genomes_tarnished) == dict:
         genomes_tarnished = list(genomes_tarnished.items())
@@ -256,24 +680,172 @@ def eval_genomes(genomes_tarnished, genomes_margit, config_tarnished, config_mar
     for _, genome in genomes_margit:
         genome.fitness = 0
 
-    for (genome_id_player, genome_tarnished), (genome_id_enemy, genome_margit) in zip(genomes_tarnished, genomes_margit):
-        # Create separate neural networks for player and enemy
-        player_net = neat.nn.FeedForwardNetwork.create(genome_tarnished, config_tarnished)
-        enemy_net = neat.nn.FeedForwardNetwork.create(genome_margit, config_margit)
-        
-        # Run the simulation
-        player_fitness, enemy_fitness = play_game(player_net, enemy_net)
-        
-        # Assign fitness to each genome
-        genome_tarnished.fitness = player_fitness
-        genome_margit.fitness = enemy_fitness
+    start_time = time.perf_counter()
+    # Population numbers are 1 indexed like the ones play_game hands out
+    matches = list(enumerate(zip(genomes_tarnished, genomes_margit), start=population_offset + 1))
+    results = {}
+    # Matches we need to play, and for cached runs, which match key each population's result comes from
+    to_play = []
+    match_keys = {}
+    played_keys = {}
+    for pop, ((_, genome_tarnished), (_, genome_margit)) in matches:
+        if match_cache is not None:
+            # A deterministic game's seed only comes from the networks and SEED, so the key needs nothing else
+            key = match_keys[pop] = match_cache.key(genome_tarnished, genome_margit, SEED if DETERMINISTIC else None)
+            cached = match_cache.get(key)
+            if cached is not None:
+                results[pop] = cached
+                continue
+            if key in played_keys:
+                # Same networks twice in one generation, the one game covers both
+                continue
+            played_keys[key] = pop
+        to_play.append((pop, genome_tarnished, genome_margit))
+
+    if eval_pool:
+        tasks = [(genome_tarnished, genome_margit, curr_gen, pop, curr_trainer, match_seed(genome_tarnished, genome_margit))
+                 for pop, genome_tarnished, genome_margit in to_play]
+        played = []
+        for result, stats, profile in eval_pool.map(play_game_worker, tasks):
+            played.append(result)
+            early_stop_stats.merge(stats)
+            if profile:
+                PROFILER.merge(profile)
+    else:
+        played = []
+        for pop, genome_tarnished, genome_margit in to_play:
+            # Create separate neural networks for player and enemy
+            if PROFILER.enabled:
+                PROFILER.start()
+            player_net = neat.nn.FeedForwardNetwork.create(genome_tarnished, config_tarnished)
+            enemy_net = neat.nn.FeedForwardNetwork.create(genome_margit, config_margit)
+            if PROFILER.enabled:
+                PROFILER.lap("networks")
+
+            # Run the simulation. play_game increments the population number before it is used
+            curr_pop = pop - 1
+            played.append(play_game(player_net, enemy_net, headless=HEADLESS, seed=match_seed(genome_tarnished, genome_margit)))
+
+    for (pop, *_), result in zip(to_play, played):
+        results[pop] = result
+        if match_cache is not None:
+            match_cache.put(match_keys[pop], result)
+
+    # Assign fitness to each genome
+    for pop, ((_, genome_tarnished), (_, genome_margit)) in matches:
+        result = results[pop] if pop in results else results[played_keys[match_keys[pop]]]
+        genome_tarnished.fitness, genome_margit.fitness = result
 
         assert genome_tarnished.fitness is not None
         assert genome_margit.fitness is not None
 
+    curr_pop = population_offset + len(matches)
+    elapsed = time.perf_counter() - start_time
+    report_games_per_second(len(to_play), elapsed, True if eval_pool else HEADLESS)
+    if PROFILER.enabled:
+        PROFILER.add_wall(elapsed)
+    if match_cache is not None:
+        hits, misses = match_cache.end_generation()
+        report(f"Match cache: {hits} hits, {misses} misses, {len(match_cache)} matches cached")
+    if EARLY_STOP_POLICIES:
+        report(f"Early stops: {early_stop_stats.take()}")
+    finish_generation()
+
+def finish_generation():
+    """Hands the finished generation's game states over to retention, which prunes older ones in the background.
+    """
+    if game_storage:
+        game_storage.finish_generation(curr_gen)
+
+def init_eval_worker():
+    """Warms up an evaluation worker. Workers never draw, so they always play headless.
+    """
+    global HEADLESS
+    HEADLESS = True
+
+def remote_worker_settings() -> dict:
+    """Everything a remote worker has to play like this process does, for init_remote_worker.
+    """
+    return {
+        "versions": (GAME_VERSION, FITNESS_VERSION),
+        "deterministic": DETERMINISTIC,
+        "seed": SEED,
+        "record": RECORD_GAMESTATES,
+        "early_stop": args.early_stop,
+        "profile": PROFILER.enabled,
+    }
+
+def init_remote_worker(settings: dict):
+    """Sets up a worker that connected with --connect, from the coordinator's remote_worker_settings.
+
+    A worker running different game or fitness code would score the same games differently, so it refuses.
+    """
+    global HEADLESS
+    global DETERMINISTIC
+    global SEED
+    global RECORD_GAMESTATES
+    global EARLY_STOP_POLICIES
+    if tuple(settings["versions"]) != (GAME_VERSION, FITNESS_VERSION):
+        raise ValueError(f"Coordinator runs game/fitness versions {settings['versions']}, "
+                         f"this worker runs {(GAME_VERSION, FITNESS_VERSION)}")
+    HEADLESS = True
+    DETERMINISTIC = settings["deterministic"]
+    SEED = settings["seed"]
+    RECORD_GAMESTATES = settings["record"]
+    EARLY_STOP_POLICIES = make_policies(settings["early_stop"])
+    PROFILER.enabled = settings["profile"]
+
+def play_game_worker(task: tuple) -> tuple[int]:
+    """Plays one game inside an evaluation worker.
+
+    Args:
+        task (tuple): (tarnished genome, margit genome, generation, population, trainer, seed)
+
+    Returns:
+        tuple: <(tarnished fitness, margit fitness), this game's EarlyStopStats, its PhaseProfiler timings or None>
+    """
+    global curr_gen
+    global curr_pop
+    global curr_trainer
+    genome_tarnished, genome_margit, curr_gen, population, curr_trainer, seed = task
+    # play_game increments this before it is used
+    curr_pop = population - 1
+    if RECORD_GAMESTATES:
+        # Remote workers don't have the generation folders eval_genomes made
+        pathlib.Path(f"{GAMESTATES_PATH}/gen_{curr_gen}").mkdir(parents=True, exist_ok=True)
+
+    if PROFILER.enabled:
+        PROFILER.start()
+    player_net = neat.nn.FeedForwardNetwork.create(genome_tarnished, tarnished_neat_config)
+    enemy_net = neat.nn.FeedForwardNetwork.create(genome_margit, margit_neat_config)
+    if PROFILER.enabled:
+        PROFILER.lap("networks")
+    result = play_game(player_net, enemy_net, headless=True, seed=seed)
+    # The stats live in the worker, so send this game's back with its result
+    return result, early_stop_stats.take(), PROFILER.take() if PROFILER.enabled else None
+
+def report_games_per_second(games: int, elapsed: float, headless: bool):
+    """Print how quickly the last batch of games ran, so the modes can be compared.
+
+    Args:
+        games (int): Number of games that were played
+        elapsed (float): Wall time in seconds it took to play them
+        headless (bool): Whether the games were played without the display
+    """
+    mode = "headless" if headless else "windowed"
+    rate = games / elapsed if elapsed > 0 else float("inf")
+    report(f"Generation {curr_gen} ({curr_trainer}): {games} games in {elapsed:.2f}s, {rate:.2f} games/s ({mode})")
+
+def report(line: str):
+    """Print a per generation line. An island's process hands it to the main process to print instead.
+    """
+    if island_index is not None:
+        island_reports.put((island_index, line))
+    else:
+        print(line)
+
 def draw_text(surface, text, x, y, font_size=20, color=(255, 255, 255)):
-    font = pygame.font.SysFont(None, font_size)
-    text_surface = font.render(text, True, color)
+    text_surface = TEXT_CACHE.render(text, font_size, color)
     surface.blit(text_surface, (x, y))
 
 def draw():
@@ -289,7 +861,56 @@ def draw():
 
     pygame.display.update()
 
-def play_game(tarnished_net, margit_net) -> tuple[int]:
+# Reused by every game in this process, see play_game
+# Early stops of the games played in this process since the last report
+early_stop_stats = EarlyStopStats()
+# Phase timings of the games played in this process since the last report, see --profile
+PROFILER = PhaseProfiler(args.profile)
+
+# Network inputs of the game being played, overwritten every tick
+OBSERVATIONS = ObservationBuffers()
+# The buffers read the entities directly. The first game in each process also builds the inputs
+# the old way, out of the get_state() dicts, and makes sure every tick agrees (see check_observations)
+OBSERVATIONS_CHECKED = False
+
+def new_match_entities():
+    """Get Tarnished and Margit ready for a new match.
+
+    Entities that can reset() themselves are reused across matches, so a worker doesn't
+    rebuild them (and their weapons) for every game. Otherwise fresh ones are made.
+
+    Tarnished and Margit live in entities/ and don't have reset() or __slots__ yet, so for
+    now every match still builds new ones. reset() has to put back everything __init__ sets
+    that a match changes: health, x/y/angle and the pygame rect, the current action and its
+    timers, each weapon's attack state and Margit's daggers. It keeps the target and the
+    weapon objects.
+    """
+    global tarnished
+    global margit
+    if tarnished is not None and margit is not None and hasattr(tarnished, "reset") and hasattr(margit, "reset"):
+        # reset() keeps the targets and weapons they were already given
+        tarnished.reset()
+        margit.reset()
+        return
+
+    tarnished = Tarnished()
+    margit = Margit()
+    tarnished.give_target(margit)
+    margit.give_target(tarnished)
+
+def match_seed(genome_tarnished, genome_margit) -> int:
+    """Seed of a deterministic match, None when games aren't deterministic.
+
+    Only the two networks and SEED go into it, not the generation or population number, so a
+    pairing that survives into later generations plays the very same game again (and the
+    match cache can hand its result back).
+    """
+    if not DETERMINISTIC:
+        return None
+    return action_log.game_seed(SEED, genome_digest(genome_tarnished, include_key=False),
+                                genome_digest(genome_margit, include_key=False))
+
+def play_game(tarnished_net, margit_net, headless: bool = False, record: bool = None, seed: int = None) -> tuple[int]:
     # Initial housekeeping
     """Game states:
     Game states will be comprised of several things:
@@ -301,15 +922,29 @@ def play_game(tarnished_net, margit_net) -> tuple[int]:
     Once the game has finished, the total game status will be stored with all the
     game states, the current game version, the fitness version,
     the winner of the match, and the total fitness for each side.
+
+    When headless, the game never touches the display, clock or event queue, so it runs
+    uncapped as fast as the CPU allows. Ticks are then counted by updates instead of
+    pygame's wall clock.
+
+    Fitness is scored tick by tick as the game runs, so the game states are only kept
+    (and written out) when recording. record defaults to RECORD_GAMESTATES.
+
+    Deterministic games are seeded with seed (see match_seed). Without one, they get a seed
+    from the generation and population numbers.
     """
-    global tarnished
-    global margit
     global curr_pop
+    global OBSERVATIONS_CHECKED
+    # Read once, so with profiling off each phase only costs a skipped branch
+    profiling = PROFILER.enabled
+    if profiling:
+        PROFILER.start()
     curr_pop += 1
+    if record is None:
+        record = RECORD_GAMESTATES
 
     # Reset the npcs
-    tarnished = Tarnished()
-    margit = Margit()
+    new_match_entities()
 
     game_result = { # For recording all other elements and storing final output of logging function
         "winner": "draw", # Default incase something fails
@@ -326,22 +961,54 @@ def play_game(tarnished_net, margit_net) -> tuple[int]:
         "game_states": [],
     }
 
-    tarnished.give_target(margit)
-    margit.give_target(tarnished)
-
-    clock = pygame.time.Clock()
+    # Deterministic games log actions instead of keeping every state
+    keep_states = record and not DETERMINISTIC
+    actions_recorder = None
+    # The entities draw from the global random, which neat breeds and speciates with too.
+    # A deterministic game seeds it for itself and hands neat's state back once it's over
+    neat_random_state = None
+    if DETERMINISTIC:
+        if seed is None:
+            seed = action_log.game_seed(SEED, curr_gen, curr_pop, curr_trainer)
+        neat_random_state = random.getstate()
+        random.seed(seed)
+        if record:
+            actions_recorder = action_log.ActionLogRecorder(seed, TARNISHED_OUTPUT_MAP, MARGIT_OUTPUT_MAP)
+            actions_recorder.set_initial(tarnished.get_state(), margit.get_state())
+
+    tarnished_fitness, margit_fitness = make_fitness_accumulators()
+    # The last finished tick's state. It is only scored once the next tick finishes, because
+    # a death has to update it first, same as it would in the recorded game states.
+    last_state = None
+
+    for policy in EARLY_STOP_POLICIES:
+        policy.reset(MAX_UPDATES_PER_GAME + 1)
+    ticks_skipped = 0
+    stopped_by = None
+
+    clock = None if headless else pygame.time.Clock()
     updates = 0
+    if profiling:
+        PROFILER.lap("setup")
     try:
         # Main game loop
         running = True
         while running:
-            clock.tick(TPS)
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-
+            if not headless:
+                clock.tick(TPS)
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        running = False
+                if profiling:
+                    PROFILER.lap("display")
+
+            tick = updates if headless or DETERMINISTIC else pygame.time.get_ticks()
+            # Both sides' inputs, straight from the entities into the reused buffers
+            tarnished_inputs, margit_inputs = OBSERVATIONS.fill(tarnished, margit)
+            if profiling:
+                PROFILER.lap("inputs")
             curr_state = {
-                "tick": pygame.time.get_ticks(),
+                "tick": tick,
                 "tarnished": {
                     "state": tarnished.get_state()
                 },
@@ -349,54 +1016,117 @@ def play_game(tarnished_net, margit_net) -> tuple[int]:
                     "state": margit.get_state()
                 }
             }
-
-            # Get actions from current state
-            tarnish_actions = get_tarnished_actions(tarnished_net, curr_state)
+            if not OBSERVATIONS_CHECKED:
+                check_observations(curr_state, tarnished_inputs, margit_inputs)
+            if profiling:
+                PROFILER.lap("state")
+
+            # Get actions from current state, as bitmasks
+            tarnished_mask = get_tarnished_action_mask(tarnished_net, tarnished_inputs)
+            margit_mask = get_margit_action_mask(margit_net, margit_inputs)
+            # The entities and recorded game states still take action lists
+            tarnish_actions = TARNISHED_ACTIONS.actions(tarnished_mask)
+            margit_actions = MARGIT_ACTIONS.actions(margit_mask)
             curr_state["tarnished"]["actions"] = tarnish_actions
-            margit_actions = get_margit_actions(margit_net, curr_state)
             curr_state["margit"]["actions"] = margit_actions
+            if actions_recorder:
+                actions_recorder.append_masks(tarnished_mask, margit_mask)
+            if profiling:
+                PROFILER.lap("activate")
             
             # Do tarnished action first
             tarnished.do_actions(tarnish_actions)
             margit.do_actions(margit_actions)
+            if profiling:
+                PROFILER.lap("actions")
 
             # Game logic here
             tarnished.update()
             margit.update()
+            if profiling:
+                PROFILER.lap("update")
 
-            draw()
+            if not headless:
+                draw()
+                if profiling:
+                    PROFILER.lap("draw")
             
-            game_result["game_states"].append(curr_state)
+            if last_state is not None:
+                tarnished_fitness.update(last_state)
+                margit_fitness.update(last_state)
+            if profiling:
+                PROFILER.lap("fitness")
+            last_state = curr_state
+            if keep_states:
+                game_result["game_states"].append(curr_state)
             updates += 1
             # print(updates)
             if updates > MAX_UPDATES_PER_GAME:
                 game_result["notes"] = "Game stalemated"
                 running = False
+            else:
+                for policy in EARLY_STOP_POLICIES:
+                    if policy.check(updates, tarnished, margit):
+                        # Still a stalemate, the rest of the game gets scored as if nothing changed
+                        stopped_by = policy.name
+                        ticks_skipped = MAX_UPDATES_PER_GAME + 1 - updates
+                        game_result["notes"] = "Game stalemated"
+                        game_result["early_stop"] = {"policy": stopped_by, "ticks_skipped": ticks_skipped}
+                        running = False
+                        break
+            if profiling:
+                PROFILER.lap("early_stop")
     except TarnishedDied:
         # Update winner
         game_result["winner"] = "margit"
         # Update the state of the last game tick for tarnished status
-        game_result["game_states"][-1]["tarnished"]["state"] = tarnished.get_state()
+        if last_state is not None:
+            last_state["tarnished"]["state"] = tarnished.get_state()
     except MargitDied as e:
         # Update winner
         game_result["winner"] = "tarnished"
         # Update the state of the last game tick for margit status
-        game_result["game_states"][-1]["margit"]["state"] = margit.get_state()
+        if last_state is not None:
+            last_state["margit"]["state"] = margit.get_state()
         game_result["notes"] = "Margit died to: " + str(e)
     finally:
-        # Record our game state
-        score, details = get_tarnished_fitness(game_result)
+        if neat_random_state is not None:
+            random.setstate(neat_random_state)
+        # Score the final tick now that it is settled
+        if last_state is not None:
+            tarnished_fitness.update(last_state)
+            margit_fitness.update(last_state)
+            if ticks_skipped:
+                tarnished_fitness.skip(last_state, ticks_skipped)
+                margit_fitness.skip(last_state, ticks_skipped)
+        early_stop_stats.add(updates, ticks_skipped, stopped_by)
+        OBSERVATIONS_CHECKED = True
+        score, details = tarnished_fitness.finish(game_result)
         game_result[f"{trainer_str(Entities.TARNISHED)}_fitness"] = int(score)
         game_result[f"{trainer_str(Entities.TARNISHED)}_fitness_details"] = details
-        score, details = get_margit_fitness(game_result)
+        score, details = margit_fitness.finish(game_result)
         game_result[f"{trainer_str(Entities.MARGIT)}_fitness"] = int(score)
         game_result[f"{trainer_str(Entities.MARGIT)}_fitness_details"] = details
+        if profiling:
+            PROFILER.lap("fitness")
 
-        file_name = str(curr_pop) + f"_{curr_trainer}"
-        file_name += ".json"
-        file_name = file_name.replace(":", "_")
-        with open(f"{GAMESTATES_PATH}/gen_{curr_gen}/{file_name}", 'w') as f:
-            json.dump(game_result, f, indent=4)
+        # Record our game state
+        if actions_recorder:
+            game_result["action_log"] = actions_recorder.to_dict()
+        if record and GAMESTATES_FORMAT == "archive":
+            recording.append_game(f"{GAMESTATES_PATH}/gen_{curr_gen}/{recording.ARCHIVE_NAME}", game_result, GAMESTATES_COMPRESSION)
+        elif record:
+            file_name = str(curr_pop) + f"_{curr_trainer}"
+            file_name += ".json"
+            file_name = file_name.replace(":", "_")
+            # Fields added during the game (action_log, early_stop) would land after the frames,
+            # where ReplayReader.header never looks. Keep the frames last
+            game_result["game_states"] = game_result.pop("game_states")
+            with open(f"{GAMESTATES_PATH}/gen_{curr_gen}/{file_name}", 'w') as f:
+                json.dump(game_result, f, indent=4)
+        if profiling:
+            PROFILER.lap("record")
+            PROFILER.add_game(updates)
     
     return game_result[f"{trainer_str(Entities.TARNISHED)}_fitness"], game_result[f"{trainer_str(Entities.MARGIT)}_fitness"]
 
@@ -415,6 +1145,26 @@ TARNISHED_OUTPUT_MAP = [ # ABSOLUTELY CRITICAL THIS IS NOT TOUCHED OR THE NETWOR
 ]
 
 def get_tarnished_actions(net, gamestate) -> list[Actions]:
+    """Pruned actions tarnished's network picks for a recorded game state.
+    """
+    return get_tarnished_actions_from_inputs(net, get_tarnished_inputs(gamestate))
+
+def check_observations(gamestate: dict, tarnished_inputs: list, margit_inputs: list):
+    """Make sure the observation buffers hold what get_tarnished_inputs/get_margit_inputs build from get_state().
+
+    ObservationBuffers reads time_left_in_action where get_state() reports time_in_action, so
+    this is what catches the two drifting apart.
+
+    Raises:
+        ValueError: A side's inputs don't match
+    """
+    for side, inputs, expected in (("tarnished", tarnished_inputs, get_tarnished_inputs(gamestate)),
+                                   ("margit", margit_inputs, get_margit_inputs(gamestate))):
+        if tuple(inputs) != expected:
+            raise ValueError(f"Observation buffers disagree with get_state() for {side} on tick {gamestate['tick']}: "
+                             f"{list(inputs)} != {list(expected)}")
+
+def get_tarnished_inputs(gamestate) -> tuple:
     """_summary_
 
     Args:
@@ -434,7 +1184,7 @@ def get_tarnished_actions(net, gamestate) -> list[Actions]:
     """
     tarnished_state = gamestate["tarnished"]["state"]
     margit_state = gamestate["margit"]["state"]
-    inputs = (
+    return (
         tarnished_state["x"],
         tarnished_state["y"],
         tarnished_state["angle"],
@@ -444,16 +1194,18 @@ def get_tarnished_actions(net, gamestate) -> list[Actions]:
         margit_state["current_action"] or -1,
         margit_state["time_in_action"],
     )
+
+def get_tarnished_actions_from_inputs(net, inputs) -> list[Actions]:
+    return TARNISHED_ACTIONS.actions(get_tarnished_action_mask(net, inputs))
+
+def get_tarnished_action_mask(net, inputs) -> int:
+    """Pruned actions the network picks, as a bitmask over TARNISHED_OUTPUT_MAP (see action_mask.py).
+    """
     # Now get the recommended outputs
     outputs = net.activate(inputs)
 
-    # Now map to actions
-    # Go through every element in the output, and if it exists, then place the corresponding
-    # action into the list.
-    actions = [TARNISHED_OUTPUT_MAP[i] for i in range(len(outputs)) if outputs[i]]
-    # print(actions)
-    
-    return prune_actions(actions)
+    # Every output that fired sets the bit of its action, then opposing pairs cancel out
+    return TARNISHED_ACTIONS.prune(TARNISHED_ACTIONS.from_outputs(outputs))
 
 MARGIT_OUTPUT_MAP = [ # ABSOLUTELY CRITICAL THIS IS NOT TOUCHED OR THE NETWORK WILL NEED TO BE RETRAINED
     Actions.MLEFT,
@@ -468,7 +1220,26 @@ MARGIT_OUTPUT_MAP = [ # ABSOLUTELY CRITICAL THIS IS NOT TOUCHED OR THE NETWORK W
     Actions.MDAGGERS,
 ]
 
+# Actions that cancel each other out when chosen together
+OPPOSING_ACTIONS = [
+    (Actions.PLEFT, Actions.PRIGHT),
+    (Actions.MLEFT, Actions.MRIGHT),
+    (Actions.PFORWARD, Actions.PBACK),
+    (Actions.MFORWARD, Actions.MBACK),
+    (Actions.PTURNL, Actions.PTURNR),
+    (Actions.MTURNL, Actions.MTURNR),
+]
+
+# Bitmask encodings of each side's actions, bits in output map order
+TARNISHED_ACTIONS = ActionMask("TarnishedActions", TARNISHED_OUTPUT_MAP, OPPOSING_ACTIONS)
+MARGIT_ACTIONS = ActionMask("MargitActions", MARGIT_OUTPUT_MAP, OPPOSING_ACTIONS)
+
 def get_margit_actions(net, gamestate) -> list[Actions]:
+    """Pruned actions margit's network picks for a recorded game state.
+    """
+    return get_margit_actions_from_inputs(net, get_margit_inputs(gamestate))
+
+def get_margit_inputs(gamestate) -> tuple:
     """_summary_
 
     Args:
@@ -488,7 +1259,7 @@ def get_margit_actions(net, gamestate) -> list[Actions]:
     """
     tarnished_state = gamestate["tarnished"]["state"]
     margit_state = gamestate["margit"]["state"]
-    inputs = (
+    return (
         margit_state["x"],
         margit_state["y"],
         margit_state["angle"],
@@ -499,17 +1270,20 @@ def get_margit_actions(net, gamestate) -> list[Actions]:
         tarnished_state["time_in_action"],
     )
 
+def get_margit_actions_from_inputs(net, inputs) -> list[Actions]:
+    return MARGIT_ACTIONS.actions(get_margit_action_mask(net, inputs))
+
+def get_margit_action_mask(net, inputs) -> int:
+    """Pruned actions the network picks, as a bitmask over MARGIT_OUTPUT_MAP (see action_mask.py).
+    """
     # Now get the recommended outputs
     outputs = net.activate(inputs)
-    
-    # Now map to actions
-    # Go through every element in the output, and if it exists, then place the corresponding
-    # action into the list.
-    actions = [MARGIT_OUTPUT_MAP[i] for i in range(len(outputs)) if outputs[i]]
 
+    # Every output that fired sets the bit of its action, then opposing pairs cancel out
+    mask = MARGIT_ACTIONS.from_outputs(outputs)
     if not SILENT:
-        print(f"Margit's actions we found: {actions}")
-    return prune_actions(actions)
+        print(f"Margit's actions we found: {MARGIT_ACTIONS.actions(mask)}")
+    return MARGIT_ACTIONS.prune(mask)
 
 def prune_actions(actions: list[Actions]):
     """Take a list of actions and prune out the actions that would cancel each other out, meaning they wont be used.
@@ -519,30 +1293,11 @@ def prune_actions(actions: list[Actions]):
     Args:
         actions (_type_): _description_
     """
-    # Left/right
-    a = Actions
-    if a.PLEFT in actions and a.PRIGHT in actions:
-        actions.remove(a.PLEFT)
-        actions.remove(a.PRIGHT)
-    if a.MLEFT in actions and a.MRIGHT in actions:
-        actions.remove(a.MLEFT)
-        actions.remove(a.MRIGHT)
-    
-    # Forward/Back
-    if a.PFORWARD in actions and a.PBACK in actions:
-        actions.remove(a.PFORWARD)
-        actions.remove(a.PBACK)
-    if a.MFORWARD in actions and a.MBACK in actions:
-        actions.remove(a.MFORWARD)
-        actions.remove(a.MBACK)
-
-    # Turning
-    if a.PTURNL in actions and a.PTURNR in actions:
-        actions.remove(a.PTURNL)
-        actions.remove(a.PTURNR)
-    if a.MTURNL in actions and a.MTURNR in actions:
-        actions.remove(a.MTURNL)
-        actions.remove(a.MTURNR)
+    # Network outputs go through the bitmask tables instead, this is for action lists from anywhere else
+    for a, b in OPPOSING_ACTIONS:
+        if a in actions and b in actions:
+            actions.remove(a)
+            actions.remove(b)
 
     return actions
 
@@ -631,12 +1386,72 @@ def get_actions(inputs) -> list[int]:
 
 # To fix it from doing n-1 checkpoint numbers
 class OneIndexedCheckpointer(neat.Checkpointer):
-    def __init__(self, generation_interval=1, time_interval_seconds=None, filename_prefix="neat-checkpoint-"):
+    def __init__(self, generation_interval=1, time_interval_seconds=None, filename_prefix="neat-checkpoint-", writer: BackgroundCheckpointWriter = None):
         super().__init__(generation_interval, time_interval_seconds, filename_prefix)
+        self.writer = writer
 
     def save_checkpoint(self, config, population, species_set, generation):
         # Increment the generation number by 1 to make it 1-indexed
-        super().save_checkpoint(config, population, species_set, generation + 1)
+        generation += 1
+        if not self.writer:
+            super().save_checkpoint(config, population, species_set, generation)
+            return
+
+        filename = f"{self.filename_prefix}{generation}"
+        print(f"Saving checkpoint to {filename}")
+        # Only the pickling happens here, so we have a snapshot before training moves on.
+        # Same contents as neat.Checkpointer writes, so restore_checkpoint doesn't know the difference
+        data = pickle.dumps((generation, config, population, species_set, random.getstate()), protocol=pickle.HIGHEST_PROTOCOL)
+        self.writer.submit(filename, data)
+
+    def __getstate__(self):
+        # The species set keeps the reporters, so every checkpoint pickles its checkpointer too.
+        # The writer's thread and queue can't be pickled, and a restored one wouldn't be running anyway
+        state = self.__dict__.copy()
+        state["writer"] = None
+        return state
+
+class GenomeStoreCheckpointer(OneIndexedCheckpointer):
+    """Checkpoints into a GenomeStore, so each checkpoint only writes the genomes that changed.
+
+    Like OneIndexedCheckpointer, only the pickling happens on the training thread. Hashing,
+    writing, and pruning the store down to the checkpoints worth keeping happen on the writer's.
+
+    Args:
+        store (GenomeStore): Store for this run's checkpoints
+        filename_prefix (str): Which trainer, like TARNISHED_CHECKPOINT_PREFIX
+        writer (BackgroundCheckpointWriter): Where the store work goes. None does it all here
+        keep_last (int): Newest checkpoints of this trainer kept after every save. None never prunes
+        keep_every (int): Also keep every Kth generation's checkpoint. 0 keeps none extra
+    """
+    def __init__(self, store: GenomeStore, generation_interval=1, time_interval_seconds=None, filename_prefix="neat-checkpoint-",
+                 writer: BackgroundCheckpointWriter = None, keep_last: int = None, keep_every: int = 0):
+        super().__init__(generation_interval, time_interval_seconds, filename_prefix, writer)
+        self.store = store
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+
+    def save_checkpoint(self, config, population, species_set, generation):
+        # Increment the generation number by 1 to make it 1-indexed
+        generation += 1
+        # Same snapshot the pickle checkpoints take, the store unpickles it on the writer thread.
+        # Minus the species set's reporters, which the store doesn't keep and which only grow
+        species_set = copy.copy(species_set)
+        species_set.reporters = None
+        data = pickle.dumps((generation, config, population, species_set, random.getstate()), protocol=pickle.HIGHEST_PROTOCOL)
+        if self.writer:
+            self.writer.submit_call(f"{self.filename_prefix}{generation}", self._store_checkpoint, generation, data)
+        else:
+            self._store_checkpoint(generation, data)
+
+    def _store_checkpoint(self, generation: int, data: bytes):
+        new = self.store.save_pickled(self.filename_prefix, data)
+        message = f"Saved checkpoint {self.filename_prefix}{generation} ({new} new genomes)"
+        if self.keep_last is not None:
+            manifests, objects = self.store.prune(self.filename_prefix, self.keep_last, self.keep_every)
+            if manifests:
+                message += f", pruned {manifests} old checkpoints and {objects} unused objects"
+        print(message)
 
 def get_newest_checkpoint_file(files: list[str], prefix: str) -> tuple[str, int]:
     """Gets the most recent checkpoint from the previous run the resume the training.
@@ -662,7 +1477,8 @@ def get_newest_checkpoint_file(files: list[str], prefix: str) -> tuple[str, int]
             return int(postfix)
     
     file_details = ["", 0]
-    prefixed = [fn for fn in files if prefix in fn] # Files containing the prefix
+    # Files containing the prefix. Hidden ones are checkpoints still being written
+    prefixed = [fn for fn in files if prefix in fn and not fn.startswith(".")]
     for name in prefixed:
         gen = get_gen_num_from_name(name)
         if gen > file_details[1]:
@@ -675,45 +1491,69 @@ gen_best: int = None
 
 def draw_replay(game_data):
     """Specific draw function for replays
-    """
-    WIN.blit(BG, (0,0))
 
-    tarnished.draw(WIN)
-    margit.draw(WIN)
+    Only the parts of the window that changed get redrawn (see hud.py), so replays can run
+    well above REPLAY_TPS.
 
+    Args:
+        game_data: Header fields of the game being replayed (ReplayReader.header)
+    """
+    red = (255, 0, 0)
+    lines = []
     trainer = curr_trainer or game_data["trainer"]
     X = 160
     curr_y_offset = 200
     if trainer == trainer_str(Entities.TARNISHED):
-        draw_text(WIN, "Tarnished Fitness: " + str(game_data[f"{trainer_str(Entities.TARNISHED)}_fitness"]), X, curr_y_offset, font_size=40, color=(255, 0, 0))
+        lines.append(("Tarnished Fitness: " + str(game_data[f"{trainer_str(Entities.TARNISHED)}_fitness"]), X, curr_y_offset, 40, red))
     else:
-        draw_text(WIN, "Margit Fitness: " + str(game_data[f"{trainer_str(Entities.MARGIT)}_fitness"]), X, curr_y_offset, font_size=40, color=(255, 0, 0))
+        lines.append(("Margit Fitness: " + str(game_data[f"{trainer_str(Entities.MARGIT)}_fitness"]), X, curr_y_offset, 40, red))
     
     # Generation meta stats for best replays
     curr_y_offset += 25
     if gen_best:
-        draw_text(WIN, "Best (Generation): " + str(gen_best), X, curr_y_offset, font_size=30, color=(255, 0, 0))
+        lines.append(("Best (Generation): " + str(gen_best), X, curr_y_offset, 30, red))
         curr_y_offset += 25
     if gen_average:
-        draw_text(WIN, "Avg. (Generation): " + str(gen_average), X, curr_y_offset, font_size=30, color=(255, 0, 0))
+        lines.append(("Avg. (Generation): " + str(gen_average), X, curr_y_offset, 30, red))
         curr_y_offset += 25
     curr_y_offset += 25
 
 
-    draw_text(WIN, "Generation: " + str(curr_gen or game_data["generation"]), X, curr_y_offset, font_size=30, color=(255, 0, 0))
+    lines.append(("Generation: " + str(curr_gen or game_data["generation"]), X, curr_y_offset, 30, red))
     curr_y_offset += 50
-    draw_text(WIN, "Population: " + str(curr_pop or game_data["population"]), X, curr_y_offset, font_size=30, color=(255, 0, 0))
+    lines.append(("Population: " + str(curr_pop or game_data["population"]), X, curr_y_offset, 30, red))
     curr_y_offset += 100
 
-    draw_text(WIN, "Fitness Details: ", X, curr_y_offset, font_size=40, color=(255, 0, 0))
+    lines.append(("Fitness Details: ", X, curr_y_offset, 40, red))
     for detail, val in game_data[f"{trainer_str(Entities.MARGIT)}_fitness_details"].items():
         curr_y_offset += 25
-        draw_text(WIN, f"   {detail}: " + str(int(val)), X, curr_y_offset, font_size=30, color=(255, 0, 0))
+        lines.append((f"   {detail}: " + str(int(val)), X, curr_y_offset, 30, red))
 
-    pygame.display.update()
+    def draw_scene():
+        tarnished.draw(WIN)
+        margit.draw(WIN)
+
+    replay_hud.draw_frame(WIN, replay_scene_rects(), draw_scene, lines)
+
+
+def replay_scene_rects() -> list[pygame.Rect]:
+    """Everywhere the entities could draw this frame: around each of them, their daggers, and the health bars.
+    """
+    size = 2 * REPLAY_DIRTY_RADIUS
+    rects = [pygame.Rect(0, 0, WIDTH, REPLAY_HEALTH_BAR_BAND)]
+    for entity in (tarnished, margit):
+        rects.append(pygame.Rect(0, 0, size, size).move(entity.x - REPLAY_DIRTY_RADIUS, entity.y - REPLAY_DIRTY_RADIUS))
+    for dagger in getattr(margit, "daggers", ()):
+        rects.append(pygame.Rect(0, 0, size // 2, size // 2).move(dagger.x - size // 4, dagger.y - size // 4))
+    return rects
 
 
-def replay_game(game_data: dict):
+def replay_game(replay: ReplayReader):
+    """Play back a recorded game, pulling frames from the reader as they are shown.
+
+    Args:
+        replay (ReplayReader): Game to replay
+    """
     global tarnished
     global margit
     # Reset the npcs
@@ -722,12 +1562,18 @@ def replay_game(game_data: dict):
     tarnished.give_target(margit)
     margit.give_target(tarnished)
     
+    game_data = replay.header
+    replay_hud.invalidate()
+    # Deterministic games are rebuilt frame by frame instead of read back
+    log = game_data.get("action_log")
+    frames = resimulate(log) if log else replay
     time.sleep(0.2) # Give me time to stop pressing space before next game
     # Main game loop
     running = True
     clock = pygame.time.Clock()
-    for frame in game_data["game_states"]:
-        clock.tick(REPLAY_TPS)
+    for frame in frames:
+        # tick(0) never waits, so a speed of 0 is uncapped
+        clock.tick(REPLAY_TPS * args.replay_speed)
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
@@ -740,25 +1586,58 @@ def replay_game(game_data: dict):
             # Skip this game now.
             break
 
-        tarn = frame["tarnished"]["state"]
-        marg = frame["margit"]["state"]
+        if not log:
+            tarn = frame["tarnished"]["state"]
+            marg = frame["margit"]["state"]
 
-        # Update Tarnished
-        tarnished.set_state(tarn)
-        margit.set_state(marg)
+            # Update Tarnished
+            tarnished.set_state(tarn)
+            margit.set_state(marg)
         
         # Draw what has been updated
         draw_replay(game_data)
 
 
+def resimulate(log: dict):
+    """Rebuild a deterministic game by re-running Tarnished/Margit on its logged actions.
+
+    Moves the global tarnished/margit along one tick per iteration, starting from the
+    logged initial states, so they can be drawn in between.
+
+    Args:
+        log (dict): The game's "action_log"
+    """
+    outer_random_state = random.getstate()
+    random.seed(log["seed"])
+    tarnished.set_state(log["initial"]["tarnished"])
+    margit.set_state(log["initial"]["margit"])
+    try:
+        for tarnish_actions, margit_actions in action_log.iter_actions(log, TARNISHED_OUTPUT_MAP, MARGIT_OUTPUT_MAP):
+            # Show the state the actions were chosen from, same as a recorded game state
+            yield
+            try:
+                tarnished.do_actions(tarnish_actions)
+                margit.do_actions(margit_actions)
+                tarnished.update()
+                margit.update()
+            except (TarnishedDied, MargitDied):
+                break
+        # And where it all ended up
+        yield
+    finally:
+        random.setstate(outer_random_state)
+
+
 def replay_file(replay_file: str):
     global curr_trainer
     curr_trainer = None # We are replaying without intention, so dont highlight anyone
-    # Get our game data
-    with open(replay_file) as json_file:
-        game_data = json.load(json_file)
-    
-    replay_game(game_data)
+    if recording.is_archive(replay_file):
+        # A whole generation's archive, so play every game in it
+        for offset, _ in list(recording.iter_headers(replay_file)):
+            replay_game(ReplayReader(replay_file, offset))
+        return
+
+    replay_game(ReplayReader(replay_file))
 
 
 def replay_best_in_gen(gen: int, trainer: str, num_best = 0):
@@ -786,21 +1665,30 @@ def replay_best_in_gen(gen: int, trainer: str, num_best = 0):
 
     gen_dir = f"{GAMESTATES_PATH}/gen_{gen}/"
     runs = os.listdir(gen_dir)
-    gen_runs = [r for r in runs if trainer in r]
+    # Co-evolved games scored both trainers, so they count for either
+    gen_runs = [r for r in runs if (trainer in r or COEVOLUTION_TRAINER in r) and not recording.is_archive(r)]
+    archives = [r for r in runs if recording.is_archive(r)]
 
     # Start collecting info on runs of generation
     fitness_sum = 0
-    # (game's fitness for trainer, file name of game data)
-    runs_processed: list[tuple[int, str]] = []
+    # (game's fitness for trainer, (file name of game data, record offset for archives))
+    runs_processed: list[tuple[int, tuple[str, int]]] = []
     for run_file in gen_runs:
-        # Get run data
-        with open(f"{gen_dir}{run_file}") as json_file:
-            game_data = json.load(json_file)
+        # Get run data. Only the header, none of the frames get parsed here
+        game_data = ReplayReader(f"{gen_dir}{run_file}").header
         
         # Process data and keep a record of it for retrieval
         this_fit = int(game_data[f"{trainer}_fitness"])
         fitness_sum += this_fit
-        runs_processed.append((this_fit, run_file))
+        runs_processed.append((this_fit, (run_file, None)))
+    for archive in archives:
+        # Archives let us read the fitness without decoding any of the game states
+        for offset, header in recording.iter_headers(f"{gen_dir}{archive}"):
+            if header["trainer"] not in (trainer, COEVOLUTION_TRAINER):
+                continue
+            this_fit = int(header[f"{trainer}_fitness"])
+            fitness_sum += this_fit
+            runs_processed.append((this_fit, (archive, offset)))
     
     if not runs_processed:
         raise ValueError(f"No runs to process for trainer {trainer}")
@@ -815,17 +1703,19 @@ def replay_best_in_gen(gen: int, trainer: str, num_best = 0):
     # then working our way down.
     for _ in range(len(runs_processed[-num_best:])):
         # Get the next run to replay
-        fit, file = runs_processed.pop()
-        with open(f"{gen_dir}{file}") as json_file:
-            game_data = json.load(json_file)
-        curr_pop = game_data["population"]
+        fit, (file, offset) = runs_processed.pop()
+        replay = ReplayReader(f"{gen_dir}{file}", offset)
+        curr_pop = replay["population"]
 
         # Now replay the game
-        replay_game(game_data)
+        replay_game(replay)
 
 
 if __name__ == "__main__":
-    if replays:
+    if args.connect:
+        host, port = parse_address(args.connect)
+        print(f"Played {run_worker(host, port)} games for {args.connect}")
+    elif replays:
         print("We are replaying previous games")
         process_replays()
     else:
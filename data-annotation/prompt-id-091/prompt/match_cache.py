@@ -0,0 +1,124 @@
+"""Cache of match results, so unchanged pairings aren't played again.
+
+Elites carry over between generations untouched and reproduction can produce duplicate
+networks, so many pairings in a generation have already been played. A match is keyed on
+a hash of both networks' genes (ignoring genome keys, which change even when the network
+doesn't) plus the versions: GAME_VERSION, FITNESS_VERSION, MAX_UPDATES_PER_GAME and the
+early stop policies. Changing the game, the fitness function or when games get cut short
+never serves stale results.
+
+In deterministic mode a game's seed only comes from both networks and SEED (see
+main.match_seed), so SEED goes into the key too and a hit is exactly the result replaying
+that game would give, in whatever generation the pairing turns up again.
+"""
+from collections import OrderedDict
+import gzip
+import hashlib
+import os
+import pickle
+
+from genome_store import genome_digest
+
+CACHE_VERSION = 1
+
+
+class MatchCache:
+    """Bounded LRU cache of (tarnished fitness, margit fitness) per match.
+
+    Args:
+        max_entries (int): Matches kept before the least recently used ones are evicted
+        versions (tuple): Everything the results depend on besides the networks, like the game and fitness versions
+        path (str): File to persist the cache to across restarts. None keeps it in memory only
+    """
+
+    def __init__(self, max_entries: int, versions: tuple, path: str = None):
+        self.max_entries = max_entries
+        self.versions = tuple(versions)
+        self.path = path
+        self._entries = OrderedDict()
+        # Counted per generation and for the whole run
+        self.hits = 0
+        self.misses = 0
+        self.total_hits = 0
+        self.total_misses = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    def key(self, genome_tarnished, genome_margit, seed: int = None) -> str:
+        """Key of a match between two genomes.
+
+        Args:
+            genome_tarnished (neat.DefaultGenome): Tarnished's genome
+            genome_margit (neat.DefaultGenome): Margit's genome
+            seed (int): In deterministic mode, what the game's seed comes from besides the networks (SEED)
+
+        Returns:
+            str: Hex sha256 digest
+        """
+        h = hashlib.sha256(repr(self.versions).encode())
+        h.update(genome_digest(genome_tarnished, include_key=False).encode())
+        h.update(genome_digest(genome_margit, include_key=False).encode())
+        if seed is not None:
+            h.update(repr(seed).encode())
+        return h.hexdigest()
+
+    def get(self, key: str):
+        """Cached result of a match, counting the hit or miss.
+
+        Returns:
+            tuple[int, int]: <tarnished fitness, margit fitness>, or None if it hasn't been played
+        """
+        result = self._entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key: str, result: tuple):
+        self._entries[key] = tuple(result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def end_generation(self) -> tuple[int, int]:
+        """Reset the per generation counters.
+
+        Returns:
+            tuple[int, int]: <hits, misses> of the generation that just finished
+        """
+        counts = self.hits, self.misses
+        self.total_hits += self.hits
+        self.total_misses += self.misses
+        self.hits = self.misses = 0
+        return counts
+
+    def __len__(self):
+        return len(self._entries)
+
+    ### Persistence ###
+
+    def save(self):
+        """Write the cache to its path, atomically. Does nothing for in memory caches.
+        """
+        if not self.path:
+            return
+        directory, name = os.path.split(self.path)
+        tmp_path = os.path.join(directory, f".{name}.tmp")
+        with gzip.open(tmp_path, "wb", compresslevel=5) as f:
+            pickle.dump((CACHE_VERSION, self.versions, list(self._entries.items())), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        try:
+            with gzip.open(self.path) as f:
+                cache_version, versions, entries = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError) as e:
+            print(f"Ignoring unreadable match cache {self.path}: {e}")
+            return
+        # Results from another game, fitness version or stalemate rule are worthless, so start over
+        if cache_version != CACHE_VERSION or versions != self.versions:
+            return
+        for key, result in entries[-self.max_entries:]:
+            self._entries[key] = result
@@ -0,0 +1,108 @@
+"""Network inputs for both sides, written into reusable buffers.
+
+Both networks see the same eight numbers per tick, just from opposite points of view:
+
+    TARNISHED_INPUT_MAP                 MARGIT_INPUT_MAP
+    0 X Position                        0 X Position
+    1 Y Position                        1 Y Position
+    2 Current Angle                     2 Current Angle
+    3 Margit X                          3 Tarnished X
+    4 Margit Y                          4 Tarnished Y
+    5 Margit's angle                    5 Tarnished's angle
+    6 Margit's current action           6 Tarnished's current action
+    7 Time remaining in Margit action   7 Time remaining in Tarnished action
+
+ObservationBuffers reads every entity attribute once per tick and writes it into both
+sides' buffers, instead of two fresh tuples built out of get_state() dicts.
+BatchObservations does the same for many matches at once into (matches, 8) arrays.
+"""
+try:
+    import numpy as np
+except ImportError:
+    # Only batched observations need it, play_game doesn't
+    np = None
+
+OBSERVATION_SIZE = 8
+# Columns of the entity's own values, and of its opponent's
+SELF_X, SELF_Y, SELF_ANGLE, OTHER_X, OTHER_Y, OTHER_ANGLE, OTHER_ACTION, OTHER_TIME = range(OBSERVATION_SIZE)
+
+
+class ObservationBuffers:
+    """The two input vectors of one match, overwritten every tick.
+
+    The buffers are handed straight to net.activate, so read them before the next fill.
+    """
+
+    def __init__(self):
+        self.tarnished = [0.0] * OBSERVATION_SIZE
+        self.margit = [0.0] * OBSERVATION_SIZE
+
+    def fill(self, tarnished, margit) -> tuple[list, list]:
+        """Write this tick's inputs for both sides straight from the entities.
+
+        Args:
+            tarnished (Tarnished): Tarnished
+            margit (Margit): Margit
+
+        Returns:
+            tuple[list, list]: <tarnished inputs, margit inputs>
+        """
+        t = self.tarnished
+        m = self.margit
+        t[SELF_X] = m[OTHER_X] = tarnished.x
+        t[SELF_Y] = m[OTHER_Y] = tarnished.y
+        t[SELF_ANGLE] = m[OTHER_ANGLE] = tarnished.angle
+        m[SELF_X] = t[OTHER_X] = margit.x
+        m[SELF_Y] = t[OTHER_Y] = margit.y
+        m[SELF_ANGLE] = t[OTHER_ANGLE] = margit.angle
+        t[OTHER_ACTION] = margit.current_action or -1
+        m[OTHER_ACTION] = tarnished.current_action or -1
+        # get_state() reports this as time_in_action
+        t[OTHER_TIME] = margit.time_left_in_action
+        m[OTHER_TIME] = tarnished.time_left_in_action
+        return t, m
+
+
+class BatchObservations:
+    """Input arrays for many matches, overwritten every tick.
+
+    Args:
+        matches (int): Number of matches, one row each
+    """
+
+    def __init__(self, matches: int):
+        if np is None:
+            raise ImportError("BatchObservations needs numpy")
+        self.matches = matches
+        self.tarnished = np.zeros((matches, OBSERVATION_SIZE), dtype=np.float64)
+        self.margit = np.zeros((matches, OBSERVATION_SIZE), dtype=np.float64)
+
+    def fill_columns(self, t_x, t_y, t_angle, t_action, t_time, m_x, m_y, m_angle, m_action, m_time) -> tuple[np.ndarray, np.ndarray]:
+        """Write every match's inputs from per match arrays, like BatchSimulator keeps them.
+
+        Current actions are the values the networks see, -1 for none.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: <(matches, 8) tarnished inputs, (matches, 8) margit inputs>
+        """
+        t = self.tarnished
+        m = self.margit
+        t[:, SELF_X] = m[:, OTHER_X] = t_x
+        t[:, SELF_Y] = m[:, OTHER_Y] = t_y
+        t[:, SELF_ANGLE] = m[:, OTHER_ANGLE] = t_angle
+        m[:, SELF_X] = t[:, OTHER_X] = m_x
+        m[:, SELF_Y] = t[:, OTHER_Y] = m_y
+        m[:, SELF_ANGLE] = t[:, OTHER_ANGLE] = m_angle
+        t[:, OTHER_ACTION] = m_action
+        m[:, OTHER_ACTION] = t_action
+        t[:, OTHER_TIME] = m_time
+        m[:, OTHER_TIME] = t_time
+        return t, m
+
+    def fill_entities(self, matches) -> tuple[np.ndarray, np.ndarray]:
+        """Write the inputs of object engine matches, one row per (tarnished, margit) pair.
+        """
+        row = ObservationBuffers()
+        for i, (tarnished, margit) in enumerate(matches):
+            self.tarnished[i], self.margit[i] = row.fill(tarnished, margit)
+        return self.tarnished, self.margit
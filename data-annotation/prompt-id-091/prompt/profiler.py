@@ -0,0 +1,133 @@
+"""Per phase timings of training games, turned on with --profile.
+
+play_game ends each phase of a game with lap(), which adds the time since the previous
+lap to that phase:
+
+    PROFILER.start()            # start of the game
+    ...reset the entities...
+    PROFILER.lap("setup")
+    ...fill the network inputs...
+    PROFILER.lap("inputs")
+
+Every lap in play_game sits behind `if profiling:` on a local, so with profiling off a tick
+only pays for a few branches that aren't taken. Evaluation workers keep their own
+PhaseProfiler and send take() back with every game, which the main process merge()s, the
+same way early stop stats come back. ProfileReporter prints the generation's breakdown
+once it ends, after neat's StdOutReporter has printed its own.
+"""
+import time
+
+from neat.reporting import BaseReporter
+
+# In the order they happen, so the report reads like a game does
+PHASES = (
+    "networks",     # FeedForwardNetwork.create for both genomes
+    "setup",        # Resetting the entities and the game's bookkeeping
+    "display",      # clock.tick and the event queue, only when windowed
+    "inputs",       # Network inputs
+    "state",        # get_state() dicts
+    "activate",     # net.activate and turning outputs into actions
+    "actions",      # do_actions
+    "update",       # Entity updates
+    "draw",         # Drawing the frame, only when windowed
+    "fitness",      # Scoring ticks and finishing the fitness
+    "early_stop",   # Keeping states and checking early stop policies
+    "record",       # Writing the game out
+)
+
+
+class PhaseProfiler:
+    """Seconds spent per phase of the games played in this process since the last take().
+
+    Args:
+        enabled (bool): Whether callers should time anything at all. Checked by them, not here
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.games = 0
+        self.ticks = 0
+        # Wall time of the generations the games were played in, only known to the main process
+        self.wall = 0.0
+        self._last = 0.0
+
+    def start(self):
+        """Start timing the first phase from now.
+        """
+        self._last = time.perf_counter()
+
+    def lap(self, phase: str):
+        """End the current phase, the time since start() or the previous lap counts towards it.
+        """
+        now = time.perf_counter()
+        self.seconds[phase] = self.seconds.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def add_game(self, ticks: int):
+        self.games += 1
+        self.ticks += ticks
+
+    def add_wall(self, seconds: float):
+        self.wall += seconds
+
+    def merge(self, other: "PhaseProfiler"):
+        for phase, seconds in other.seconds.items():
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + seconds
+        self.games += other.games
+        self.ticks += other.ticks
+        self.wall += other.wall
+
+    def take(self) -> "PhaseProfiler":
+        """Hand over the timings so far and start fresh ones.
+        """
+        taken = PhaseProfiler(self.enabled)
+        taken.merge(self)
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.games = 0
+        self.ticks = 0
+        self.wall = 0.0
+        return taken
+
+    def report(self, workers: int = 1) -> str:
+        """Breakdown of where the time went, one line per phase that took any.
+
+        Args:
+            workers (int): Processes the games were spread over, to tell how busy they were kept
+        """
+        busy = sum(self.seconds.values())
+        wall = self.wall or busy
+        lines = [f"Profile: {self.games} games, {self.ticks} ticks in {wall:.2f}s, "
+                 f"{self.games / wall if wall else 0:.2f} games/s, {self.ticks / wall if wall else 0:.0f} ticks/s"]
+        if workers > 1:
+            capacity = wall * workers
+            lines.append(f"  {busy:.2f}s of games over {workers} workers ({100 * busy / capacity if capacity else 0:.0f}% busy)")
+        for phase, seconds in self.seconds.items():
+            if not seconds:
+                continue
+            per_tick = 1e6 * seconds / self.ticks if self.ticks else 0
+            lines.append(f"  {phase:<12} {seconds:8.3f}s {100 * seconds / busy:5.1f}% {per_tick:8.1f}us/tick")
+        if workers == 1 and self.wall > busy:
+            # Everything eval_genomes does around the games, like the match cache
+            lines.append(f"  {'(outside)':<12} {self.wall - busy:8.3f}s")
+        return "\n".join(lines)
+
+
+class ProfileReporter(BaseReporter):
+    """Prints the profiler's breakdown at the end of every generation that played games.
+
+    Coevolving populations both end the same generation, only the first one to get here
+    prints it since the second finds the timings already taken.
+
+    Args:
+        profiler (PhaseProfiler): Where the generation's timings are gathered
+        workers (int): Evaluation processes, 1 when games are played in this one
+    """
+
+    def __init__(self, profiler: PhaseProfiler, workers: int = 1):
+        self.profiler = profiler
+        self.workers = workers
+
+    def end_generation(self, config, population, species_set):
+        if self.profiler.games:
+            print(self.profiler.take().report(self.workers))
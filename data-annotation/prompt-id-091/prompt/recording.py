@@ -0,0 +1,417 @@
+"""Compact binary recordings of played games.
+
+One append-only archive per generation holds every game of that generation. Each game is
+a record laid out as:
+
+    fixed header    magic, format version, compression, header length, payload length
+    header          JSON of everything in game_result except "game_states", plus the column schema
+    payload         game states split into blocks of ticks, each block compressed on its own
+
+Inside a block the game states are stored by column: one fixed width array per scalar
+field of each entity (x, y, angle, health, ...), and a variable length section for lists
+(daggers, actions) holding a count per tick and then the flattened items. Anything whose
+type changes from tick to tick (weapons that are None when not swinging) falls back to a
+JSON string per tick.
+"""
+from argparse import ArgumentParser
+from array import array
+import fcntl
+import json
+import lzma
+import os
+import struct
+import sys
+import zlib
+
+FORMAT_VERSION = 1
+ARCHIVE_NAME = "games.frec"
+ARCHIVE_SUFFIX = ".frec"
+
+MAGIC = b"FREC"
+# magic, version, compression, header length, payload length
+RECORD_HEADER = struct.Struct("<4sHHIQ")
+
+COMPRESSIONS = {
+    None: 0,
+    "zlib": 1,
+    "lzma": 2,
+}
+_COMPRESSION_NAMES = {v: k for k, v in COMPRESSIONS.items()}
+
+DEFAULT_BLOCK_TICKS = 256
+
+# Column kinds
+_BOOL, _INT, _FLOAT, _NULLABLE_INT, _NULLABLE_FLOAT, _DICT, _LIST, _JSON = "b", "i", "f", "ni", "nf", "dict", "list", "json"
+_MISSING = object()
+
+
+### Schema ###
+
+def _json_key(key):
+    """The string json.dump would write for a dict key, so recordings read back like the JSON ones.
+    """
+    if isinstance(key, str):
+        return key
+    if key is True:
+        return "true"
+    if key is False:
+        return "false"
+    if key is None:
+        return "null"
+    if isinstance(key, int):
+        return int.__repr__(key)
+    return float.__repr__(key)
+
+
+def _normalise(value):
+    """Turns enums and tuples into the plain values JSON would have stored.
+    """
+    if isinstance(value, dict):
+        return {_json_key(k): _normalise(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalise(v) for v in value]
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    return value
+
+
+def _infer(values: list) -> dict:
+    """Work out how to store one field, given its value on every tick.
+    """
+    if values and all(isinstance(v, dict) for v in values):
+        fields = {}
+        for v in values:
+            for key in v:
+                fields.setdefault(key, None)
+        return {"kind": _DICT, "fields": {key: _infer([v.get(key, _MISSING) for v in values]) for key in fields}}
+
+    if values and all(isinstance(v, list) for v in values):
+        items = [item for v in values for item in v]
+        return {"kind": _LIST, "item": _infer(items) if items else {"kind": _JSON}}
+
+    present = [v for v in values if v is not None]
+    if any(v is _MISSING for v in values) or any(isinstance(v, (str, dict, list)) for v in present):
+        return {"kind": _JSON}
+    if present and all(isinstance(v, bool) for v in present):
+        return {"kind": _BOOL} if len(present) == len(values) else {"kind": _JSON}
+    if any(isinstance(v, bool) for v in present):
+        return {"kind": _JSON}
+    nullable = len(present) != len(values)
+    if all(isinstance(v, int) for v in present):
+        return {"kind": _NULLABLE_INT if nullable else _INT}
+    return {"kind": _NULLABLE_FLOAT if nullable else _FLOAT}
+
+
+### Encoding ###
+
+def _pack(typecode: str, values) -> bytes:
+    arr = array(typecode, values)
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _unpack(typecode: str, data: memoryview, offset: int, count: int) -> tuple[array, int]:
+    arr = array(typecode)
+    end = offset + count * arr.itemsize
+    arr.frombytes(data[offset:end])
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr, end
+
+
+def _encode_column(schema: dict, values: list, out: list):
+    kind = schema["kind"]
+    if kind == _DICT:
+        for key, field in schema["fields"].items():
+            _encode_column(field, [v.get(key, _MISSING) for v in values], out)
+    elif kind == _LIST:
+        out.append(_pack("I", [len(v) for v in values]))
+        _encode_column(schema["item"], [item for v in values for item in v], out)
+    elif kind == _BOOL:
+        out.append(_pack("B", values))
+    elif kind == _INT:
+        out.append(_pack("q", values))
+    elif kind in (_FLOAT, _NULLABLE_INT, _NULLABLE_FLOAT):
+        out.append(_pack("d", [float("nan") if v is None else v for v in values]))
+    else:
+        encoded = [b"" if v is _MISSING else json.dumps(v).encode() for v in values]
+        out.append(_pack("I", [len(e) for e in encoded]))
+        out.append(b"".join(encoded))
+
+
+def _decode_column(schema: dict, data: memoryview, offset: int, count: int) -> tuple[list, int]:
+    kind = schema["kind"]
+    if kind == _DICT:
+        columns = {}
+        for key, field in schema["fields"].items():
+            columns[key], offset = _decode_column(field, data, offset, count)
+        keys = list(columns)
+        return [{k: columns[k][i] for k in keys if columns[k][i] is not _MISSING} for i in range(count)], offset
+    if kind == _LIST:
+        lengths, offset = _unpack("I", data, offset, count)
+        items, offset = _decode_column(schema["item"], data, offset, sum(lengths))
+        values, start = [], 0
+        for length in lengths:
+            values.append(items[start:start + length])
+            start += length
+        return values, offset
+    if kind == _BOOL:
+        arr, offset = _unpack("B", data, offset, count)
+        return [bool(v) for v in arr], offset
+    if kind == _INT:
+        arr, offset = _unpack("q", data, offset, count)
+        return arr.tolist(), offset
+    if kind in (_FLOAT, _NULLABLE_INT, _NULLABLE_FLOAT):
+        arr, offset = _unpack("d", data, offset, count)
+        if kind == _FLOAT:
+            return arr.tolist(), offset
+        as_int = kind == _NULLABLE_INT
+        return [None if v != v else (int(v) if as_int else v) for v in arr], offset
+    lengths, offset = _unpack("I", data, offset, count)
+    values = []
+    for length in lengths:
+        values.append(_MISSING if length == 0 else json.loads(bytes(data[offset:offset + length])))
+        offset += length
+    return values, offset
+
+
+def _compress(data: bytes, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.compress(data, 6)
+    if compression == "lzma":
+        return lzma.compress(data)
+    return data
+
+
+def _decompress(data: bytes, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "lzma":
+        return lzma.decompress(data)
+    return data
+
+
+def encode_game(game_result: dict, compression: str = "zlib", block_ticks: int = DEFAULT_BLOCK_TICKS) -> bytes:
+    """Turn a finished game_result into one archive record.
+
+    Args:
+        game_result (dict): As built by play_game, including "game_states"
+        compression (str): None, "zlib" or "lzma"
+        block_ticks (int): How many ticks go into each independently compressed block
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression}, expected one of {list(COMPRESSIONS)}")
+
+    frames = _normalise(game_result.get("game_states", []))
+    schema = _infer(frames) if frames else {"kind": _DICT, "fields": {}}
+
+    blocks, payload = [], []
+    offset = 0
+    for start in range(0, len(frames), block_ticks):
+        chunk = frames[start:start + block_ticks]
+        out = []
+        _encode_column(schema, chunk, out)
+        block = _compress(b"".join(out), compression)
+        blocks.append([offset, len(block), len(chunk)])
+        payload.append(block)
+        offset += len(block)
+
+    header = {k: v for k, v in game_result.items() if k != "game_states"}
+    header["format"] = {"ticks": len(frames), "schema": schema, "blocks": blocks}
+    header_bytes = json.dumps(_normalise(header), separators=(",", ":")).encode()
+    payload_bytes = b"".join(payload)
+    fixed = RECORD_HEADER.pack(MAGIC, FORMAT_VERSION, COMPRESSIONS[compression], len(header_bytes), len(payload_bytes))
+    return fixed + header_bytes + payload_bytes
+
+
+def append_game(archive_path: str, game_result: dict, compression: str = "zlib") -> int:
+    """Append one game to a generation archive. Safe to call from several worker processes at once.
+
+    Returns:
+        int: Offset of the record within the archive
+    """
+    record = encode_game(game_result, compression)
+    while True:
+        with open(archive_path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # keep_records may have swapped in a new archive while we waited for the lock,
+                # and anything written to the old one would be lost
+                if os.fstat(f.fileno()).st_ino != os.stat(archive_path).st_ino:
+                    continue
+                offset = f.seek(0, os.SEEK_END)
+                f.write(record)
+                return offset
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+### Decoding ###
+
+def _read_record_header(f) -> tuple[int, str, dict, int]:
+    """Reads the header of the record at the current position, leaving the file at its payload.
+
+    Returns:
+        tuple: <version, compression, header, payload length>, or None at the end of the archive
+    """
+    fixed = f.read(RECORD_HEADER.size)
+    if not fixed:
+        return None
+    if len(fixed) < RECORD_HEADER.size:
+        raise ValueError(f"Truncated record header in {f.name}")
+    magic, version, compression, header_len, payload_len = RECORD_HEADER.unpack(fixed)
+    if magic != MAGIC:
+        raise ValueError(f"{f.name} is not a game archive (bad magic {magic!r})")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"{f.name} was written by a newer recording format (v{version})")
+    header = json.loads(f.read(header_len))
+    return version, _COMPRESSION_NAMES[compression], header, payload_len
+
+
+def iter_headers(archive_path: str):
+    """Go through every game in an archive without decoding any game states.
+
+    Yields:
+        tuple[int, dict]: <record offset, header> where the header holds every game_result field but game_states
+    """
+    with open(archive_path, "rb") as f:
+        while True:
+            offset = f.tell()
+            record = _read_record_header(f)
+            if record is None:
+                return
+            _, _, header, payload_len = record
+            f.seek(payload_len, os.SEEK_CUR)
+            yield offset, header
+
+
+def _decode_block(compressed: bytes, compression: str, schema: dict, ticks: int) -> list[dict]:
+    data = memoryview(_decompress(compressed, compression))
+    frames, _ = _decode_column(schema, data, 0, ticks)
+    return frames
+
+
+def read_header(archive_path: str, offset: int = 0) -> dict:
+    """Read one game's header (every game_result field but game_states) without touching its payload.
+    """
+    with open(archive_path, "rb") as f:
+        f.seek(offset)
+        _, _, header, _ = _read_record_header(f)
+    header.pop("format")
+    return header
+
+
+def iter_frames(archive_path: str, offset: int = 0):
+    """Yield one game's states a tick at a time, only ever holding a single block in memory.
+
+    Args:
+        archive_path (str): Archive to read from
+        offset (int): Record offset, from iter_headers or append_game
+    """
+    with open(archive_path, "rb") as f:
+        f.seek(offset)
+        _, compression, header, _ = _read_record_header(f)
+        payload_start = f.tell()
+        layout = header["format"]
+        for start, length, ticks in layout["blocks"]:
+            f.seek(payload_start + start)
+            yield from _decode_block(f.read(length), compression, layout["schema"], ticks)
+
+
+def read_game(archive_path: str, offset: int = 0) -> dict:
+    """Load one full game_result back out of an archive, in the same shape the JSON files have.
+
+    Args:
+        archive_path (str): Archive to read from
+        offset (int): Record offset, from iter_headers or append_game
+    """
+    with open(archive_path, "rb") as f:
+        f.seek(offset)
+        _, compression, header, payload_len = _read_record_header(f)
+        payload = f.read(payload_len)
+
+    layout = header.pop("format")
+    frames = []
+    for start, length, ticks in layout["blocks"]:
+        frames.extend(_decode_block(payload[start:start + length], compression, layout["schema"], ticks))
+    header["game_states"] = frames
+    return header
+
+
+def keep_records(archive_path: str, offsets) -> int:
+    """Rewrite an archive with only the records at the given offsets, copying them without decoding.
+
+    The new archive is moved into place atomically, so readers see either the old or the new one.
+    Holds the archive's lock throughout, so no game appended meanwhile gets lost.
+
+    Returns:
+        int: Bytes freed
+    """
+    offsets = sorted(set(offsets))
+    tmp_path = os.path.join(os.path.dirname(archive_path), f".{os.path.basename(archive_path)}.tmp")
+    with open(archive_path, "rb") as src:
+        fcntl.flock(src, fcntl.LOCK_EX)
+        try:
+            with open(tmp_path, "wb") as dst:
+                for offset in offsets:
+                    src.seek(offset)
+                    _, _, _, header_len, payload_len = RECORD_HEADER.unpack(src.read(RECORD_HEADER.size))
+                    src.seek(offset)
+                    dst.write(src.read(RECORD_HEADER.size + header_len + payload_len))
+                freed = src.seek(0, os.SEEK_END) - dst.tell()
+            # Still holding the lock, appenders that were waiting on it see the new archive
+            os.replace(tmp_path, archive_path)
+        finally:
+            fcntl.flock(src, fcntl.LOCK_UN)
+    return freed
+
+
+def is_archive(path: str) -> bool:
+    return str(path).endswith(ARCHIVE_SUFFIX)
+
+
+### Conversion ###
+
+def convert_json_dir(gen_dir: str, compression: str = "zlib", remove: bool = False) -> int:
+    """Pack every JSON game state in a generation directory into that generation's archive.
+
+    Args:
+        gen_dir (str): Directory like game_states/gen_12
+        compression (str): None, "zlib" or "lzma"
+        remove (bool): Delete the JSON files once they are safely in the archive
+
+    Returns:
+        int: Number of games converted
+    """
+    archive_path = os.path.join(gen_dir, ARCHIVE_NAME)
+    json_files = sorted(f for f in os.listdir(gen_dir) if f.endswith(".json"))
+    for file_name in json_files:
+        with open(os.path.join(gen_dir, file_name)) as json_file:
+            game_data = json.load(json_file)
+        append_game(archive_path, game_data, compression)
+    if remove:
+        for file_name in json_files:
+            os.unlink(os.path.join(gen_dir, file_name))
+    return len(json_files)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Convert JSON game states into per generation archives")
+    parser.add_argument("path", help="Game states directory holding gen_N directories, or a single gen_N directory")
+    parser.add_argument("--compression", default="zlib", choices=["none", "zlib", "lzma"])
+    parser.add_argument("--remove", action="store_true", default=False,
+                        help="Delete the JSON files after converting them")
+    args = parser.parse_args()
+
+    compression = None if args.compression == "none" else args.compression
+    gen_dirs = [args.path]
+    if not os.path.basename(os.path.normpath(args.path)).startswith("gen_"):
+        gen_dirs = [os.path.join(args.path, d) for d in sorted(os.listdir(args.path)) if d.startswith("gen_")]
+    for gen_dir in gen_dirs:
+        converted = convert_json_dir(gen_dir, compression, args.remove)
+        print(f"Converted {converted} games in {gen_dir}")
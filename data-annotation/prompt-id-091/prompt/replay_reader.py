@@ -0,0 +1,172 @@
+"""Streaming readers for recorded games.
+
+A ReplayReader gives the game's header fields (fitness, fitness details, generation,
+population, trainer, ...) without parsing any frames, and hands the frames out one at
+a time. Only a small window of the file is ever held in memory: one read chunk and one
+frame for JSON game states, one block of ticks for archives.
+"""
+import json
+
+import recording
+
+CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+class ReplayReader:
+    """Lazily reads one recorded game, either a JSON game state file or a record in a generation archive.
+
+    Args:
+        path (str): JSON game state file or .frec archive
+        offset (int): Record offset when path is an archive. Defaults to its first game
+    """
+
+    def __init__(self, path: str, offset: int = None):
+        self.path = path
+        self.offset = offset
+        self.is_archive = recording.is_archive(path)
+        self._header = None
+
+    @property
+    def header(self) -> dict:
+        """Every game_result field other than game_states. Doesn't parse any frames (when game_states is the last field).
+        """
+        if self._header is None:
+            if self.is_archive:
+                self._header = recording.read_header(self.path, self.offset or 0)
+            else:
+                stream = _JsonGameStream(self.path)
+                self._header = stream.read_header()
+                stream.close()
+        return self._header
+
+    def __getitem__(self, key):
+        return self.header[key]
+
+    def get(self, key, default=None):
+        return self.header.get(key, default)
+
+    def __iter__(self):
+        """Yield game states one tick at a time.
+        """
+        if self.is_archive:
+            yield from recording.iter_frames(self.path, self.offset or 0)
+            return
+
+        stream = _JsonGameStream(self.path)
+        try:
+            header = stream.read_header()
+            yield from stream.iter_frames()
+            # Anything written after game_states only shows up once we are past the frames
+            header.update(stream.read_rest())
+            self._header = header
+        finally:
+            stream.close()
+
+
+class _JsonGameStream:
+    """Incremental parser over a game_result JSON file that never loads the whole game_states list.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path)
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._at_frames = False
+        self._done = False
+
+    def close(self):
+        self._file.close()
+
+    def _fill(self) -> bool:
+        """Pull in another chunk, dropping what we have already consumed. False once the file runs out.
+        """
+        if self._eof:
+            return False
+        chunk = self._file.read(CHUNK_SIZE)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _next_char(self) -> str:
+        """Skip whitespace and return the next character without consuming it.
+        """
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError(f"Unexpected end of game state file {self._file.name}")
+
+    def _expect(self, chars: str) -> str:
+        char = self._next_char()
+        if char not in chars:
+            raise ValueError(f"Expected one of {chars!r} in {self._file.name}, found {char!r}")
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """Decode the next JSON value, reading more of the file until it is complete.
+        """
+        self._next_char()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number could continue into the next chunk, so make sure something follows it
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _fields(self, first: bool, stop_at_frames: bool) -> dict:
+        """Read key/value pairs of the top level object, until its end or the game_states key.
+        """
+        fields = {}
+        while True:
+            if not first and self._expect(",}") == "}":
+                self._done = True
+                return fields
+            first = False
+            key = self._value()
+            self._expect(":")
+            if key == "game_states" and stop_at_frames:
+                self._at_frames = True
+                return fields
+            fields[key] = self._value()
+
+    def read_header(self) -> dict:
+        self._expect("{")
+        if self._next_char() == "}":
+            self._pos += 1
+            self._done = True
+            return {}
+        return self._fields(first=True, stop_at_frames=True)
+
+    def iter_frames(self):
+        if not self._at_frames:
+            return
+        self._expect("[")
+        if self._next_char() == "]":
+            self._pos += 1
+        else:
+            while True:
+                yield self._value()
+                if self._expect(",]") == "]":
+                    break
+        self._at_frames = False
+
+    def read_rest(self) -> dict:
+        if self._done:
+            return {}
+        return self._fields(first=False, stop_at_frames=False)